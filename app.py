@@ -1,6 +1,6 @@
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, Request, WebSocket, WebSocketDisconnect
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse, JSONResponse, StreamingResponse
+from fastapi.responses import FileResponse, JSONResponse, StreamingResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
 import sqlite3
 from datetime import datetime, timedelta
@@ -11,20 +11,43 @@ from typing import Dict, List, Optional
 from fastapi.responses import StreamingResponse
 import os
 import socket
-from apriltag_detector import ArUcoStateDetector
+from apriltag_detector import ArUcoStateDetector, DETECTOR_PROFILES
 import cv2
 import numpy as np
 import time
 import asyncio
-import subprocess
-import sys
 from collections import defaultdict
 from models import SessionLocal, MachineState, CST
 import pytz
 import threading
+import telemetry
+from telemetry import Counter, Gauge, Histogram, timed
+from profiler import MAX_PROFILE_SECONDS, profile_in_progress, profile_process
+import executor
+from executor import run_camera, run_db, run_encode
+from camera_discovery import camera_discovery
+from history_cache import history_cache, to_epoch
+from live_state import live_state
+from state_stream import state_hub
+from ws_protocol import BINARY_SUBPROTOCOL, Frame, is_get_state, make_update, wants_binary
+from fleet_gateway import FleetStateFeed, gateway, merge_metrics, merge_states
+import replication
+from replication import collector, parse_batch
+from service_registry import service_registry
+from retention import clear_rollups, retention_engine, rollup_daily_totals, rollup_totals
+from partitioned_store import PARTITION_DIR, PartitionedStore
+from video_streams import VARIANT_WIDTHS, MosaicStream, video_streams
 
 app = FastAPI()
 
+# Pipeline instrumentation, exposed on /metrics
+CAPTURE_READ_SECONDS = Histogram('cnc_capture_read_seconds', 'Time spent in cap.read')
+STATE_SAVE_SECONDS = Histogram('cnc_state_save_seconds', 'Time spent writing a state change to the database')
+BROADCAST_SECONDS = Histogram('cnc_broadcast_seconds', 'Time spent sending a state change to all WebSocket clients')
+FRAMES_CAPTURED = Counter('cnc_frames_captured_total', 'Frames read from the camera')
+FRAMES_SKIPPED = Counter('cnc_frames_skipped_total', 'Captured frames not sent to the detector')
+STATE_CHANGES = Counter('cnc_state_changes_total', 'Detected machine state changes')
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -35,62 +58,11 @@ app.add_middleware(
 )
 
 def detect_available_cameras() -> list:
-    """Detect Logitech BRIO or first available camera using v4l2-ctl and OpenCV."""
-    max_devices = 40
-    brio_device = None
-    generic_device = None
-    print("\n===== ENVIRONMENT DIAGNOSTICS =====")
-    print(f"User ID: {os.getuid()}  Effective User ID: {os.geteuid()}")
-    print(f"Python version: {sys.version}")
-    print(f"Environment: {os.environ}")
-    print("Sleeping 5 seconds before camera detection...")
-    time.sleep(5)
-    print("Scanning for Logitech BRIO and available cameras...")
-    for i in range(max_devices):
-        dev = f"/dev/video{i}"
-        try:
-            print(f"\n--- Checking {dev} ---")
-            result = subprocess.run([
-                "v4l2-ctl", "--device", dev, "--all"
-            ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            print(f"v4l2-ctl output for {dev}:\n{result.stdout}\n{result.stderr}")
-            if "Logitech BRIO" in result.stdout:
-                print(f"Found Logitech BRIO at {dev}")
-                cap = cv2.VideoCapture(dev)
-                print(f"  cap.isOpened(): {cap.isOpened()}")
-                if cap.isOpened():
-                    ret, frame = cap.read()
-                    print(f"  ret from cap.read(): {ret}")
-                    if ret:
-                        print(f"  {dev} is a working Logitech BRIO video capture device!")
-                        cap.release()
-                        brio_device = dev
-                        break
-                    cap.release()
-        except Exception as e:
-            print(f"  Error checking {dev}: {e}")
-            continue
-    if brio_device:
-        return [brio_device]
-    # Fallback: return first working video device
-    for i in range(max_devices):
-        dev = f"/dev/video{i}"
-        print(f"\n--- Checking {dev} (generic fallback) ---")
-        cap = cv2.VideoCapture(dev)
-        print(f"  cap.isOpened(): {cap.isOpened()}")
-        if cap.isOpened():
-            ret, frame = cap.read()
-            print(f"  ret from cap.read(): {ret}")
-            if ret:
-                print(f"  {dev} is a working generic video capture device!")
-                cap.release()
-                generic_device = dev
-                break
-            cap.release()
-    if generic_device:
-        return [generic_device]
-    print("No working camera found.")
-    return []
+    """Return capture devices, Logitech BRIO first, from the cached discovery results."""
+    cameras = [camera['device'] for camera in camera_discovery.cameras()]
+    if not cameras:
+        print("No working camera found.")
+    return cameras
 
 # Default camera settings optimized for ArUco detection
 DEFAULT_CAMERA_SETTINGS = {
@@ -204,93 +176,91 @@ camera_id = None
 # Equipment name storage
 EQUIPMENT_NAME_FILE = "equipment_name.txt"
 
-# Service discovery
-SERVICE_REGISTRY_FILE = "data/service_registry.json"
-
-# Global variables
-current_state = 'IDLE'
-last_tag_id = None
-state_start_time = None
-latest_frame = None
-frame_lock = threading.Lock()
-
 # WebSocket connection manager
 class ConnectionManager:
     def __init__(self):
         self.active_connections: List[WebSocket] = []
-
-    async def connect(self, websocket: WebSocket):
-        await websocket.accept()
+        # Clients that negotiated the MessagePack subprotocol (see ws_protocol.py)
+        self.binary_connections: set = set()
+
+    async def connect(self, websocket: WebSocket) -> bool:
+        """Accept a client, in binary mode if it asked for it; returns whether it is binary."""
+        binary = wants_binary(websocket.scope.get("subprotocols", []))
+        if binary:
+            await websocket.accept(subprotocol=BINARY_SUBPROTOCOL)
+            self.binary_connections.add(websocket)
+        else:
+            await websocket.accept()
         self.active_connections.append(websocket)
+        return binary
 
     def disconnect(self, websocket: WebSocket):
         self.active_connections.remove(websocket)
+        self.binary_connections.discard(websocket)
 
     async def broadcast(self, message: dict):
-        for connection in self.active_connections:
-            await connection.send_json(message)
+        with BROADCAST_SECONDS.time():
+            # Binary clients share one encoded frame; this machine is id 0 on its own socket
+            frame = Frame.updates([make_update(0, message)]) if self.binary_connections else None
+            for connection in self.active_connections:
+                if connection in self.binary_connections:
+                    await connection.send_bytes(frame.binary())
+                else:
+                    await connection.send_json(message)
 
 manager = ConnectionManager()
 
-def get_service_registry() -> Dict:
-    """Get the current service registry."""
-    try:
-        if os.path.exists(SERVICE_REGISTRY_FILE):
-            with open(SERVICE_REGISTRY_FILE, 'r') as f:
-                return json.load(f)
-    except Exception:
-        pass
-    return {"services": []}
+# State changes reach WebSocket clients through the same hub as the event stream
+state_hub.add_listener(manager.broadcast)
 
-def save_service_registry(registry: Dict) -> None:
-    """Save the service registry."""
-    os.makedirs(os.path.dirname(SERVICE_REGISTRY_FILE), exist_ok=True)
-    with open(SERVICE_REGISTRY_FILE, 'w') as f:
-        json.dump(registry, f, indent=2)
+Gauge('cnc_websocket_connections', 'Connected WebSocket clients', lambda: len(manager.active_connections))
+Gauge('cnc_websocket_binary_connections', 'Connected WebSocket clients using MessagePack',
+      lambda: len(manager.binary_connections))
+Gauge('cnc_stream_subscribers', 'Connected /api/state/stream clients', state_hub.subscriber_count)
 
 @app.get("/api/discovery/register")
 async def register_service():
     """Register this service in the cluster."""
     try:
-        registry = get_service_registry()
-        service_info = {
+        return service_registry.heartbeat({
             "id": socket.gethostname(),
             "ip": get_ip(),
             "port": 8000,
-            "name": get_equipment_name(),
-            "last_seen": datetime.now().isoformat()
-        }
-        
-        # Update or add service
-        services = registry.get("services", [])
-        for i, service in enumerate(services):
-            if service["id"] == service_info["id"]:
-                services[i] = service_info
-                break
-        else:
-            services.append(service_info)
-        
-        registry["services"] = services
-        save_service_registry(registry)
-        return service_info
+            "name": get_equipment_name()
+        })
     except Exception as e:
         return JSONResponse(
             status_code=500,
             content={"error": str(e)}
         )
 
+def get_active_services() -> List[Dict]:
+    """Registered services whose last heartbeat is within the registry TTL."""
+    return service_registry.active()
+
+@app.post("/api/discovery/heartbeat")
+async def service_heartbeat(heartbeat: Dict):
+    """Register or refresh one service, or a batch of them under "services"."""
+    services = heartbeat.get("services", [heartbeat])
+    if not isinstance(services, list):
+        return JSONResponse(
+            status_code=400,
+            content={"error": "services must be a list"}
+        )
+    try:
+        updated = service_registry.heartbeat_many(services)
+    except ValueError as e:
+        return JSONResponse(
+            status_code=400,
+            content={"error": str(e)}
+        )
+    return {"accepted": len(updated), "ttl": service_registry.ttl}
+
 @app.get("/api/discovery/services")
 async def list_services():
     """List all registered services in the cluster."""
     try:
-        registry = get_service_registry()
-        # Filter out services that haven't been seen in the last 5 minutes
-        now = datetime.now()
-        active_services = [
-            service for service in registry.get("services", [])
-            if (now - datetime.fromisoformat(service["last_seen"])).total_seconds() < 300
-        ]
-        return {"services": active_services}
+        return {"services": get_active_services()}
     except Exception as e:
         return JSONResponse(
             status_code=500,
@@ -349,6 +319,7 @@ def get_ip():
 
 CST = pytz.timezone('America/Chicago')
 
+@timed(STATE_SAVE_SECONDS)
 def save_state_change(state: str, duration: float, description: str = None, tag_id: int = None):
     """Save a state change to the database.
     
@@ -358,17 +329,18 @@ def save_state_change(state: str, duration: float, description: str = None, tag_
         description: Optional description of the state
         tag_id: Optional tag ID associated with the state
     """
-    db = get_db()
+    db = get_write_db()
     cursor = db.cursor()
     try:
         # Only update previous state duration if duration > 0
         if duration > 0:
-            cursor.execute('''
-                UPDATE state_changes
-                SET duration = ?
-                WHERE id = (SELECT id FROM state_changes ORDER BY timestamp DESC LIMIT 1)
-            ''', (duration,))
-            db.commit()
+            cursor.execute('SELECT id FROM state_changes ORDER BY timestamp DESC LIMIT 1')
+            previous = cursor.fetchone()
+            if previous:
+                cursor.execute('UPDATE state_changes SET duration = ? WHERE id = ?', (duration, previous['id']))
+                replication.shipper.enqueue(db, previous['id'])
+                db.commit()
+                history_cache.update_duration(previous['id'], duration)
             print(f"[DB] Updated previous state duration to {duration}s")
         # Check last state in DB
         cursor.execute('SELECT state FROM state_changes ORDER BY timestamp DESC LIMIT 1')
@@ -382,7 +354,11 @@ def save_state_change(state: str, duration: float, description: str = None, tag_
             INSERT INTO state_changes (timestamp, state, description, tag_id, duration)
             VALUES (?, ?, ?, ?, ?)
         ''', (now_cst.isoformat(), state, description, tag_id, 0.0))
+        row_id = cursor.lastrowid
+        replication.shipper.enqueue(db, row_id)
         db.commit()
+        history_cache.append(row_id, now_cst.isoformat(), state, description, tag_id, 0.0)
+        replication.shipper.notify()
         print(f"[DB] Inserted new state: {state} at {now_cst.isoformat()}")
     except Exception as e:
         print(f"[DB] Error saving state change: {e}")
@@ -390,6 +366,51 @@ def save_state_change(state: str, duration: float, description: str = None, tag_
     finally:
         db.close()
 
+# Startup progress of each component, reported by /api/health
+server_started_at = time.time()
+startup_status = {
+    'database': {'status': 'pending'},
+    'camera': {'status': 'pending'}
+}
+
+async def start_component(name: str, runner, func):
+    """Run a blocking initialization function in a worker pool and record its outcome."""
+    start = time.perf_counter()
+    try:
+        ok = await runner(func)
+        startup_status[name] = {'status': 'ready' if ok is not False else 'failed'}
+    except Exception as e:
+        print(f"Error initializing {name}: {e}")
+        startup_status[name] = {'status': 'failed', 'error': str(e)}
+    startup_status[name]['startup_ms'] = round((time.perf_counter() - start) * 1000.0, 1)
+
+def on_cameras_changed(cameras: list):
+    """Open a newly plugged-in camera when monitoring has no working camera."""
+    if cameras and (detector is None or detector.cap is None or not detector.cap.isOpened()):
+        future = executor.camera_executor.submit(initialize_camera)
+        future.add_done_callback(lambda f: startup_status['camera'].update(status='ready') if f.result() else None)
+
+def init_database() -> bool:
+    replication.shipper.start()
+    retention_engine.start()
+    rows = history_cache.load(lambda: get_db(datetime.now() - timedelta(days=history_cache.days + 1)))
+    print(f"[DB] Cached {rows} state changes from the last {history_cache.days:g} days")
+    # Until the camera reports, the live state is the last one recorded
+    last_state = get_latest_state()
+    if last_state:
+        live_state.seed(last_state["state"], to_epoch(last_state["timestamp"]), last_state["tag_id"],
+                        last_state["description"] or "")
+    return True
+
+def start_camera() -> bool:
+    # Watch for cameras being plugged in or removed
+    camera_discovery.add_listener(on_cameras_changed)
+    camera_discovery.start()
+    if not initialize_camera():
+        print("Warning: Failed to initialize camera. The application will start without camera support.")
+        return False
+    return True
+
 @app.on_event("startup")
 async def startup_event():
     ip = get_ip()
@@ -398,60 +419,130 @@ async def startup_event():
     print(f"=== Server is running! Access it at: {url} ===")
     print("="*50 + "\n")
     
-    # Initialize camera on startup
-    if not initialize_camera():
-        print("Warning: Failed to initialize camera. The application will start without camera support.")
+    # The schema exists before the camera thread or any endpoint can write to it
+    init_db()
+
+    # Load the database caches and open the camera concurrently in the background,
+    # so the server accepts requests while hardware is still being probed
+    asyncio.create_task(start_component('database', run_db, init_database))
+    asyncio.create_task(start_component('camera', run_camera, start_camera))
     
-    # Start camera processing thread
+    # Start camera processing thread; it waits until the detector is ready
     import threading
-    camera_thread = threading.Thread(target=process_camera_feed, daemon=True)
+    camera_thread = threading.Thread(target=process_camera_feed, name="camera-feed", daemon=True)
     camera_thread.start()
+    
+    # Restore registered services from the last snapshot
+    service_registry.start()
+    
+    # Watch for handlers that block the event loop
+    asyncio.create_task(executor.monitor_loop_lag())
+
+    # Fan state changes out to WebSocket and event stream clients from this loop
+    state_hub.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    state_hub.stop()
+    await gateway.close()
+    replication.shipper.stop()
+    service_registry.stop()
+    retention_engine.stop()
+    camera_discovery.stop()
+    executor.shutdown()
 
 # Mount static files
 app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # Database setup
-def get_db():
+# With PARTITION_DIR set, state_changes is split into one database file per month
+partition_store = PartitionedStore(PARTITION_DIR, os.getenv('DATABASE_PATH', 'machine_states.db')) if PARTITION_DIR else None
+
+def get_db(start_time: Optional[datetime] = None, end_time: Optional[datetime] = None):
+    """
+    Open the database.
+
+    With partitioning, only the partitions overlapping start_time..end_time are
+    attached (all of them when no period is given).
+    """
     db_path = os.getenv('DATABASE_PATH', 'machine_states.db')
     db_dir = os.path.dirname(db_path)
     if db_dir and not os.path.exists(db_dir):
         os.makedirs(db_dir, exist_ok=True)
+    if partition_store is not None:
+        return partition_store.connect(start_time, end_time)
     db = sqlite3.connect(db_path)
     db.row_factory = sqlite3.Row
     return db
 
+def get_main_db():
+    """Open the main database (rollups, replication outbox) without attaching any partitions."""
+    if partition_store is not None:
+        return partition_store.connect_main()
+    return get_db()
+
+def get_history_db(first_id: Optional[int] = None):
+    """Open the database with state_changes readable from first_id on (all of it when None)."""
+    if partition_store is not None:
+        return partition_store.connect_from_id(first_id)
+    return get_db()
+
+def get_write_db():
+    """Open the database for recording state changes."""
+    if partition_store is not None:
+        return partition_store.connect_writer()
+    return get_db()
+
 def init_db():
-    db = get_db()
-    db.execute('''
-        CREATE TABLE IF NOT EXISTS state_changes (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            timestamp TEXT NOT NULL,
-            state TEXT NOT NULL,
-            description TEXT,
-            tag_id INTEGER,
-            duration REAL
-        )
-    ''')
+    db = get_main_db()
+    # Lets the retention engine hand freed pages back; only takes effect on a new database
+    db.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    # WAL lets dashboard queries in the DB pool read while the camera thread writes
+    db.execute('PRAGMA journal_mode=WAL')
+    if partition_store is None:
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS state_changes (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                timestamp TEXT NOT NULL,
+                state TEXT NOT NULL,
+                description TEXT,
+                tag_id INTEGER,
+                duration REAL
+            )
+        ''')
+    elif db.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'state_changes'").fetchone():
+        print(f"[DB] Warning: {partition_store.main_path} still has an unpartitioned state_changes table; "
+              f"move it with: python partitioned_store.py --db {partition_store.main_path} --dir {PARTITION_DIR}")
     db.commit()
-
-init_db()
+    db.close()
+    if partition_store is not None:
+        partition_store.current()
+    # Queue state changes for the central collector, if one is configured
+    replication.shipper.install(get_main_db, get_history_db)
+    # Rollups of transitions compacted by the retention engine
+    retention_engine.install(get_main_db, partition_store)
 
 # Helper function to get state counts for a time period
 def get_state_counts(start_time: datetime, end_time: datetime) -> Dict:
-    db = get_db()
-    cursor = db.cursor()
-    
-    # Get total duration for each state within the time period
-    cursor.execute('''
-        SELECT 
-            state,
-            SUM(duration) as total_duration
-        FROM state_changes
-        WHERE datetime(timestamp) BETWEEN datetime(?) AND datetime(?)
-        GROUP BY state
-    ''', (start_time.isoformat(), end_time.isoformat()))
-    
-    results = cursor.fetchall()
+    db = get_db(start_time, end_time)
+    try:
+        cursor = db.cursor()
+        
+        # Get total duration for each state within the time period
+        cursor.execute('''
+            SELECT 
+                state,
+                SUM(duration) as total_duration
+            FROM state_changes
+            WHERE datetime(timestamp) BETWEEN datetime(?) AND datetime(?)
+            GROUP BY state
+        ''', (start_time.isoformat(), end_time.isoformat()))
+        
+        results = cursor.fetchall()
+        # Older history may have been compacted into rollups
+        compacted = rollup_totals(db, 'state_changes', start_time, end_time)
+    finally:
+        db.close()
     
     # Initialize counts
     counts = {
@@ -465,9 +556,30 @@ def get_state_counts(start_time: datetime, end_time: datetime) -> Dict:
         state = row['state']
         if state in counts:
             counts[state] = float(row['total_duration'] or 0)
+    for state, total in compacted.items():
+        if state in counts:
+            counts[state] += total
     
     return counts
 
+def fetch_state_changes(start_time: datetime, end_time: datetime) -> list:
+    """Fetch all state changes within a time period."""
+    db = get_db(start_time, end_time)
+    try:
+        cursor = db.cursor()
+        cursor.execute('''SELECT * FROM state_changes WHERE datetime(timestamp) BETWEEN datetime(?) AND datetime(?)''', (start_time.isoformat(), end_time.isoformat()))
+        return cursor.fetchall()
+    finally:
+        db.close()
+
+def fetch_rollup_days(start_time: datetime, end_time: datetime) -> Dict:
+    """Per-day state totals of compacted history within a time period."""
+    db = get_db(start_time, end_time)
+    try:
+        return rollup_daily_totals(db, 'state_changes', start_time, end_time)
+    finally:
+        db.close()
+
 @app.get("/")
 async def root():
     return FileResponse("static/index.html")
@@ -490,18 +602,23 @@ async def get_metrics(period: str):
     else:
         return JSONResponse(status_code=400, content={"error": "Invalid period"})
 
-    state_counts = get_state_counts(start_time, now)
+    return await run_db(build_metrics, period, start_time, now)
+
+def build_metrics(period: str, start_time: datetime, now: datetime) -> Dict:
+    """Compute state totals, hourly/daily breakdowns and summary fields for a period."""
+    # Recent periods are served from the in-memory history cache
+    cached = history_cache.covers(start_time)
+    state_counts = history_cache.state_totals(start_time, now) if cached else get_state_counts(start_time, now)
     total_duration = sum(state_counts.values())
     percentages = {k: round((v / total_duration * 100) if total_duration > 0 else 0, 1) for k, v in state_counts.items()}
 
     # Hourly metrics for today
     hourly_metrics = None
-    if period == "today":
+    if period == "today" and cached:
+        hourly_metrics = history_cache.hourly_totals(start_time, now)
+    elif period == "today":
         hourly_metrics = {h: {"running_duration": 0, "idle_duration": 0, "error_duration": 0} for h in range(24)}
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute('''SELECT * FROM state_changes WHERE datetime(timestamp) BETWEEN datetime(?) AND datetime(?)''', (start_time.isoformat(), now.isoformat()))
-        rows = cursor.fetchall()
+        rows = fetch_state_changes(start_time, now)
         for row in rows:
             ts = datetime.fromisoformat(row['timestamp'])
             duration = float(row['duration'] or 0)
@@ -527,12 +644,11 @@ async def get_metrics(period: str):
 
     # Daily metrics for week/month/quarter/year
     daily_metrics = None
-    if period in ["week", "month", "quarter", "year"]:
+    if period in ["week", "month", "quarter", "year"] and cached:
+        daily_metrics = history_cache.daily_totals(start_time, now)
+    elif period in ["week", "month", "quarter", "year"]:
         daily_metrics = {}
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute('''SELECT * FROM state_changes WHERE datetime(timestamp) BETWEEN datetime(?) AND datetime(?)''', (start_time.isoformat(), now.isoformat()))
-        rows = cursor.fetchall()
+        rows = fetch_state_changes(start_time, now)
         for row in rows:
             ts = datetime.fromisoformat(row['timestamp'])
             day = ts.date().isoformat()
@@ -544,6 +660,12 @@ async def get_metrics(period: str):
                 daily_metrics[day]['idle_duration'] += float(row['duration'] or 0)
             elif row['state'] == 'ERROR':
                 daily_metrics[day]['error_duration'] += float(row['duration'] or 0)
+        # Add days that were compacted into rollups
+        for day, totals in fetch_rollup_days(start_time, now).items():
+            if day not in daily_metrics:
+                daily_metrics[day] = {"running_duration": 0, "idle_duration": 0, "error_duration": 0, "efficiency": 0}
+            for state in ('RUNNING', 'IDLE', 'ERROR'):
+                daily_metrics[day][f'{state.lower()}_duration'] += totals.get(state, 0)
         # Calculate efficiency for each day
         for day, metrics in daily_metrics.items():
             total = metrics['running_duration'] + metrics['idle_duration'] + metrics['error_duration']
@@ -597,17 +719,28 @@ async def get_events(period: str, state: str = "all", limit: int = 50):
     else:
         return JSONResponse(status_code=400, content={"error": "Invalid period"})
 
-    db = get_db()
-    cursor = db.cursor()
-    if state == "all":
-        cursor.execute('''
-            SELECT * FROM state_changes WHERE datetime(timestamp) BETWEEN datetime(?) AND datetime(?) ORDER BY timestamp DESC LIMIT ?
-        ''', (start_time.isoformat(), now.isoformat(), limit))
-    else:
-        cursor.execute('''
-            SELECT * FROM state_changes WHERE datetime(timestamp) BETWEEN datetime(?) AND datetime(?) AND state = ? ORDER BY timestamp DESC LIMIT ?
-        ''', (start_time.isoformat(), now.isoformat(), state.upper(), limit))
-    rows = cursor.fetchall()
+    return await run_db(query_events, start_time, now, state, limit)
+
+def query_events(start_time: datetime, end_time: datetime, state: str = "all", limit: int = 50) -> List[Dict]:
+    """Fetch the most recent state changes within a time period, optionally filtered by state."""
+    if history_cache.covers(start_time):
+        rows = history_cache.events(start_time, end_time, None if state == "all" else state.upper(), limit,
+                                    newest_first=True)
+        return [row.to_dict() for row in rows]
+    db = get_db(start_time, end_time)
+    try:
+        cursor = db.cursor()
+        if state == "all":
+            cursor.execute('''
+                SELECT * FROM state_changes WHERE datetime(timestamp) BETWEEN datetime(?) AND datetime(?) ORDER BY timestamp DESC LIMIT ?
+            ''', (start_time.isoformat(), end_time.isoformat(), limit))
+        else:
+            cursor.execute('''
+                SELECT * FROM state_changes WHERE datetime(timestamp) BETWEEN datetime(?) AND datetime(?) AND state = ? ORDER BY timestamp DESC LIMIT ?
+            ''', (start_time.isoformat(), end_time.isoformat(), state.upper(), limit))
+        rows = cursor.fetchall()
+    finally:
+        db.close()
     events = []
     for row in rows:
         events.append({
@@ -619,30 +752,40 @@ async def get_events(period: str, state: str = "all", limit: int = 50):
         })
     return events
 
+def get_latest_state():
+    """Fetch the most recent state change, or None if there is none."""
+    # The newest partition holds the latest state, whenever it started
+    db = get_db(datetime.now())
+    try:
+        cursor = db.cursor()
+        cursor.execute('''
+            SELECT * FROM state_changes
+            ORDER BY timestamp DESC
+            LIMIT 1
+        ''')
+        return cursor.fetchone()
+    finally:
+        db.close()
+
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await manager.connect(websocket)
+    binary = await manager.connect(websocket)
     try:
+        if binary:
+            await Frame.hello([[0, socket.gethostname(), get_equipment_name()]]).send(websocket, True)
         while True:
-            data = await websocket.receive_text()
-            if data == "get_state":
-                # Get the most recent state from the database
-                db = get_db()
-                cursor = db.cursor()
-                cursor.execute('''
-                    SELECT * FROM state_changes
-                    ORDER BY timestamp DESC
-                    LIMIT 1
-                ''')
-                last_state = cursor.fetchone()
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            if is_get_state(message):
+                # Serve the live state published by the camera pipeline
+                snapshot = live_state.get()
                 
-                if last_state:
-                    await websocket.send_json({
-                        "state": last_state["state"],
-                        "description": last_state["description"],
-                        "timestamp": last_state["timestamp"],
-                        "last_tag_id": last_state["tag_id"]
-                    })
+                if binary:
+                    state = snapshot.to_dict() if snapshot is not None else {"state": "IDLE"}
+                    await Frame.updates([make_update(0, state)]).send(websocket, True)
+                elif snapshot is not None:
+                    await websocket.send_json(snapshot.to_dict())
                 else:
                     await websocket.send_json({
                         "state": "IDLE",
@@ -653,23 +796,113 @@ async def websocket_endpoint(websocket: WebSocket):
     except WebSocketDisconnect:
         manager.disconnect(websocket)
 
+@app.get("/api/state/stream")
+async def stream_state(request: Request):
+    """
+    Server-Sent Events stream of state changes, with duration ticks in between.
+
+    Each state event carries its sequence number as the event id, so a reconnecting
+    EventSource resumes from Last-Event-ID without missing changes.
+    """
+    last_event_id = request.headers.get("last-event-id") or request.query_params.get("last_event_id")
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        last_event_id = None
+    subscriber = state_hub.subscribe(last_event_id)
+
+    async def events():
+        try:
+            yield b"retry: 3000\n\n"
+            while True:
+                payload = await subscriber.get()
+                if payload is None:
+                    break
+                yield payload
+        finally:
+            state_hub.unsubscribe(subscriber)
+
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+fleet_feed = FleetStateFeed(gateway, get_active_services)
+
+@app.websocket("/ws/fleet")
+async def fleet_websocket(websocket: WebSocket):
+    """
+    Live state of every registered machine over one socket.
+
+    Sends a hello frame listing the machines, then batches of compact updates for
+    the machines whose state changed. Clients that request the MessagePack
+    subprotocol get binary frames, others the same arrays as JSON text.
+    """
+    binary = wants_binary(websocket.scope.get("subprotocols", []))
+    await websocket.accept(subprotocol=BINARY_SUBPROTOCOL if binary else None)
+    queue = fleet_feed.subscribe()
+
+    async def watch_disconnect():
+        # Clients only listen, so a disconnect is the only message expected
+        while (await websocket.receive())["type"] != "websocket.disconnect":
+            pass
+        fleet_feed.close(queue)
+
+    watcher = asyncio.create_task(watch_disconnect())
+    try:
+        while True:
+            frame = await queue.get()
+            if frame is None:
+                break
+            await frame.send(websocket, binary)
+    except (WebSocketDisconnect, RuntimeError):
+        pass
+    finally:
+        watcher.cancel()
+        fleet_feed.unsubscribe(queue)
+
+def delete_state_changes():
+    db = get_main_db()
+    try:
+        if partition_store is not None:
+            partition_store.clear()
+        else:
+            db.execute('DELETE FROM state_changes')
+        clear_rollups(db, 'state_changes')
+        replication.shipper.enqueue_clear(db)
+        db.commit()
+        history_cache.clear()
+    finally:
+        db.close()
+
 @app.post("/api/clear_data")
 async def clear_data():
     try:
-        db = get_db()
-        cursor = db.cursor()
-        cursor.execute('DELETE FROM state_changes')
-        db.commit()
+        await run_db(delete_state_changes)
         return {"status": "success", "message": "All data cleared successfully"}
     except Exception as e:
         return {"status": "error", "message": str(e)}
 
 @app.get("/api/export_states")
 async def export_states():
+    csv_data = await run_db(export_states_csv)
+    
+    # Create response with CSV file
+    response = StreamingResponse(
+        iter([csv_data]),
+        media_type="text/csv"
+    )
+    response.headers["Content-Disposition"] = "attachment; filename=state_changes.csv"
+    
+    return response
+
+def export_states_csv() -> str:
+    """Render all state changes as CSV, newest first."""
     db = get_db()
-    cursor = db.cursor()
-    cursor.execute('SELECT * FROM state_changes ORDER BY timestamp DESC')
-    rows = cursor.fetchall()
+    try:
+        cursor = db.cursor()
+        cursor.execute('SELECT * FROM state_changes ORDER BY timestamp DESC')
+        rows = cursor.fetchall()
+    finally:
+        db.close()
     
     # Create CSV string
     output = StringIO()
@@ -685,21 +918,28 @@ async def export_states():
             row['duration']
         ])
     
-    # Create response with CSV file
-    response = StreamingResponse(
-        iter([output.getvalue()]),
-        media_type="text/csv"
-    )
-    response.headers["Content-Disposition"] = "attachment; filename=state_changes.csv"
-    
-    return response
+    return output.getvalue()
 
 @app.get("/api/cameras")
-async def get_available_cameras():
+async def get_available_cameras(refresh: bool = False):
     """Get list of available cameras."""
     try:
-        cameras = detect_available_cameras()
-        return {"cameras": [{"id": i, "name": f"Camera {i}"} for i in cameras]}
+        if refresh:
+            cameras = await run_camera(camera_discovery.refresh)
+        else:
+            cameras = camera_discovery.cameras()
+        return {
+            "cameras": [
+                {
+                    "id": camera["device"],
+                    "name": f"{camera['name']} ({camera['device']})",
+                    "vendor_id": camera.get("vendor_id"),
+                    "product_id": camera.get("product_id")
+                }
+                for camera in cameras
+            ],
+            "discovery": camera_discovery.status()
+        }
     except Exception as e:
         return JSONResponse(
             status_code=500,
@@ -710,8 +950,8 @@ async def get_available_cameras():
 async def select_camera(camera_id: int):
     """Select a camera by ID."""
     try:
-        if initialize_camera(camera_id):
-            return {"status": "success", "camera_info": detector.get_camera_info()}
+        if await run_camera(initialize_camera, camera_id):
+            return {"status": "success", "camera_info": await run_camera(detector.get_camera_info)}
         return JSONResponse(
             status_code=400,
             content={"error": f"Could not initialize camera {camera_id}"}
@@ -731,7 +971,7 @@ async def get_camera_info():
                 status_code=400,
                 content={"error": "No camera initialized"}
             )
-        return detector.get_camera_info()
+        return await run_camera(detector.get_camera_info)
     except Exception as e:
         return JSONResponse(
             status_code=500,
@@ -748,11 +988,10 @@ def get_state_description(state: str) -> str:
 
 def process_camera_feed():
     """Process camera feed with optimized settings for ArUco detection."""
-    global current_state, last_tag_id, state_start_time, latest_frame
     frame_count = 0
     process_every_n_frames = 2  # Process every 2nd frame for better responsiveness
     
-    # Initialize state tracking
+    # Initialize state tracking; this thread owns it and publishes changes to live_state
     state_start_time = datetime.now()
     current_state = None
     last_tag_id = None
@@ -760,25 +999,32 @@ def process_camera_feed():
     while True:
         try:
             if detector is None or detector.cap is None or not detector.cap.isOpened():
-                time.sleep(1)
+                time.sleep(0.1)
                 continue
                 
-            ret, frame = detector.cap.read()
+            with CAPTURE_READ_SECONDS.time():
+                ret, frame = detector.cap.read()
             if not ret:
                 continue
+            capture_time = time.time()
+            FRAMES_CAPTURED.inc()
             # Store the latest frame for video streaming
-            with frame_lock:
-                latest_frame = frame.copy()
+            video_streams.publish(frame.copy())
             
             frame_count += 1
             if frame_count % process_every_n_frames != 0:
+                FRAMES_SKIPPED.inc()
                 continue
                 
             # Process frame with ArUco detector
-            state, tag_id, _ = detector.detect_state(frame)
+            result = detector.detect(frame, timestamp=capture_time)
+            state, tag_id = result.state, result.tag_id
+            video_streams.set_result(result)
+            live_state.record_frame(tag_id is not None)
             
             # Handle initial state or state change
             if current_state is None or state != current_state:
+                STATE_CHANGES.inc()
                 # If this is not the first state, save the previous state's duration
                 if current_state is not None:
                     duration = int((datetime.now() - state_start_time).total_seconds())
@@ -789,49 +1035,169 @@ def process_camera_feed():
                 current_state = state
                 state_start_time = datetime.now()
                 last_tag_id = tag_id
+                # Publishing also broadcasts the change to WebSocket and stream clients
+                live_state.publish(current_state, last_tag_id, get_state_description(current_state),
+                                   since=state_start_time.timestamp())
                 
                 # Save the new state with 0 duration (will be updated on next state change)
                 save_state_change(current_state, 0, get_state_description(current_state), tag_id)
                 print(f"[DB] Started new state {current_state}")
-                
-                # Broadcast state change to all connected clients
-                asyncio.run(manager.broadcast({
-                    'state': current_state,
-                    'last_tag_id': last_tag_id,
-                    'timestamp': datetime.now().isoformat()
-                }))
             
             time.sleep(0.01)  # Minimal sleep for better responsiveness
         except Exception as e:
             print(f"Error processing camera feed: {e}")
             time.sleep(1)
 
-def generate_frames():
-    """Generate camera frames for streaming with minimal lag."""
-    global latest_frame
-    while True:
-        try:
-            # Serve the latest frame from the detection loop
-            with frame_lock:
-                frame = latest_frame.copy() if latest_frame is not None else None
-            if frame is None:
-                time.sleep(0.01)
-                continue
-            # Get state, tag_id, and frame with bounding box
-            state, tag_id, frame = detector.detect_state(frame)
-            # Draw state information on frame
-            state_text = f"State: {state}"
-            if tag_id is not None:
-                state_text += f" (Tag: {tag_id})"
-            cv2.putText(frame, state_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-            # Convert frame to JPEG
-            ret, buffer = cv2.imencode('.jpg', frame)
-            frame_bytes = buffer.tobytes()
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
-        except Exception as e:
-            print(f"Error generating frame: {e}")
-            time.sleep(0.01)
+@app.get("/api/health")
+async def health():
+    """Report whether the server and each startup component are ready."""
+    components = {name: dict(info) for name, info in startup_status.items()}
+    components['camera_feed'] = {
+        'status': 'ready' if detector is not None and detector.cap is not None and detector.cap.isOpened() else 'unavailable'
+    }
+    statuses = [info['status'] for info in startup_status.values()]
+    snapshot = live_state.get()
+    if 'pending' in statuses:
+        status = 'starting'
+    elif all(s == 'ready' for s in statuses):
+        status = 'ok'
+    else:
+        status = 'degraded'
+    return {
+        "status": status,
+        "uptime_s": round(time.time() - server_started_at, 1),
+        "loop_lag_ms": round(executor.last_loop_lag * 1000.0, 1),
+        "components": components,
+        "history_cache": history_cache.stats(),
+        "live_state": snapshot.to_dict() if snapshot is not None else None,
+        "replication": replication.shipper.status(),
+        "service_registry": service_registry.stats(),
+        "state_stream": state_hub.stats(),
+        "retention": retention_engine.status(),
+        "partitions": partition_store.status() if partition_store is not None else None
+    }
+
+@app.get("/api/state")
+async def get_live_state():
+    """Get the current machine state from memory."""
+    snapshot = live_state.get()
+    if snapshot is None:
+        return JSONResponse(
+            status_code=503,
+            content={"error": "Machine state not available yet"}
+        )
+    return snapshot.to_dict()
+
+@app.get("/api/replication/status")
+async def replication_status():
+    """Report outbox progress on this box and, on a collector, what each box has shipped."""
+    try:
+        status = replication.shipper.status()
+        status["pending"] = await run_db(replication.shipper.pending)
+        return {
+            "shipper": status,
+            "collector": {"stats": collector.stats(), "nodes": await run_db(collector.nodes)}
+        }
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content={"error": str(e)}
+        )
+
+@app.post("/api/replication/ingest")
+async def replication_ingest(request: Request):
+    """Store a batch of state changes shipped by another box (collector role)."""
+    try:
+        node_id, log_id, events = parse_batch(await request.body(), request.headers.get("content-encoding"))
+    except ValueError as e:
+        return JSONResponse(
+            status_code=400,
+            content={"error": str(e)}
+        )
+    try:
+        acked_seq = await asyncio.wrap_future(collector.submit(node_id, log_id, events))
+        return {"acked_seq": acked_seq}
+    except Exception as e:
+        return JSONResponse(
+            status_code=500,
+            content={"error": str(e)}
+        )
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    """Expose pipeline metrics in Prometheus text format."""
+    return Response(content=telemetry.render(), media_type=telemetry.CONTENT_TYPE)
+
+FLEET_PERIODS = ("today", "week", "month", "quarter", "year")
+
+@app.get("/api/fleet/overview")
+async def fleet_overview(period: str = "today"):
+    """Plant-level metrics and the live state of every active machine, fetched concurrently."""
+    if period not in FLEET_PERIODS:
+        return JSONResponse(status_code=400, content={"error": "Invalid period"})
+    services = get_active_services()
+    metrics, states = await asyncio.gather(
+        gateway.fan_out(services, f"/api/metrics/{period}"),
+        gateway.fan_out(services, "/api/state")
+    )
+    overview = merge_metrics(metrics)
+    overview["states"] = merge_states(states)
+    for machine, state in zip(overview["machines"], states):
+        machine["live_state"] = state["data"]
+    overview["period"] = period
+    return overview
+
+@app.get("/api/fleet/metrics/{period}")
+async def fleet_metrics(period: str):
+    """Metrics of every active machine, merged into plant totals."""
+    if period not in FLEET_PERIODS:
+        return JSONResponse(status_code=400, content={"error": "Invalid period"})
+    merged = merge_metrics(await gateway.fan_out(get_active_services(), f"/api/metrics/{period}"))
+    merged["period"] = period
+    return merged
+
+@app.get("/api/fleet/timeline")
+async def fleet_timeline(period: str = "today"):
+    """Timelines of every active machine."""
+    if period not in FLEET_PERIODS:
+        return JSONResponse(status_code=400, content={"error": "Invalid period"})
+    results = await gateway.fan_out(get_active_services(), f"/api/timeline?period={period}")
+    return {
+        "period": period,
+        "machines": [
+            {
+                "id": result["id"],
+                "name": result["name"],
+                "status": result["status"],
+                "latency_ms": result["latency_ms"],
+                "error": result.get("error"),
+                "timeline": result["data"]
+            }
+            for result in results
+        ]
+    }
+
+@app.get("/api/admin/profile")
+async def profile(seconds: float = 10.0, interval_ms: float = 5.0, slow_callback_ms: float = 20.0, format: str = "json"):
+    """Sample all threads for a bounded time and report hot stacks and event-loop lag."""
+    if not 0 < seconds <= MAX_PROFILE_SECONDS:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"seconds must be between 0 and {MAX_PROFILE_SECONDS:g}"}
+        )
+    if format not in ("json", "collapsed"):
+        return JSONResponse(status_code=400, content={"error": "format must be 'json' or 'collapsed'"})
+    if profile_in_progress():
+        return JSONResponse(status_code=409, content={"error": "A profile is already running"})
+
+    result = await profile_process(seconds, interval_ms / 1000.0, slow_callback_ms / 1000.0)
+    if format == "collapsed":
+        return Response(
+            content=result["collapsed"],
+            media_type="text/plain",
+            headers={"Content-Disposition": "attachment; filename=profile.collapsed"}
+        )
+    return result
 
 @app.get("/camera")
 async def camera_view():
@@ -839,11 +1205,79 @@ async def camera_view():
     return FileResponse("static/camera.html")
 
 @app.get("/video_feed")
-async def video_feed():
-    """Stream the camera feed."""
-    return StreamingResponse(generate_frames(),
+async def video_feed(size: str = "full"):
+    """Stream the camera feed as 'full', 'medium' or 'thumb'; each variant is encoded once per frame for all viewers."""
+    if size not in VARIANT_WIDTHS:
+        return JSONResponse(status_code=400, content={"error": f"Unknown size '{size}'. Choose one of: {', '.join(VARIANT_WIDTHS)}"})
+    return StreamingResponse(video_streams.stream(size),
                             media_type="multipart/x-mixed-replace; boundary=frame")
 
+def snapshot_response(request: Request, size: str, overlay: bool):
+    """
+    Latest camera frame as a JPEG with an ETag for its frame sequence.
+
+    The image is encoded at most once per captured frame and variant; a request
+    whose If-None-Match matches the current frame gets 304 without any encoding.
+    """
+    if size not in VARIANT_WIDTHS:
+        return JSONResponse(status_code=400, content={"error": f"Unknown size '{size}'. Choose one of: {', '.join(VARIANT_WIDTHS)}"})
+    headers = {"Cache-Control": "no-cache"}
+    etag = video_streams.current_etag(size, overlay)
+    if etag is not None and etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=dict(headers, ETag=etag))
+    encoded = video_streams.jpeg(size, overlay)
+    if encoded is None:
+        return JSONResponse(status_code=503, content={"error": "No camera frame available"})
+    headers["ETag"] = video_streams.etag(encoded[0], size, overlay)
+    return Response(content=encoded[1], media_type="image/jpeg", headers=headers)
+
+@app.get("/api/camera/snapshot.jpg")
+def camera_snapshot(request: Request, size: str = "full", overlay: bool = False):
+    """Current still image of the camera, optionally scaled ('medium', 'thumb') and with the detection overlay."""
+    return snapshot_response(request, size, overlay)
+
+@app.get("/video_feed/frame.jpg")
+def video_frame(request: Request, size: str = "thumb"):
+    """Latest camera frame as a single JPEG, as shown on the video feed."""
+    return snapshot_response(request, size, True)
+
+async def collect_mosaic_tiles() -> List:
+    """Latest thumbnail of this machine and of every registered machine, fetched concurrently."""
+    services = get_active_services()
+    hostname = socket.gethostname()
+
+    def local_tile():
+        encoded = video_streams.jpeg("thumb")
+        return (get_equipment_name(), encoded[1] if encoded is not None else None)
+
+    if not any(service["id"] == hostname for service in services):
+        services = [{"id": hostname, "name": get_equipment_name()}] + services
+
+    async def tile(service):
+        if service["id"] == hostname:
+            return await run_encode(local_tile)
+        return (service.get("name") or service["id"],
+                await gateway.fetch_bytes(service, "/video_feed/frame.jpg?size=thumb"))
+
+    return list(await asyncio.gather(*(tile(service) for service in services)))
+
+mosaic_stream = MosaicStream(collect_mosaic_tiles)
+
+@app.get("/video_feed/mosaic")
+async def video_mosaic():
+    """Low-rate stream with the latest frame of every machine, composited and encoded once for all viewers."""
+    return StreamingResponse(mosaic_stream.stream(),
+                            media_type="multipart/x-mixed-replace; boundary=frame")
+
+def read_camera_properties() -> Dict:
+    """Read the current value of every configurable camera property."""
+    properties = {}
+    for prop in DEFAULT_CAMERA_SETTINGS.keys():
+        if hasattr(cv2, prop):
+            value = detector.cap.get(getattr(cv2, prop))
+            properties[prop] = value
+    return properties
+
 @app.get("/api/camera/properties")
 async def get_camera_properties():
     """Get available camera properties and their current values."""
@@ -854,18 +1288,42 @@ async def get_camera_properties():
         )
     
     try:
-        properties = {}
-        for prop in DEFAULT_CAMERA_SETTINGS.keys():
-            if hasattr(cv2, prop):
-                value = detector.cap.get(getattr(cv2, prop))
-                properties[prop] = value
-        return properties
+        return await run_camera(read_camera_properties)
     except Exception as e:
         return JSONResponse(
             status_code=500,
             content={"error": str(e)}
         )
 
+def apply_camera_properties(properties: dict) -> Optional[Dict]:
+    """Apply camera properties, persist them and return the values the camera reports, or None if saving failed."""
+    # Get current settings
+    current_settings = load_camera_settings()
+    
+    # Update settings with new values
+    for prop, value in properties.items():
+        if hasattr(cv2, prop):
+            prop_id = getattr(cv2, prop)
+            # Convert value to float if it's a string
+            if isinstance(value, str):
+                value = float(value)
+            success = detector.cap.set(prop_id, value)
+            if success:
+                current_settings[prop] = value
+            else:
+                print(f"Warning: Failed to set {prop} to {value}")
+    
+    # Save updated settings
+    if not save_camera_settings(current_settings):
+        return None
+    # Get actual current values from camera
+    actual_settings = {}
+    for prop in current_settings.keys():
+        if hasattr(cv2, prop):
+            value = detector.cap.get(getattr(cv2, prop))
+            actual_settings[prop] = value
+    return actual_settings
+
 @app.post("/api/camera/properties")
 async def update_camera_properties(properties: dict):
     """Update camera properties."""
@@ -876,31 +1334,8 @@ async def update_camera_properties(properties: dict):
         )
     
     try:
-        # Get current settings
-        current_settings = load_camera_settings()
-        
-        # Update settings with new values
-        for prop, value in properties.items():
-            if hasattr(cv2, prop):
-                prop_id = getattr(cv2, prop)
-                # Convert value to float if it's a string
-                if isinstance(value, str):
-                    value = float(value)
-                success = detector.cap.set(prop_id, value)
-                if success:
-                    current_settings[prop] = value
-                else:
-                    print(f"Warning: Failed to set {prop} to {value}")
-        
-        # Save updated settings
-        if save_camera_settings(current_settings):
-            # Get actual current values from camera
-            actual_settings = {}
-            for prop in current_settings.keys():
-                if hasattr(cv2, prop):
-                    value = detector.cap.get(getattr(cv2, prop))
-                    actual_settings[prop] = value
-            
+        actual_settings = await run_camera(apply_camera_properties, properties)
+        if actual_settings is not None:
             return {"status": "success", "settings": actual_settings}
         else:
             return JSONResponse(
@@ -925,8 +1360,16 @@ async def get_detector_settings():
     
     return {
         "movement_threshold": detector.movement_threshold,
+        "velocity_threshold": detector.get_velocity_threshold(),
+        "velocity_units": detector.velocity_units(),
+        "tag_size_mm": detector.tag_size_mm,
         "error_timeout": detector.error_timeout,
-        "state_change_delay": detector.state_change_delay
+        "state_change_delay": detector.state_change_delay,
+        "motion_prefilter": detector.motion_prefilter_enabled,
+        "tracking": detector.tracking_enabled,
+        "tracking_detect_interval": detector.tracking_detect_interval,
+        "profile": detector.profile,
+        "profiles": {name: dict(overrides) for name, overrides in DETECTOR_PROFILES.items()}
     }
 
 @app.post("/api/detector/settings")
@@ -938,13 +1381,35 @@ async def update_detector_settings(settings: dict):
             content={"error": "No detector initialized"}
         )
     
+    if "profile" in settings and settings["profile"] not in DETECTOR_PROFILES:
+        return JSONResponse(
+            status_code=400,
+            content={"error": f"Unknown profile '{settings['profile']}'. Choose one of: {', '.join(DETECTOR_PROFILES)}"}
+        )
+    
     try:
         if "movement_threshold" in settings:
             detector.movement_threshold = float(settings["movement_threshold"])
+        if "velocity_threshold" in settings:
+            value = settings["velocity_threshold"]
+            detector.velocity_threshold = float(value) if value is not None else None
+        if "tag_size_mm" in settings:
+            detector.tag_size_mm = float(settings["tag_size_mm"] or 0)
+            detector.position_history = []
         if "error_timeout" in settings:
             detector.error_timeout = float(settings["error_timeout"])
         if "state_change_delay" in settings:
             detector.state_change_delay = float(settings["state_change_delay"])
+        if "profile" in settings:
+            detector.set_profile(settings["profile"])
+        if "motion_prefilter" in settings:
+            detector.motion_prefilter_enabled = bool(settings["motion_prefilter"])
+            detector.reset_prefilter()
+        if "tracking" in settings:
+            detector.tracking_enabled = bool(settings["tracking"])
+            detector.reset_prefilter()
+        if "tracking_detect_interval" in settings:
+            detector.tracking_detect_interval = max(1, int(settings["tracking_detect_interval"]))
         return {"status": "success"}
     except Exception as e:
         return JSONResponse(
@@ -952,9 +1417,23 @@ async def update_detector_settings(settings: dict):
             content={"error": str(e)}
         )
 
+@app.get("/api/detector/stats")
+async def get_detector_stats():
+    """Get detector performance counters."""
+    if detector is None:
+        return JSONResponse(
+            status_code=400,
+            content={"error": "No detector initialized"}
+        )
+    
+    return {
+        "motion_prefilter": detector.get_prefilter_stats(),
+        "tracking": detector.get_tracking_stats()
+    }
+
 @app.get("/api/timeline")
 def get_timeline(period: str = "today"):
-    db = get_db()
+    db = None
     try:
         now = datetime.now(CST)
         # Calculate start and end times based on period
@@ -983,11 +1462,15 @@ def get_timeline(period: str = "today"):
         if end_time.tzinfo is None:
             end_time = CST.localize(end_time)
 
-        cursor = db.cursor()
-        cursor.execute('''
-            SELECT * FROM state_changes WHERE datetime(timestamp) BETWEEN datetime(?) AND datetime(?) ORDER BY timestamp ASC
-        ''', (start_time.isoformat(), end_time.isoformat()))
-        events = cursor.fetchall()
+        if history_cache.covers(start_time):
+            events = history_cache.events(start_time, end_time)
+        else:
+            db = get_db(start_time, end_time)
+            cursor = db.cursor()
+            cursor.execute('''
+                SELECT * FROM state_changes WHERE datetime(timestamp) BETWEEN datetime(?) AND datetime(?) ORDER BY timestamp ASC
+            ''', (start_time.isoformat(), end_time.isoformat()))
+            events = cursor.fetchall()
 
         result = []
         last_end_time = start_time
@@ -1036,7 +1519,8 @@ def get_timeline(period: str = "today"):
                 })
         return JSONResponse(content=result)
     finally:
-        db.close()
+        if db is not None:
+            db.close()
 
 if __name__ == '__main__':
     import uvicorn
@@ -4,24 +4,102 @@ import asyncio
 from datetime import datetime
 from models import MachineState, SessionLocal, CST
 import math
+import os
 import time
-from typing import Optional, List, Tuple
+from typing import NamedTuple, Optional, List, Tuple
 import logging
+from replay import ReplaySource, is_replay_source
+from telemetry import Counter, Histogram, timed
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Hot-path instrumentation, exposed on /metrics
+CVT_COLOR_SECONDS = Histogram('cnc_cvtcolor_seconds', 'Time spent converting frames to grayscale')
+DETECT_MARKERS_SECONDS = Histogram('cnc_detect_markers_seconds', 'Time spent in ArUco detectMarkers')
+UPDATE_STATE_SECONDS = Histogram('cnc_update_state_seconds', 'Time spent in the state transition logic')
+FRAMES_DETECTED = Counter('cnc_frames_detected_total', 'Frames run through marker detection')
+PREFILTER_SKIPPED_FRAMES = Counter('cnc_prefilter_skipped_frames_total',
+                                   'Frames where the motion pre-filter reused the last detection')
+TRACK_SECONDS = Histogram('cnc_track_seconds', 'Time spent tracking tag corners with optical flow')
+FRAMES_TRACKED = Counter('cnc_frames_tracked_total', 'Frames where optical flow replaced marker detection')
+TRACKS_LOST = Counter('cnc_tracks_lost_total', 'Optical flow tracks dropped for poor quality')
+
+# DetectorParameters overrides per profile; 'balanced' keeps the OpenCV defaults.
+# The adaptive-threshold window sweep runs one thresholding pass per window size,
+# so it is the main lever for detect time.
+DETECTOR_PROFILES = {
+    'fast': {
+        'adaptiveThreshWinSizeMin': 5,
+        'adaptiveThreshWinSizeMax': 21,
+        'adaptiveThreshWinSizeStep': 16,  # Two threshold passes instead of three
+        'minMarkerPerimeterRate': 0.05,   # Ignore tiny candidates
+        'maxMarkerPerimeterRate': 2.0,
+        'polygonalApproxAccuracyRate': 0.05,
+        'perspectiveRemovePixelPerCell': 3,
+        'cornerRefinementMethod': 0       # CORNER_REFINE_NONE
+    },
+    'balanced': {},
+    'robust': {
+        'adaptiveThreshWinSizeMin': 3,
+        'adaptiveThreshWinSizeMax': 33,
+        'adaptiveThreshWinSizeStep': 5,   # Seven threshold passes for uneven lighting
+        'minMarkerPerimeterRate': 0.01,   # Accept small / distant tags
+        'maxMarkerPerimeterRate': 4.0,
+        'perspectiveRemovePixelPerCell': 8,
+        'cornerRefinementMethod': 1       # CORNER_REFINE_SUBPIX
+    }
+}
+DEFAULT_DETECTOR_PROFILE = 'balanced'
+
+# Printed side length of the tags in millimetres; when set, tag speed is measured in mm/s
+TAG_SIZE_MM = float(os.getenv('TAG_SIZE_MM', '0'))
+# Speed above which a tag counts as moving when TAG_SIZE_MM is set (mm/s)
+VELOCITY_THRESHOLD_MM_S = float(os.getenv('VELOCITY_THRESHOLD_MM_S', '5'))
+# Processing rate movement_threshold (pixels per processed frame) was tuned at:
+# every second frame of a 30 fps camera
+MOVEMENT_REFERENCE_FPS = 15.0
+
+class DetectionResult(NamedTuple):
+    """What the detector found in one frame; drawing it is left to overlay.py."""
+    state: str
+    tag_id: Optional[int]
+    timestamp: float  # Capture time of the frame (epoch seconds)
+    corners: tuple = ()  # Marker corners as returned by detectMarkers
+    ids: Optional[np.ndarray] = None
+    position: Optional[Tuple[float, float]] = None  # Centre of the first marker (pixels)
+    velocity: float = 0.0
+    velocity_units: str = 'px/s'
+    pending_state: Optional[str] = None
+
+def create_detector_parameters(profile: str = DEFAULT_DETECTOR_PROFILE):
+    """Create ArUco DetectorParameters for the given profile name."""
+    if profile not in DETECTOR_PROFILES:
+        raise ValueError(f"Unknown detector profile: {profile}")
+    
+    # DetectorParameters_create was removed in OpenCV 4.7.0
+    if hasattr(cv2.aruco, 'DetectorParameters_create'):
+        parameters = cv2.aruco.DetectorParameters_create()
+    else:
+        parameters = cv2.aruco.DetectorParameters()
+    for name, value in DETECTOR_PROFILES[profile].items():
+        setattr(parameters, name, value)
+    return parameters
+
 class ArUcoStateDetector:
-    def __init__(self, camera_id: Optional[str] = None, movement_threshold=0.5, error_timeout=3.0, state_change_delay=0.5):
+    def __init__(self, camera_id: Optional[str] = None, movement_threshold=0.5, error_timeout=3.0, state_change_delay=0.5,
+                 profile: str = DEFAULT_DETECTOR_PROFILE):
         """
         Initialize the ArUco state detector.
         
         Args:
             camera_id: Camera device ID (default: None)
-            movement_threshold: Minimum movement distance to consider as motion (in pixels)
+            movement_threshold: Minimum movement per frame at MOVEMENT_REFERENCE_FPS to consider as motion
+                (in pixels); used to derive velocity_threshold when that is not set
             error_timeout: Time without tag detection to trigger ERROR state (in seconds)
             state_change_delay: Time required in new state before registering the change (in seconds)
+            profile: DetectorParameters profile name, one of DETECTOR_PROFILES (default: 'balanced')
         """
         self.camera_id = camera_id
         self.movement_threshold = movement_threshold
@@ -34,14 +112,11 @@ class ArUcoStateDetector:
         self.movement_confidence_threshold = 4  # Number of frames that must show movement
         
         # Initialize ArUco detector
-        self.aruco_dict = cv2.aruco.Dictionary_get(cv2.aruco.DICT_4X4_50)
-        self.parameters = cv2.aruco.DetectorParameters_create()
-        
-        # Compatibility for OpenCV >= 4.7.0
+        self.aruco_dict = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50)
+        self.profile = None
+        self.parameters = None
         self.detector = None
-        version = tuple(map(int, cv2.__version__.split(".")[:2]))
-        if version >= (4, 7):
-            self.detector = cv2.aruco.ArucoDetector(self.aruco_dict, self.parameters)
+        self.set_profile(profile)
         
         # State tracking
         self.last_position = None
@@ -80,8 +155,13 @@ class ArUcoStateDetector:
         }
 
         # In __init__
-        self.position_history = []
+        self.position_history = []  # (timestamp, x, y, mm per pixel or None) of recent detections
         self.position_history_size = 5  # Number of frames to average over
+        # Movement is measured as tag speed from capture timestamps, so thresholds hold
+        # whatever the frame rate, decimation or dropped frames
+        self.velocity_threshold = None  # Speed that counts as movement (px/s, or mm/s with tag_size_mm)
+        self.tag_size_mm = TAG_SIZE_MM  # Printed tag side length; 0 keeps speeds in px/s
+        self.last_velocity = 0.0
         self.last_state_change_time = None
         self.last_movement_time = None
         self.min_running_hold_time = 10  # seconds: must be below threshold this long to switch to IDLE
@@ -89,12 +169,72 @@ class ArUcoStateDetector:
         self.movement_event_window = 10  # seconds: window to look for recent movement
         self.movement_events = []  # list of (timestamp, movement) for recent significant movements
 
+        # Motion pre-filter: reuse the last detection while the watched region is unchanged
+        self.motion_prefilter_enabled = True
+        self.motion_prefilter_downsample = 4  # Downsample factor for the full-frame check
+        self.motion_prefilter_pixel_threshold = 25  # Grey-level change that counts as a changed pixel
+        self.motion_prefilter_min_changed_pixels = 4  # Changed pixels needed to force a detection
+        self.motion_prefilter_roi_margin = 0.5  # ROI margin around the last tag (fraction of tag size)
+        self.motion_prefilter_max_skips = 30  # Force a full detection after this many reused frames
+        self._prefilter_reference = None  # (roi, reference image) from the last full detection
+        self._prefilter_result = None  # (corners, ids) from the last full detection
+        self._prefilter_skips = 0
+        self.prefilter_frames = 0
+        self.prefilter_skipped_frames = 0
+
+        # Hybrid tracking: follow the tag corners with pyramidal Lucas-Kanade optical flow
+        # between full detections
+        self.tracking_enabled = True
+        self.tracking_detect_interval = 10  # Run a full detection at least every N frames
+        self.tracking_max_error = 2.0  # Forward-backward flow error (pixels) that loses the track
+        self.tracking_max_scale_change = 0.25  # Largest change in tag size between frames
+        self.tracking_lk_params = dict(
+            winSize=(21, 21),
+            maxLevel=3,
+            criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.01)
+        )
+        self._track_gray = None  # Frame the tracked corners belong to
+        self._track_result = None  # (corners, ids) being tracked
+        self._track_frames = 0  # Frames tracked since the last full detection
+        self.last_markers_tracked = False  # Whether detect_markers' last markers came from optical flow only
+        self.tracked_frames = 0
+        self.lost_tracks = 0
+        self.detect_calls = 0
+
+        self.last_result: Optional[DetectionResult] = None
+
+    def set_profile(self, profile: str):
+        """Switch the DetectorParameters profile used for marker detection."""
+        parameters = create_detector_parameters(profile)
+        
+        # Compatibility for OpenCV >= 4.7.0
+        detector = None
+        version = tuple(map(int, cv2.__version__.split(".")[:2]))
+        if version >= (4, 7):
+            detector = cv2.aruco.ArucoDetector(self.aruco_dict, parameters)
+        
+        self.parameters = parameters
+        self.detector = detector
+        self.profile = profile
+        
+        # Cached detections were made with the old parameters
+        if hasattr(self, '_prefilter_result'):
+            self.reset_prefilter()
+
     def setup_camera(self):
         """Set up camera with optimal parameters for performance."""
         try:
             if self.cap is not None:
                 self.cap.release()
             
+            # Recorded video or image sequence instead of a live device
+            if is_replay_source(self.camera_id):
+                self.cap = ReplaySource(self.camera_id, realtime=True, loop=True)
+                if not self.cap.isOpened():
+                    raise RuntimeError(f"Failed to open recording {self.camera_id}")
+                logger.info(f"Replaying {self.camera_id} at {self.cap.get(cv2.CAP_PROP_FPS)} FPS")
+                return
+            
             # Try different camera backends
             backends = [
                 (cv2.CAP_V4L2, "V4L2"),
@@ -144,19 +284,65 @@ class ArUcoStateDetector:
             self.cap = None
             raise
 
-    def _calculate_movement(self, current_position):
-        """Calculate movement distance between current and last position."""
-        if self.last_position is None:
+    def get_velocity_threshold(self) -> float:
+        """Speed above which the tag counts as moving, in the units of _tag_velocity."""
+        if self.velocity_threshold is not None:
+            return self.velocity_threshold
+        if self.tag_size_mm:
+            return VELOCITY_THRESHOLD_MM_S
+        # Derived from the per-frame threshold so existing installations keep their tuning
+        return self.movement_threshold * MOVEMENT_REFERENCE_FPS
+
+    def _mm_per_pixel(self, marker_corners) -> Optional[float]:
+        """Scale from the detected tag's mean side length, or None when tag_size_mm is not set."""
+        if not self.tag_size_mm:
+            return None
+        side = float(np.mean(np.linalg.norm(marker_corners - np.roll(marker_corners, 1, axis=0), axis=1)))
+        return self.tag_size_mm / side if side > 0 else None
+
+    def _tag_velocity(self, timestamp: float, position, marker_corners=None) -> float:
+        """
+        Add a detection to position_history and return the tag's average speed over it.
+
+        Args:
+            timestamp: Capture time of the frame in epoch seconds
+            position: (x, y) tag centre in pixels
+            marker_corners: 4x2 corner array, used for the mm scale when tag_size_mm is set
+
+        Returns:
+            Path length over the history divided by the time it spans, in px/s (mm/s when
+            calibrated); 0.0 until two samples with increasing timestamps exist
+        """
+        if self.position_history and timestamp <= self.position_history[-1][0]:
+            # Duplicate or out-of-order frame: no time has passed, so no speed can be measured
+            return self.last_velocity
+        scale = self._mm_per_pixel(marker_corners) if marker_corners is not None else None
+        self.position_history.append((timestamp, position[0], position[1], scale))
+        if len(self.position_history) > self.position_history_size:
+            self.position_history.pop(0)
+
+        if len(self.position_history) < 2:
+            self.last_velocity = 0.0
             return 0.0
-        
+        distance = 0.0
+        for (_, x0, y0, s0), (_, x1, y1, s1) in zip(self.position_history, self.position_history[1:]):
+            step = math.hypot(x1 - x0, y1 - y0)
+            if self.tag_size_mm:
+                scales = [s for s in (s0, s1) if s is not None]
+                step *= sum(scales) / len(scales) if scales else 0.0
+            distance += step
+        elapsed = self.position_history[-1][0] - self.position_history[0][0]
+        self.last_velocity = distance / elapsed
+        return self.last_velocity
+
+    def _calculate_movement(self, current_position, timestamp: Optional[float] = None, marker_corners=None):
+        """Calculate the tag's speed from the current position and capture time."""
         try:
-            movement = math.sqrt(
-                (current_position[0] - self.last_position[0])**2 +
-                (current_position[1] - self.last_position[1])**2
-            )
+            movement = self._tag_velocity(time.time() if timestamp is None else timestamp,
+                                          current_position, marker_corners)
             
             # Update movement history
-            self.movement_history.append(movement > self.movement_threshold)
+            self.movement_history.append(movement > self.get_velocity_threshold())
             if len(self.movement_history) > self.movement_history_size:
                 self.movement_history.pop(0)
             
@@ -175,6 +361,184 @@ class ArUcoStateDetector:
             logger.error(f"Error checking movement consistency: {e}")
             return False
 
+    def _prefilter_region(self, gray, roi):
+        """Return the image the pre-filter compares: the tag ROI or a downsampled frame."""
+        if roi is not None:
+            x0, y0, x1, y1 = roi
+            return gray[y0:y1, x0:x1]
+        factor = self.motion_prefilter_downsample
+        size = (max(1, gray.shape[1] // factor), max(1, gray.shape[0] // factor))
+        return cv2.resize(gray, size, interpolation=cv2.INTER_AREA)
+
+    def _prefilter_roi(self, gray, corners):
+        """Bounding box (with margin) around all detected markers, or None for the full frame."""
+        if len(corners) == 0:
+            return None
+        points = np.concatenate([c.reshape(-1, 2) for c in corners])
+        x_min, y_min = points.min(axis=0)
+        x_max, y_max = points.max(axis=0)
+        margin = self.motion_prefilter_roi_margin * max(x_max - x_min, y_max - y_min)
+        height, width = gray.shape[:2]
+        x0 = max(0, int(x_min - margin))
+        y0 = max(0, int(y_min - margin))
+        x1 = min(width, int(x_max + margin) + 1)
+        y1 = min(height, int(y_max + margin) + 1)
+        if x1 <= x0 or y1 <= y0:
+            return None
+        return (x0, y0, x1, y1)
+
+    def _frame_unchanged(self, gray):
+        """
+        Check whether the frame matches the reference taken at the last full detection.
+
+        While a tag is visible only the region around it is compared at full resolution,
+        so any tag motion or occlusion above sensor noise forces a detection on the same
+        frame. Without a tag the whole frame is compared downsampled, so a tag appearing
+        anywhere is picked up immediately as well.
+        """
+        if self._prefilter_reference is None or self._prefilter_result is None:
+            return False
+        if self._prefilter_skips >= self.motion_prefilter_max_skips:
+            return False
+        shape, roi, reference = self._prefilter_reference
+        if gray.shape != shape:
+            return False
+        current = self._prefilter_region(gray, roi)
+        diff = cv2.absdiff(current, reference)
+        changed = np.count_nonzero(diff > self.motion_prefilter_pixel_threshold)
+        return changed < self.motion_prefilter_min_changed_pixels
+
+    def _track_corners(self, gray):
+        """
+        Follow the last known tag corners into this frame with optical flow.
+
+        Each corner is tracked forward and then back again; the track is only kept when
+        every corner returns to within tracking_max_error pixels of where it started
+        and the tag keeps roughly the same size, which catches occlusion, blur and
+        corners sliding off the tag.
+
+        Returns (corners, ids) like detectMarkers, or None if the track was lost.
+        """
+        corners, ids = self._track_result
+        previous = np.concatenate([c.reshape(-1, 2) for c in corners]).astype(np.float32).reshape(-1, 1, 2)
+        with TRACK_SECONDS.time():
+            forward, status, _ = cv2.calcOpticalFlowPyrLK(self._track_gray, gray, previous, None,
+                                                          **self.tracking_lk_params)
+            if forward is None or not status.all():
+                return None
+            backward, status, _ = cv2.calcOpticalFlowPyrLK(gray, self._track_gray, forward, None,
+                                                           **self.tracking_lk_params)
+        if backward is None or not status.all():
+            return None
+        if np.abs(previous - backward).reshape(-1, 2).max() > self.tracking_max_error:
+            return None
+
+        tracked = []
+        for i, old in enumerate(corners):
+            new = forward[i * 4:(i + 1) * 4].reshape(1, 4, 2)
+            old_size = cv2.arcLength(old.reshape(4, 2).astype(np.float32), True)
+            new_size = cv2.arcLength(new.reshape(4, 2), True)
+            if old_size <= 0 or abs(new_size / old_size - 1.0) > self.tracking_max_scale_change:
+                return None
+            tracked.append(new)
+        return tuple(tracked), ids
+
+    def _remember_markers(self, gray, corners, ids):
+        """Keep this frame and its markers as the reference for the pre-filter and the tracker."""
+        if self.motion_prefilter_enabled:
+            roi = self._prefilter_roi(gray, corners)
+            self._prefilter_reference = (gray.shape, roi, self._prefilter_region(gray, roi).copy())
+            self._prefilter_result = (corners, ids)
+        if self.tracking_enabled and len(corners) > 0:
+            self._track_gray = gray.copy()
+            self._track_result = (corners, ids)
+        else:
+            self._track_gray = None
+            self._track_result = None
+
+    def detect_markers(self, gray):
+        """
+        Detect ArUco markers, reusing the last result when the frame is static and
+        tracking the last markers with optical flow between full detections.
+
+        Returns (corners, ids) as produced by detectMarkers.
+        """
+        self.prefilter_frames += 1
+        FRAMES_DETECTED.inc()
+        # Only a real detection is reused, so a static scene still refreshes last_detection_time
+        if self.motion_prefilter_enabled and not self.last_markers_tracked and self._frame_unchanged(gray):
+            self._prefilter_skips += 1
+            self.prefilter_skipped_frames += 1
+            PREFILTER_SKIPPED_FRAMES.inc()
+            return self._prefilter_result
+
+        if (self.tracking_enabled and self._track_result is not None
+                and self._track_frames < self.tracking_detect_interval and gray.shape == self._track_gray.shape):
+            tracked = self._track_corners(gray)
+            if tracked is not None:
+                self._track_frames += 1
+                self.tracked_frames += 1
+                FRAMES_TRACKED.inc()
+                self._remember_markers(gray, *tracked)
+                self._prefilter_skips = 0
+                self.last_markers_tracked = True
+                return tracked
+            self.lost_tracks += 1
+            TRACKS_LOST.inc()
+
+        self.detect_calls += 1
+        with DETECT_MARKERS_SECONDS.time():
+            if self.detector is not None:
+                corners, ids, rejected = self.detector.detectMarkers(gray)
+            else:
+                corners, ids, rejected = cv2.aruco.detectMarkers(gray, self.aruco_dict, parameters=self.parameters)
+
+        self._remember_markers(gray, corners, ids)
+        self._prefilter_skips = 0
+        self._track_frames = 0
+        self.last_markers_tracked = False
+        return corners, ids
+
+    def _track_expired(self, current_time) -> bool:
+        """
+        Whether markers that only optical flow still follows have outlived the error timeout.
+
+        Only detectMarkers hits refresh last_detection_time, so a covered tag that flow
+        keeps following over static texture still turns into ERROR on time.
+        """
+        return (self.last_markers_tracked and self.last_detection_time is not None
+                and (current_time - self.last_detection_time).total_seconds() > self.error_timeout)
+
+    def reset_prefilter(self):
+        """Drop the pre-filter and tracking references so the next frame runs a full detection."""
+        self._prefilter_reference = None
+        self._prefilter_result = None
+        self._prefilter_skips = 0
+        self._track_gray = None
+        self._track_result = None
+        self._track_frames = 0
+
+    def get_prefilter_stats(self) -> dict:
+        """Get motion pre-filter counters."""
+        return {
+            "enabled": self.motion_prefilter_enabled,
+            "frames": self.prefilter_frames,
+            "skipped_frames": self.prefilter_skipped_frames,
+            "skip_rate": round(self.prefilter_skipped_frames / self.prefilter_frames, 4) if self.prefilter_frames else 0.0
+        }
+
+    def get_tracking_stats(self) -> dict:
+        """Get optical flow tracking counters."""
+        return {
+            "enabled": self.tracking_enabled,
+            "detect_interval": self.tracking_detect_interval,
+            "frames": self.prefilter_frames,
+            "tracked_frames": self.tracked_frames,
+            "detect_calls": self.detect_calls,
+            "lost_tracks": self.lost_tracks,
+            "track_rate": round(self.tracked_frames / self.prefilter_frames, 4) if self.prefilter_frames else 0.0
+        }
+
     def _get_description(self, state):
         """Get a random description for the current state."""
         try:
@@ -184,6 +548,7 @@ class ArUcoStateDetector:
             logger.error(f"Error getting state description: {e}")
             return f"State: {state}"
 
+    @timed(UPDATE_STATE_SECONDS)
     def _update_state(self, new_state, current_time):
         """
         Update state with enhanced state transition logic.
@@ -259,14 +624,14 @@ class ArUcoStateDetector:
             gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
             
             # Detect ArUco markers with optimized parameters
-            if self.detector is not None:
-                corners, ids, rejected = self.detector.detectMarkers(gray)
-            else:
-                corners, ids, rejected = cv2.aruco.detectMarkers(gray, self.aruco_dict, parameters=self.parameters)
+            corners, ids = self.detect_markers(gray)
             
             current_time = datetime.now(CST)
             movement = 0.0
             state_changed = False
+            if len(corners) > 0 and self._track_expired(current_time):
+                corners, ids = (), None
+                self.reset_prefilter()
 
             if len(corners) > 0:
                 # Use the first detected marker
@@ -278,41 +643,21 @@ class ArUcoStateDetector:
                     self.last_tag_id = int(ids[0][0])
                 
                 # Calculate movement
-                movement = self._calculate_movement(current_position)
+                movement = self._calculate_movement(current_position, current_time.timestamp(), marker_corners)
                 
                 # Determine new state based on movement
-                new_state = 'RUNNING' if movement > self.movement_threshold else 'IDLE'
+                new_state = 'RUNNING' if movement > self.get_velocity_threshold() else 'IDLE'
                 state_changed = self._update_state(new_state, current_time)
                 
                 self.last_position = current_position
-                self.last_detection_time = current_time
-
-                # Only draw debug visualization if window is visible
-                if cv2.getWindowProperty('Machine State Detection', cv2.WND_PROP_VISIBLE) >= 0:
-                    frame = cv2.aruco.drawDetectedMarkers(frame, corners, ids)
-                    center = (int(current_position[0]), int(current_position[1]))
-                    cv2.circle(frame, center, 5, (0, 255, 0), -1)
-                    
-                    state_text = f"State: {self.current_state}"
-                    if self.pending_state:
-                        state_text += f" (Pending: {self.pending_state})"
-                    cv2.putText(frame, state_text,
-                               (10, 30), cv2.FONT_HERSHEY_SIMPLEX,
-                               1, (0, 255, 0), 2)
-                    
-                    cv2.putText(frame, f"Movement: {movement:.1f}",
-                               (10, 60), cv2.FONT_HERSHEY_SIMPLEX,
-                               1, (0, 255, 0), 2)
+                if not self.last_markers_tracked:
+                    self.last_detection_time = current_time
             else:
                 if (self.last_detection_time is None or 
                     (current_time - self.last_detection_time).total_seconds() > self.error_timeout):
                     state_changed = self._update_state('ERROR', current_time)
                     self.last_position = None
-
-            # Show frame if window exists and debug mode is enabled
-            if cv2.getWindowProperty('Machine State Detection', cv2.WND_PROP_VISIBLE) >= 0:
-                cv2.imshow('Machine State Detection', frame)
-                cv2.waitKey(1)
+                    self.position_history = []
 
             # If state changed, add to queue for database processing
             if state_changed:
@@ -434,27 +779,38 @@ class ArUcoStateDetector:
             logger.error(f"Error getting camera info: {e}")
             return {"error": str(e)}
 
-    def detect_state(self, frame):
+    def detect(self, frame, timestamp: Optional[float] = None) -> DetectionResult:
         """
         Detect ArUco markers and determine machine state from a single frame.
-        Returns (state, tag_id, frame_with_markers)
+
+        Nothing is drawn on the frame; pass the result to overlay.draw_overlay for that.
+        
+        Args:
+            frame: BGR frame to process
+            timestamp: Capture time of the frame in epoch seconds (default: now)
+        
+        Returns:
+            DetectionResult, also kept as last_result
         """
+        now_ts = time.time() if timestamp is None else timestamp
         try:
             if frame is None:
-                return 'ERROR', None, None
+                self.last_result = DetectionResult('ERROR', None, now_ts, velocity_units=self.velocity_units())
+                return self.last_result
 
-            # Detect ArUco markers
-            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-            if self.detector is not None:
-                corners, ids, rejected = self.detector.detectMarkers(gray)
-            else:
-                corners, ids, rejected = cv2.aruco.detectMarkers(gray, self.aruco_dict, parameters=self.parameters)
+            # Detect ArUco markers (skipped when the frame is static)
+            with CVT_COLOR_SECONDS.time():
+                gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            corners, ids = self.detect_markers(gray)
             
-            current_time = datetime.now(CST)
+            current_time = datetime.fromtimestamp(now_ts, CST)
             avg_movement = 0.0
             tag_id = None
+            current_position = None
             state_changed = False
-            now_ts = time.time()
+            if len(corners) > 0 and self._track_expired(current_time):
+                corners, ids = (), None
+                self.reset_prefilter()
 
             if len(corners) > 0:
                 # Use the first detected marker
@@ -466,27 +822,12 @@ class ArUcoStateDetector:
                     tag_id = int(ids[0][0])
                     self.last_tag_id = tag_id
                 
-                # Add current position to history
-                self.position_history.append(current_position)
-                if len(self.position_history) > self.position_history_size:
-                    self.position_history.pop(0)
-
-                # Calculate average movement over the buffer
-                if len(self.position_history) > 1:
-                    movements = [
-                        math.sqrt(
-                            (self.position_history[i][0] - self.position_history[i-1][0])**2 +
-                            (self.position_history[i][1] - self.position_history[i-1][1])**2
-                        )
-                        for i in range(1, len(self.position_history))
-                    ]
-                    avg_movement = sum(movements) / len(movements)
-                else:
-                    avg_movement = 0.0
+                # Average speed over the recent detections, from their capture timestamps
+                avg_movement = self._tag_velocity(now_ts, current_position, marker_corners)
 
                 # --- Recent movement window logic ---
                 # Record significant movement events
-                if avg_movement > self.movement_threshold:
+                if avg_movement > self.get_velocity_threshold():
                     self.movement_events.append((now_ts, avg_movement))
                 # Remove old events outside the window
                 self.movement_events = [evt for evt in self.movement_events if now_ts - evt[0] <= self.movement_event_window]
@@ -500,23 +841,8 @@ class ArUcoStateDetector:
                         state_changed = self._update_state('IDLE', current_time)
 
                 self.last_position = current_position
-                self.last_detection_time = current_time
-
-                # Draw detection results
-                frame = cv2.aruco.drawDetectedMarkers(frame, corners, ids)
-                center = (int(current_position[0]), int(current_position[1]))
-                cv2.circle(frame, center, 5, (0, 255, 0), -1)
-                
-                # Overlay: show state and pending state clearly
-                state_text = f"State: {self.current_state}"
-                if self.pending_state and self.pending_state != self.current_state:
-                    state_text += f" (pending {self.pending_state})"
-                cv2.putText(frame, state_text,
-                           (10, 30), cv2.FONT_HERSHEY_SIMPLEX,
-                           1, (0, 255, 0), 2)
-                cv2.putText(frame, f"Avg Movement: {avg_movement:.2f}",
-                           (10, 60), cv2.FONT_HERSHEY_SIMPLEX,
-                           1, (0, 255, 0), 2)
+                if not self.last_markers_tracked:
+                    self.last_detection_time = current_time
             else:
                 if (self.last_detection_time is None or 
                     (current_time - self.last_detection_time).total_seconds() > self.error_timeout):
@@ -525,11 +851,34 @@ class ArUcoStateDetector:
                     self.position_history = []
                     self.movement_events = []
 
-            return self.current_state, tag_id, frame
+            pending = self.pending_state if self.pending_state != self.current_state else None
+            self.last_result = DetectionResult(
+                self.current_state, tag_id, now_ts,
+                corners=tuple(corners) if tag_id is not None else (),
+                ids=ids if tag_id is not None else None,
+                position=current_position,
+                velocity=avg_movement,
+                velocity_units=self.velocity_units(),
+                pending_state=pending
+            )
+            return self.last_result
 
         except Exception as e:
             logger.error(f"Error detecting state: {e}")
-            return 'ERROR', None, frame
+            self.last_result = DetectionResult('ERROR', None, now_ts, velocity_units=self.velocity_units())
+            return self.last_result
+
+    def detect_state(self, frame, timestamp: Optional[float] = None):
+        """
+        Detect ArUco markers and determine machine state from a single frame.
+
+        Returns (state, tag_id, frame); the frame is returned unchanged, see detect.
+        """
+        result = self.detect(frame, timestamp)
+        return result.state, result.tag_id, frame
+
+    def velocity_units(self) -> str:
+        return 'mm/s' if self.tag_size_mm else 'px/s'
 
     def __del__(self):
         """Cleanup when the detector is destroyed."""
@@ -540,7 +889,7 @@ class ArUcoStateDetector:
             logger.error(f"Error during cleanup: {e}")
 
 # Create a global instance
-detector = None  # Initialize as None
+detector = None  # Created by initialize_detector()
 
 def initialize_detector(camera_id: Optional[str] = "0"):
     """Initialize the detector with a specific camera ID"""
@@ -551,6 +900,3 @@ def initialize_detector(camera_id: Optional[str] = "0"):
     except Exception as e:
         logger.error(f"Failed to initialize detector: {e}")
         return False
-
-# Initialize with default camera (0)
-initialize_detector() 
\ No newline at end of file
@@ -0,0 +1,284 @@
+import argparse
+import asyncio
+import http.client
+import json
+import math
+import os
+import platform
+import socket
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+import numpy as np
+
+STAGES = ('capture', 'detect', 'state', 'db', 'websocket', 'end_to_end')
+
+# Transitions one simulated machine produces per year (see simulator.CNCSimulator)
+ROWS_PER_MACHINE_YEAR = 15000
+
+def percentiles(samples: List[float]) -> Dict:
+    """Summarize latency samples (in milliseconds)."""
+    if not samples:
+        return {'count': 0}
+    values = np.array(samples)
+    return {
+        'count': len(samples),
+        'mean': round(float(values.mean()), 3),
+        'p50': round(float(np.percentile(values, 50)), 3),
+        'p95': round(float(np.percentile(values, 95)), 3),
+        'p99': round(float(np.percentile(values, 99)), 3),
+        'max': round(float(values.max()), 3)
+    }
+
+class SimulatedWebSocket:
+    """Stand-in for a connected dashboard: serializes messages like Starlette and records arrival times."""
+
+    def __init__(self):
+        self.received = []  # (perf_counter at arrival, message size in bytes)
+
+    async def send_json(self, data):
+        payload = json.dumps(data, separators=(',', ':')).encode('utf-8')
+        self.received.append((time.perf_counter(), len(payload)))
+
+def seed_history(db_path: str, rows: int, seed: int = 0) -> int:
+    """
+    Fill a state_changes table with roughly `rows` simulated transitions ending now.
+
+    Larger histories are produced by simulating more machines over up to a year, so
+    the rows keep realistic durations and working-hours patterns.
+
+    Returns:
+        Number of rows written
+    """
+    from models import CST
+    from simulator import generate_history
+
+    machines = max(1, math.ceil(rows / ROWS_PER_MACHINE_YEAR))
+    days = 365 * rows / (machines * ROWS_PER_MACHINE_YEAR)
+    end = datetime.now(CST)
+    return generate_history(db_path, end - timedelta(days=days), end, machines=machines, seed=seed)
+
+def benchmark_pipeline(recording: str, clients: int = 10, max_frames: int = None) -> Dict:
+    """
+    Drive capture -> detect -> state -> DB -> WebSocket with a recording.
+
+    Mirrors the body of app.process_camera_feed, but takes frame timestamps from the
+    recording so a max-speed replay produces the same transitions as a live run.
+    """
+    import app
+    from apriltag_detector import ArUcoStateDetector
+
+    app.init_db()
+    detector = ArUcoStateDetector(camera_id=recording)
+    source = detector.cap
+    source.realtime = False
+    source.loop = False
+    sockets = [SimulatedWebSocket() for _ in range(clients)]
+    app.manager.active_connections = list(sockets)
+
+    timings = {stage: [] for stage in STAGES}
+    base_time = time.time()
+    current_state = None
+    state_start_time = None
+    frames = 0
+    transitions = 0
+    wall_start = time.perf_counter()
+
+    while max_frames is None or frames < max_frames:
+        t0 = time.perf_counter()
+        ret, frame = source.read()
+        t1 = time.perf_counter()
+        if not ret:
+            break
+        frames += 1
+        timings['capture'].append((t1 - t0) * 1000.0)
+
+        state, tag_id, _ = detector.detect_state(frame, timestamp=base_time + source.timestamp)
+        t2 = time.perf_counter()
+        timings['detect'].append((t2 - t1) * 1000.0)
+
+        app.live_state.record_frame(tag_id is not None)
+        changed = current_state is None or state != current_state
+        previous_state, previous_start = current_state, state_start_time
+        if changed:
+            current_state = state
+            state_start_time = base_time + source.timestamp
+            snapshot = app.live_state.publish(current_state, tag_id, app.get_state_description(current_state),
+                                              since=state_start_time)
+        t3 = time.perf_counter()
+        timings['state'].append((t3 - t2) * 1000.0)
+        if not changed:
+            continue
+
+        transitions += 1
+        if previous_state is not None:
+            duration = int(base_time + source.timestamp - previous_start)
+            app.save_state_change(previous_state, duration, app.get_state_description(previous_state), tag_id)
+        app.save_state_change(current_state, 0, app.get_state_description(current_state), tag_id)
+        t4 = time.perf_counter()
+        timings['db'].append((t4 - t3) * 1000.0)
+
+        asyncio.run(app.manager.broadcast(snapshot.to_dict()))
+        t5 = time.perf_counter()
+        timings['websocket'].append((t5 - t4) * 1000.0)
+        timings['end_to_end'].append((sockets[-1].received[-1][0] - t0) * 1000.0)
+
+    wall_time = time.perf_counter() - wall_start
+    source.release()
+    app.manager.active_connections = []
+
+    return {
+        'recording': recording,
+        'frames': frames,
+        'transitions': transitions,
+        'websocket_clients': clients,
+        'wall_time_s': round(wall_time, 3),
+        'frames_per_second': round(frames / wall_time, 1) if wall_time > 0 else 0.0,
+        'stages_ms': {stage: percentiles(samples) for stage, samples in timings.items()}
+    }
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def _http_client(port: int, path: str, deadline: float, latencies: List[float], errors: List[int]):
+    connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            connection.request('GET', path)
+            response = connection.getresponse()
+            response.read()
+            if response.status != 200:
+                errors.append(response.status)
+                continue
+        except Exception:
+            errors.append(0)
+            connection.close()
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+            continue
+        latencies.append((time.perf_counter() - start) * 1000.0)
+    connection.close()
+
+def benchmark_api(db_path: str, paths: List[str], clients: int = 4, duration: float = 10.0) -> List[Dict]:
+    """
+    Measure requests per second for API paths against the database at db_path.
+
+    The app is served by uvicorn in a background thread without running its startup
+    hooks, so no camera is opened.
+    """
+    import uvicorn
+    import app
+
+    os.environ['DATABASE_PATH'] = db_path
+    port = _free_port()
+    server = uvicorn.Server(uvicorn.Config(app.app, host='127.0.0.1', port=port, lifespan='off', log_level='warning'))
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        time.sleep(0.05)
+
+    results = []
+    try:
+        for path in paths:
+            latencies: List[float] = []
+            errors: List[int] = []
+            deadline = time.perf_counter() + duration
+            workers = [threading.Thread(target=_http_client, args=(port, path, deadline, latencies, errors))
+                       for _ in range(clients)]
+            start = time.perf_counter()
+            for worker in workers:
+                worker.start()
+            for worker in workers:
+                worker.join()
+            elapsed = time.perf_counter() - start
+            results.append({
+                'path': path,
+                'clients': clients,
+                'requests': len(latencies),
+                'errors': len(errors),
+                'requests_per_second': round(len(latencies) / elapsed, 2),
+                'latency_ms': percentiles(latencies)
+            })
+    finally:
+        server.should_exit = True
+        thread.join()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end latency and throughput benchmark for the dashboard.")
+    parser.add_argument('--recording', help="Video or image sequence to replay (default: generate a synthetic video)")
+    parser.add_argument('--max-frames', type=int, help="Stop the pipeline run after this many frames")
+    parser.add_argument('--ws-clients', type=int, default=10, help="Simulated WebSocket clients (default: 10)")
+    parser.add_argument('--history-sizes', default='1000,10000,100000,1000000',
+                        help="Comma-separated history sizes in rows (default: 1k to 1M; add 10000000 for 10M)")
+    parser.add_argument('--paths', default='/api/metrics/today,/api/metrics/month,/api/metrics/year',
+                        help="API paths to load test")
+    parser.add_argument('--http-clients', type=int, default=4, help="Concurrent HTTP clients (default: 4)")
+    parser.add_argument('--duration', type=float, default=10.0, help="Seconds per API path (default: 10)")
+    parser.add_argument('--workdir', help="Directory for databases and generated video (default: temporary)")
+    parser.add_argument('--skip-pipeline', action='store_true', help="Only run the API benchmark")
+    parser.add_argument('--skip-api', action='store_true', help="Only run the pipeline benchmark")
+    parser.add_argument('--output', default='benchmark_results.json', help="Results file (default: benchmark_results.json)")
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='cnc-benchmark-')
+    os.makedirs(workdir, exist_ok=True)
+    # The database path must be set before app and models are imported
+    os.environ['DATABASE_PATH'] = os.path.join(workdir, 'pipeline.db')
+
+    import cv2
+
+    results = {
+        'started_at': datetime.now().isoformat(),
+        'python_version': sys.version.split()[0],
+        'opencv_version': cv2.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count()
+    }
+
+    if not args.skip_pipeline:
+        recording = args.recording
+        if recording is None:
+            from synthetic_video import SyntheticMarkerVideo
+
+            recording = os.path.join(workdir, 'synthetic.avi')
+            if not os.path.exists(recording):
+                print("Generating synthetic video...")
+                SyntheticMarkerVideo(seed=0).write(recording)
+        print(f"Running pipeline benchmark on {recording}...")
+        results['pipeline'] = benchmark_pipeline(recording, args.ws_clients, args.max_frames)
+        pipeline = results['pipeline']
+        print(f"  {pipeline['frames']} frames at {pipeline['frames_per_second']} FPS, "
+              f"{pipeline['transitions']} transitions")
+        for stage, stats in pipeline['stages_ms'].items():
+            if stats['count']:
+                print(f"  {stage:<11} p50 {stats['p50']:>8.3f} ms  p95 {stats['p95']:>8.3f} ms  p99 {stats['p99']:>8.3f} ms")
+
+    if not args.skip_api:
+        results['api'] = []
+        for rows in [int(size) for size in args.history_sizes.split(',')]:
+            db_path = os.path.join(workdir, f'history_{rows}.db')
+            if not os.path.exists(db_path):
+                print(f"Seeding {rows} rows...")
+                seed_history(db_path, rows)
+            actual_rows = sqlite3.connect(db_path).execute('SELECT COUNT(*) FROM state_changes').fetchone()[0]
+            print(f"Load testing with {actual_rows} rows of history...")
+            for result in benchmark_api(db_path, args.paths.split(','), args.http_clients, args.duration):
+                result['history_rows'] = actual_rows
+                results['api'].append(result)
+                print(f"  {result['path']:<24} {result['requests_per_second']:>8.1f} req/s  "
+                      f"p50 {result['latency_ms'].get('p50', 0):>9.2f} ms  p99 {result['latency_ms'].get('p99', 0):>9.2f} ms")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults saved to {args.output}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+import argparse
+import json
+import time
+
+import cv2
+import numpy as np
+
+from apriltag_detector import DETECTOR_PROFILES, create_detector_parameters
+from replay import ReplaySource
+
+def load_recorded_frames(path, max_frames=500):
+    """
+    Load recorded frames as grayscale images.
+
+    Args:
+        path: Video file, directory of images or glob pattern
+        max_frames: Maximum number of frames to load
+
+    Returns:
+        List of grayscale frames
+    """
+    source = ReplaySource(path)
+    if not source.isOpened():
+        raise RuntimeError(f"Could not open recording {path}")
+    frames = []
+    try:
+        while len(frames) < max_frames:
+            ret, frame = source.read()
+            if not ret:
+                break
+            frames.append(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY))
+    finally:
+        source.release()
+    return frames
+
+def benchmark_profile(frames, profile, repeat=1):
+    """
+    Run marker detection over all frames with one profile.
+
+    Args:
+        frames: Grayscale frames to process
+        profile: Profile name from DETECTOR_PROFILES
+        repeat: Number of passes over the frames
+
+    Returns:
+        Dict with detection rate and per-frame timing in milliseconds
+    """
+    aruco_dict = cv2.aruco.getPredefinedDictionary(cv2.aruco.DICT_4X4_50)
+    parameters = create_detector_parameters(profile)
+    detector = None
+    version = tuple(map(int, cv2.__version__.split(".")[:2]))
+    if version >= (4, 7):
+        detector = cv2.aruco.ArucoDetector(aruco_dict, parameters)
+
+    timings = []
+    detected_frames = 0
+    for _ in range(repeat):
+        detected_frames = 0
+        for gray in frames:
+            start = time.perf_counter()
+            if detector is not None:
+                corners, ids, rejected = detector.detectMarkers(gray)
+            else:
+                corners, ids, rejected = cv2.aruco.detectMarkers(gray, aruco_dict, parameters=parameters)
+            timings.append((time.perf_counter() - start) * 1000.0)
+            if ids is not None and len(ids) > 0:
+                detected_frames += 1
+
+    timings = np.array(timings)
+    return {
+        'profile': profile,
+        'frames': len(frames),
+        'detection_rate': round(detected_frames / len(frames), 4) if frames else 0.0,
+        'ms_per_frame_mean': round(float(timings.mean()), 3) if len(timings) else 0.0,
+        'ms_per_frame_p95': round(float(np.percentile(timings, 95)), 3) if len(timings) else 0.0,
+        'fps': round(1000.0 / float(timings.mean()), 1) if len(timings) and timings.mean() > 0 else 0.0
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare ArUco detector profiles on recorded frames.")
+    parser.add_argument('recording', help="Video file, directory of images or glob pattern")
+    parser.add_argument('--profiles', default=','.join(DETECTOR_PROFILES),
+                        help="Comma-separated profiles to compare (default: all)")
+    parser.add_argument('--max-frames', type=int, default=500, help="Maximum frames to load (default: 500)")
+    parser.add_argument('--repeat', type=int, default=1, help="Passes over the frames per profile (default: 1)")
+    parser.add_argument('--json', dest='json_path', help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    frames = load_recorded_frames(args.recording, args.max_frames)
+    if not frames:
+        print(f"No frames could be read from {args.recording}")
+        return
+    height, width = frames[0].shape[:2]
+    print(f"Loaded {len(frames)} frames ({width}x{height}) from {args.recording}")
+    print(f"OpenCV {cv2.__version__}\n")
+
+    results = []
+    print(f"{'Profile':<10} {'Detect rate':>12} {'ms/frame':>10} {'p95 ms':>10} {'FPS':>8}")
+    for profile in args.profiles.split(','):
+        profile = profile.strip()
+        result = benchmark_profile(frames, profile, args.repeat)
+        results.append(result)
+        print(f"{profile:<10} {result['detection_rate'] * 100:>11.1f}% {result['ms_per_frame_mean']:>10.2f} "
+              f"{result['ms_per_frame_p95']:>10.2f} {result['fps']:>8.1f}")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump({
+                'recording': args.recording,
+                'resolution': [width, height],
+                'opencv_version': cv2.__version__,
+                'results': results
+            }, f, indent=2)
+        print(f"\nResults saved to {args.json_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,222 @@
+import fcntl
+import glob
+import os
+import re
+import struct
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+SYSFS_VIDEO4LINUX = '/sys/class/video4linux'
+
+# VIDIOC_QUERYCAP = _IOR('V', 0, struct v4l2_capability), a 104 byte struct:
+# driver[16], card[32], bus_info[32], version, capabilities, device_caps, reserved[3]
+VIDIOC_QUERYCAP = 0x80685600
+V4L2_CAPABILITY = struct.Struct('16s32s32sIII12x')
+V4L2_CAP_VIDEO_CAPTURE = 0x00000001
+V4L2_CAP_DEVICE_CAPS = 0x80000000
+
+PREFERRED_CAMERAS = ('Logitech BRIO',)
+
+def _read_sysfs(path: str) -> Optional[str]:
+    try:
+        with open(path, 'r') as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def query_capabilities(device: str) -> Optional[Dict]:
+    """
+    Ask a V4L2 device what it can do with a single VIDIOC_QUERYCAP ioctl.
+
+    The device is opened non-blocking and never streams, so this takes well under a
+    millisecond even for cameras that are busy in another process.
+
+    Returns:
+        Dict with driver, card, bus_info and capture, or None if the query failed
+    """
+    try:
+        fd = os.open(device, os.O_RDONLY | os.O_NONBLOCK)
+    except OSError:
+        return None
+    try:
+        buffer = bytearray(V4L2_CAPABILITY.size)
+        fcntl.ioctl(fd, VIDIOC_QUERYCAP, buffer)
+    except OSError:
+        return None
+    finally:
+        os.close(fd)
+
+    driver, card, bus_info, _, capabilities, device_caps = V4L2_CAPABILITY.unpack(buffer)
+    # Metadata nodes (e.g. the BRIO's second /dev/video node) share the physical
+    # device's capabilities, but not its per-node device_caps
+    caps = device_caps if capabilities & V4L2_CAP_DEVICE_CAPS else capabilities
+    return {
+        'driver': driver.split(b'\0', 1)[0].decode(errors='replace'),
+        'card': card.split(b'\0', 1)[0].decode(errors='replace'),
+        'bus_info': bus_info.split(b'\0', 1)[0].decode(errors='replace'),
+        'capture': bool(caps & V4L2_CAP_VIDEO_CAPTURE)
+    }
+
+def describe_device(node: str) -> Dict:
+    """Collect sysfs metadata and capabilities for one video4linux node (e.g. 'video0')."""
+    sysfs = os.path.join(SYSFS_VIDEO4LINUX, node)
+    device = f"/dev/{node}"
+    usb_device = os.path.join(sysfs, 'device', '..')
+    info = {
+        'device': device,
+        'node_number': int(re.sub(r'\D', '', node) or 0),
+        'name': _read_sysfs(os.path.join(sysfs, 'name')) or node,
+        'index': _read_sysfs(os.path.join(sysfs, 'index')),
+        'vendor_id': _read_sysfs(os.path.join(usb_device, 'idVendor')),
+        'product_id': _read_sysfs(os.path.join(usb_device, 'idProduct')),
+        'serial': _read_sysfs(os.path.join(usb_device, 'serial')),
+        'capture': None
+    }
+    capabilities = query_capabilities(device)
+    if capabilities is not None:
+        info['capture'] = capabilities['capture']
+        info['driver'] = capabilities['driver']
+        info['bus_info'] = capabilities['bus_info']
+    elif info['index'] is not None:
+        # Without access to the device node, assume only the first node of a device captures
+        info['capture'] = info['index'] == '0'
+    return info
+
+def _sort_key(camera: Dict):
+    preferred = any(name in camera['name'] for name in PREFERRED_CAMERAS)
+    return (not preferred, camera['node_number'])
+
+def _list_nodes() -> List[str]:
+    try:
+        return sorted(os.listdir(SYSFS_VIDEO4LINUX))
+    except OSError:
+        return []
+
+def enumerate_cameras(max_workers: int = 8) -> List[Dict]:
+    """
+    List capture-capable video devices, preferred cameras (Logitech BRIO) first.
+
+    Metadata comes from sysfs and each node is queried in parallel, so the scan costs
+    milliseconds instead of opening every device with OpenCV. Without sysfs (e.g. a
+    container without /sys mounted) it falls back to the /dev/video* nodes.
+    """
+    nodes = [node for node in _list_nodes() if node.startswith('video')]
+    if nodes:
+        with ThreadPoolExecutor(max_workers=min(max_workers, len(nodes))) as pool:
+            cameras = list(pool.map(describe_device, nodes))
+    else:
+        cameras = []
+        for device in glob.glob('/dev/video*'):
+            capabilities = query_capabilities(device)
+            cameras.append({
+                'device': device,
+                'node_number': int(re.sub(r'\D', '', device) or 0),
+                'name': capabilities['card'] if capabilities else os.path.basename(device),
+                'capture': capabilities['capture'] if capabilities else None
+            })
+    return sorted((camera for camera in cameras if camera['capture'] is not False), key=_sort_key)
+
+class CameraDiscovery:
+    """
+    Cached camera list that refreshes only when devices are plugged in or removed.
+
+    Uses udev events through pyudev when it is installed, otherwise polls the sysfs
+    directory listing, which is a single cheap readdir.
+    """
+
+    def __init__(self, poll_interval: float = 2.0):
+        """
+        Args:
+            poll_interval: Seconds between checks for new devices when pyudev is not available
+        """
+        self.poll_interval = poll_interval
+        self._cameras: Optional[List[Dict]] = None
+        self._nodes: Optional[List[str]] = None
+        self._lock = threading.Lock()
+        self._listeners: List[Callable[[List[Dict]], None]] = []
+        self._thread = None
+        self._stop = threading.Event()
+        self.last_refresh = None
+        self.refresh_ms = None
+        self.hotplug_backend = None
+
+    def cameras(self) -> List[Dict]:
+        """Cached list of cameras, scanning on first use."""
+        with self._lock:
+            cameras = self._cameras
+        if cameras is None:
+            cameras = self.refresh()
+        return list(cameras)
+
+    def refresh(self) -> List[Dict]:
+        """Rescan devices now and notify listeners if the list changed."""
+        start = time.perf_counter()
+        nodes = _list_nodes()
+        cameras = enumerate_cameras()
+        with self._lock:
+            changed = self._cameras is not None and cameras != self._cameras
+            self._cameras = cameras
+            self._nodes = nodes
+            self.last_refresh = time.time()
+            self.refresh_ms = round((time.perf_counter() - start) * 1000.0, 2)
+        if changed:
+            print(f"Camera list changed: {[camera['device'] for camera in cameras]}")
+            for listener in self._listeners:
+                try:
+                    listener(cameras)
+                except Exception as e:
+                    print(f"Error in camera hotplug listener: {e}")
+        return cameras
+
+    def add_listener(self, callback: Callable[[List[Dict]], None]):
+        """Call callback with the new camera list whenever a device is added or removed."""
+        self._listeners.append(callback)
+
+    def start(self):
+        """Start watching for hotplug events in a background thread."""
+        if self._thread is not None:
+            return
+        self._stop.clear()
+        try:
+            import pyudev
+            context = pyudev.Context()
+            monitor = pyudev.Monitor.from_netlink(context)
+            monitor.filter_by(subsystem='video4linux')
+            self.hotplug_backend = 'udev'
+            target = self._watch_udev
+            args = (monitor,)
+        except Exception:
+            self.hotplug_backend = 'poll'
+            target = self._watch_sysfs
+            args = ()
+        self._thread = threading.Thread(target=target, args=args, name='camera-discovery', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.poll_interval + 1)
+            self._thread = None
+
+    def _watch_udev(self, monitor):
+        monitor.start()
+        while not self._stop.is_set():
+            device = monitor.poll(timeout=1.0)
+            if device is not None and device.action in ('add', 'remove', 'change'):
+                self.refresh()
+
+    def _watch_sysfs(self):
+        while not self._stop.wait(self.poll_interval):
+            if _list_nodes() != self._nodes:
+                self.refresh()
+
+    def status(self) -> Dict:
+        return {
+            'hotplug_backend': self.hotplug_backend,
+            'last_refresh': self.last_refresh,
+            'refresh_ms': self.refresh_ms
+        }
+
+camera_discovery = CameraDiscovery()
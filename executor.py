@@ -0,0 +1,85 @@
+import asyncio
+import functools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from telemetry import Gauge, Histogram
+
+# SQLite allows concurrent readers, so several dashboards can query at once; camera
+# controls talk to a single device and must not interleave.
+DB_WORKERS = int(os.getenv('DB_WORKERS', '4'))
+CAMERA_WORKERS = 1
+# JPEG encoding and mosaic compositing for video endpoints, kept apart from the camera
+# worker so a slow encode never delays a camera control call
+ENCODE_WORKERS = int(os.getenv('ENCODE_WORKERS', '2'))
+
+db_executor = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix='db')
+camera_executor = ThreadPoolExecutor(max_workers=CAMERA_WORKERS, thread_name_prefix='camera-control')
+encode_executor = ThreadPoolExecutor(max_workers=ENCODE_WORKERS, thread_name_prefix='encode')
+
+LOOP_LAG_SECONDS = Histogram('cnc_event_loop_lag_seconds', 'How late the event loop wakes up from a short sleep',
+                             buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0))
+DB_QUEUE_SECONDS = Histogram('cnc_db_pool_wait_seconds', 'Time DB calls wait for a free worker')
+DB_CALL_SECONDS = Histogram('cnc_db_call_seconds', 'Time spent running DB calls in the worker pool')
+CAMERA_CALL_SECONDS = Histogram('cnc_camera_call_seconds', 'Time spent running camera control calls')
+Gauge('cnc_db_pool_queue_depth', 'DB calls waiting for a free worker', lambda: db_executor._work_queue.qsize())
+ENCODE_CALL_SECONDS = Histogram('cnc_encode_call_seconds', 'Time spent running calls in the encode pool')
+Gauge('cnc_camera_pool_queue_depth', 'Camera control calls waiting for the camera worker',
+      lambda: camera_executor._work_queue.qsize())
+Gauge('cnc_encode_pool_queue_depth', 'Encode calls waiting for a free encode worker',
+      lambda: encode_executor._work_queue.qsize())
+
+# Most recent loop lag in seconds, for health reporting
+last_loop_lag = 0.0
+
+def _timed_call(func: Callable, queued_at: float, wait_histogram: Optional[Histogram], run_histogram: Histogram):
+    start = time.perf_counter()
+    if wait_histogram is not None:
+        wait_histogram.observe(start - queued_at)
+    try:
+        return func()
+    finally:
+        run_histogram.observe(time.perf_counter() - start)
+
+async def run_db(func: Callable, *args, **kwargs):
+    """Run a blocking database call in the DB pool and await its result."""
+    call = functools.partial(func, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(
+        db_executor, _timed_call, call, time.perf_counter(), DB_QUEUE_SECONDS, DB_CALL_SECONDS)
+
+async def run_camera(func: Callable, *args, **kwargs):
+    """Run a blocking camera control call (cap.get/set, opening a device) on the camera worker."""
+    call = functools.partial(func, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(
+        camera_executor, _timed_call, call, time.perf_counter(), None, CAMERA_CALL_SECONDS)
+
+async def run_encode(func: Callable, *args, **kwargs):
+    """Run a CPU-bound image call (JPEG encoding, compositing) in the encode pool."""
+    call = functools.partial(func, *args, **kwargs)
+    return await asyncio.get_running_loop().run_in_executor(
+        encode_executor, _timed_call, call, time.perf_counter(), None, ENCODE_CALL_SECONDS)
+
+async def monitor_loop_lag(interval: float = 0.5, warn_after: float = 0.25):
+    """
+    Continuously measure event-loop lag.
+
+    Every interval, sleeps and records how late the wake-up was. Lag above warn_after
+    seconds means something blocked the loop; use /api/admin/profile to find out what.
+    """
+    global last_loop_lag
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        last_loop_lag = max(0.0, loop.time() - start - interval)
+        LOOP_LAG_SECONDS.observe(last_loop_lag)
+        if last_loop_lag > warn_after:
+            print(f"Warning: event loop blocked for {last_loop_lag * 1000:.0f} ms")
+
+def shutdown():
+    """Stop the worker pools, waiting for running calls to finish."""
+    db_executor.shutdown(wait=True)
+    camera_executor.shutdown(wait=True)
+    encode_executor.shutdown(wait=True)
@@ -0,0 +1,221 @@
+import asyncio
+import os
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+import httpx
+
+from ws_protocol import Frame, make_update
+
+# Per-node request timeout (in seconds); slow nodes are served from cache instead
+FLEET_TIMEOUT = float(os.getenv('FLEET_TIMEOUT', '2.0'))
+# How long a node's last good response may stand in for it (in seconds)
+FLEET_CACHE_TTL = float(os.getenv('FLEET_CACHE_TTL', '300'))
+# Seconds between polls of every machine's live state for /ws/fleet clients
+FLEET_STATE_INTERVAL = float(os.getenv('FLEET_STATE_INTERVAL', '1.0'))
+
+def node_url(service: Dict) -> str:
+    return f"http://{service['ip']}:{service.get('port', 8000)}"
+
+class FleetGateway:
+    """
+    Queries every registered machine concurrently and merges the answers.
+
+    One pooled httpx.AsyncClient keeps connections to the nodes alive between
+    requests. Each node gets its own timeout; when a node is slow or down its last
+    good response is returned (marked stale) so one machine never holds up the plant
+    view.
+    """
+
+    def __init__(self, timeout: float = FLEET_TIMEOUT, cache_ttl: float = FLEET_CACHE_TTL, max_connections: int = 200):
+        """
+        Args:
+            timeout: Seconds to wait for each node
+            cache_ttl: Seconds a cached response may be served for an unreachable node
+            max_connections: Size of the connection pool shared by all nodes
+        """
+        self.timeout = timeout
+        self.cache_ttl = cache_ttl
+        self.max_connections = max_connections
+        self._client: Optional[httpx.AsyncClient] = None
+        self._client_loop = None
+        self._cache: Dict[tuple, tuple] = {}  # (node id, path) -> (fetched_at, data)
+
+    def _get_client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if self._client is None or self._client_loop is not loop:
+            # Pooled connections belong to the loop that opened them
+            self._client_loop = loop
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout, connect=min(1.0, self.timeout)),
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections)
+            )
+        return self._client
+
+    async def fetch(self, service: Dict, path: str) -> Dict:
+        """
+        GET path from one node.
+
+        Returns:
+            Dict with node id and name, status ('ok', 'stale' or 'error'), latency and data
+        """
+        key = (service['id'], path)
+        result = {'id': service['id'], 'name': service.get('name'), 'url': node_url(service)}
+        start = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(self._get_client().get(result['url'] + path), self.timeout)
+            response.raise_for_status()
+            data = response.json()
+            self._cache[key] = (time.time(), data)
+            result.update(status='ok', data=data)
+        except Exception as e:
+            error = str(e) or type(e).__name__
+            cached = self._cache.get(key)
+            if cached is not None and time.time() - cached[0] <= self.cache_ttl:
+                result.update(status='stale', data=cached[1], error=error,
+                              age_s=round(time.time() - cached[0], 1))
+            else:
+                result.update(status='error', data=None, error=error)
+        result['latency_ms'] = round((time.perf_counter() - start) * 1000.0, 1)
+        return result
+
+    async def fetch_bytes(self, service: Dict, path: str) -> Optional[bytes]:
+        """GET path from one node as raw bytes, or None if it fails or times out."""
+        try:
+            response = await asyncio.wait_for(self._get_client().get(node_url(service) + path), self.timeout)
+            response.raise_for_status()
+            return response.content
+        except Exception:
+            return None
+
+    async def fan_out(self, services: List[Dict], path: str) -> List[Dict]:
+        """Fetch path from all services at once."""
+        return list(await asyncio.gather(*(self.fetch(service, path) for service in services)))
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+def _status_counts(results: List[Dict]) -> Dict:
+    return {status: sum(1 for r in results if r['status'] == status) for status in ('ok', 'stale', 'error')}
+
+def merge_metrics(results: List[Dict]) -> Dict:
+    """Combine per-machine /api/metrics responses into plant totals plus a per-machine list."""
+    totals = {'RUNNING': 0.0, 'IDLE': 0.0, 'ERROR': 0.0}
+    machines = []
+    for result in results:
+        data = result['data'] or {}
+        counts = data.get('state_counts') or {}
+        for state in totals:
+            totals[state] += float(counts.get(state) or 0)
+        machines.append({
+            'id': result['id'],
+            'name': result['name'],
+            'status': result['status'],
+            'latency_ms': result['latency_ms'],
+            'error': result.get('error'),
+            'state_counts': counts,
+            'efficiency': (data.get('percentages') or {}).get('RUNNING')
+        })
+    total = sum(totals.values())
+    return {
+        'state_counts': totals,
+        'percentages': {state: round((value / total * 100) if total > 0 else 0, 1) for state, value in totals.items()},
+        'machines': machines,
+        'nodes': _status_counts(results)
+    }
+
+def merge_states(results: List[Dict]) -> Dict:
+    """Count machines per live state from /api/state responses."""
+    counts: Dict[str, int] = {}
+    for result in results:
+        state = (result['data'] or {}).get('state', 'UNKNOWN') if result['status'] != 'error' else 'UNREACHABLE'
+        counts[state] = counts.get(state, 0) + 1
+    return counts
+
+gateway = FleetGateway()
+
+class FleetStateFeed:
+    """
+    Live state of every machine for any number of fleet WebSocket clients.
+
+    One polling loop, running only while someone is subscribed, fetches /api/state
+    from all machines each interval through the gateway. Only machines whose state
+    changed are put into a single batched frame, which is encoded once per protocol
+    and queued to every subscriber.
+    """
+
+    def __init__(self, fleet: FleetGateway, services: Callable[[], List[Dict]], interval: float = FLEET_STATE_INTERVAL):
+        """
+        Args:
+            fleet: Gateway used to reach the machines
+            services: Returns the currently registered services
+            interval: Seconds between polls
+        """
+        self.fleet = fleet
+        self.services = services
+        self.interval = interval
+        self._subscribers: Set[asyncio.Queue] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._machines: Dict[str, list] = {}  # service id -> [machine_id, service id, name]
+        self._last: Dict[int, list] = {}  # machine_id -> last update sent
+
+    def subscribe(self) -> asyncio.Queue:
+        """Queue of frames for a new client, starting with the machines and their last known state."""
+        queue: asyncio.Queue = asyncio.Queue(maxsize=100)
+        queue.put_nowait(Frame.hello(self._machines.values()))
+        if self._last:
+            queue.put_nowait(Frame.updates(list(self._last.values())))
+        self._subscribers.add(queue)
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue):
+        self._subscribers.discard(queue)
+
+    def close(self, queue: asyncio.Queue):
+        """Unsubscribe and end the client's stream with None."""
+        self._subscribers.discard(queue)
+        while not queue.empty():
+            queue.get_nowait()
+        queue.put_nowait(None)
+
+    def _publish(self, frame: Frame):
+        for queue in list(self._subscribers):
+            try:
+                queue.put_nowait(frame)
+            except asyncio.QueueFull:
+                # The client stopped reading; end its stream
+                self.close(queue)
+
+    async def poll(self):
+        """Fetch every machine's state once and publish what changed."""
+        results = await self.fleet.fan_out(self.services(), "/api/state")
+        added = False
+        updates = []
+        for result in results:
+            if result['id'] not in self._machines:
+                self._machines[result['id']] = [len(self._machines), result['id'], result['name']]
+                added = True
+            machine_id = self._machines[result['id']][0]
+            state = result['data'] if result['status'] != 'error' else {'state': 'UNREACHABLE'}
+            update = make_update(machine_id, state or {})
+            if self._last.get(machine_id) != update:
+                self._last[machine_id] = update
+                updates.append(update)
+        if added:
+            self._publish(Frame.hello(self._machines.values()))
+        if updates:
+            self._publish(Frame.updates(updates))
+
+    async def _run(self):
+        while self._subscribers:
+            start = time.monotonic()
+            try:
+                await self.poll()
+            except Exception as e:
+                print(f"Error polling fleet state: {e}")
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - start)))
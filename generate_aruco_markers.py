@@ -14,9 +14,12 @@ def generate_aruco_marker(dictionary, marker_id, size_pixels=400):
     Returns:
         The generated marker image
     """
-    # Generate the marker
+    # Generate the marker (generateImageMarker replaced drawMarker in OpenCV 4.7.0)
     marker = np.zeros((size_pixels, size_pixels), dtype=np.uint8)
-    marker = cv2.aruco.generateImageMarker(dictionary, marker_id, size_pixels, marker, 1)
+    if hasattr(cv2.aruco, 'generateImageMarker'):
+        marker = cv2.aruco.generateImageMarker(dictionary, marker_id, size_pixels, marker, 1)
+    else:
+        marker = cv2.aruco.drawMarker(dictionary, marker_id, size_pixels, marker, 1)
     return marker
 
 def create_svg_from_marker(marker, margin_pixels=50):
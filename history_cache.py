@@ -0,0 +1,319 @@
+import math
+import os
+import threading
+import time
+from array import array
+from datetime import date, datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+# Days of history kept in memory; the default covers the quarter view
+HISTORY_CACHE_DAYS = float(os.getenv('HISTORY_CACHE_DAYS', '93'))
+
+TRACKED_STATES = ('RUNNING', 'IDLE', 'ERROR')
+NO_TAG = -1
+
+def to_epoch(value) -> float:
+    """
+    Convert a datetime or ISO timestamp to epoch seconds.
+
+    Naive values are treated as UTC, which is how SQLite's datetime() reads them.
+    """
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+def _sql_seconds(value) -> int:
+    # datetime(timestamp) in SQLite drops fractional seconds before comparing
+    return math.floor(to_epoch(value))
+
+class StateEvent:
+    """
+    One row of state_changes.
+
+    Supports row['column'] access like sqlite3.Row, so code written against query
+    results works unchanged with cached events.
+    """
+    __slots__ = ('id', 'timestamp', 'state', 'description', 'tag_id', 'duration')
+
+    def __init__(self, id, timestamp, state, description, tag_id, duration):
+        self.id = id
+        self.timestamp = timestamp
+        self.state = state
+        self.description = description
+        self.tag_id = tag_id
+        self.duration = duration
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def to_dict(self) -> Dict:
+        return {
+            "timestamp": self.timestamp,
+            "state": self.state,
+            "duration": self.duration,
+            "description": self.description,
+            "tag_id": self.tag_id
+        }
+
+class HistoryCache:
+    """
+    Columnar in-memory copy of the last few days of state_changes.
+
+    Each column is an array.array (ids, start second, UTC offset, duration, state code,
+    tag id), and repeated strings (state names, descriptions) are dictionary encoded.
+    Aggregations run on zero-copy NumPy views of the columns, so metric requests for
+    recent periods never touch the database. The cache is filled once from the
+    database and then kept current by the writer (save_state_change).
+
+    Range filters follow SQLite's datetime() comparison: both sides are truncated to
+    whole UTC seconds and the range is inclusive.
+    """
+
+    def __init__(self, days: float = HISTORY_CACHE_DAYS):
+        """
+        Args:
+            days: Days of history to keep in memory
+        """
+        self.days = days
+        self._lock = threading.Lock()
+        self._pending: List[tuple] = []  # Rows written before the initial load finished
+        self.loaded = False
+        self.since = None  # Start of the covered range (in epoch seconds)
+        self._reset_columns()
+
+    def _reset_columns(self):
+        self.ids = array('q')
+        self.starts = array('d')  # Epoch seconds
+        self.seconds = array('q')  # Epoch seconds truncated like SQLite's datetime()
+        self.offsets = array('i')  # UTC offset of the stored timestamp (in seconds)
+        self.durations = array('d')
+        self.state_codes = array('B')
+        self.tag_ids = array('q')
+        self.description_codes = array('I')
+        self.timestamps: List[str] = []
+        self.state_names: List[str] = list(TRACKED_STATES)
+        self._state_lookup = {name: code for code, name in enumerate(self.state_names)}
+        self.descriptions: List[Optional[str]] = []
+        self._description_lookup: Dict[Optional[str], int] = {}
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def _code(self, names: list, lookup: dict, value) -> int:
+        code = lookup.get(value)
+        if code is None:
+            code = len(names)
+            names.append(value)
+            lookup[value] = code
+        return code
+
+    def _append_row(self, row_id: int, timestamp: str, state: str, description: Optional[str],
+                    tag_id: Optional[int], duration: Optional[float]):
+        parsed = datetime.fromisoformat(timestamp)
+        epoch = to_epoch(parsed)
+        offset = parsed.utcoffset()
+        index = len(self.ids)
+        if index and epoch < self.starts[-1]:
+            # Rows arrive in time order; keep the columns sorted if one does not
+            index = int(np.searchsorted(np.frombuffer(self.starts, dtype=np.float64), epoch, side='right'))
+        self.ids.insert(index, row_id)
+        self.starts.insert(index, epoch)
+        self.seconds.insert(index, math.floor(epoch))
+        self.offsets.insert(index, int(offset.total_seconds()) if offset is not None else 0)
+        self.durations.insert(index, float(duration or 0.0))
+        self.state_codes.insert(index, self._code(self.state_names, self._state_lookup, state))
+        self.tag_ids.insert(index, NO_TAG if tag_id is None else int(tag_id))
+        self.description_codes.insert(index, self._code(self.descriptions, self._description_lookup, description))
+        self.timestamps.insert(index, timestamp)
+
+    def load(self, connect: Callable, now: Optional[float] = None) -> int:
+        """
+        Fill the cache from the database.
+
+        Args:
+            connect: Returns a sqlite3 connection with the state_changes table
+            now: Current epoch time (default: time.time())
+
+        Returns:
+            Number of cached rows
+        """
+        since = math.floor((now or time.time()) - self.days * 86400)
+        since_iso = datetime.fromtimestamp(since, timezone.utc).isoformat()
+        db = connect()
+        try:
+            rows = db.execute('''
+                SELECT id, timestamp, state, description, tag_id, duration FROM state_changes
+                WHERE datetime(timestamp) >= datetime(?) ORDER BY id
+            ''', (since_iso,)).fetchall()
+        finally:
+            db.close()
+
+        with self._lock:
+            self._reset_columns()
+            seen = set()
+            for row in rows:
+                self._append_row(*row)
+                seen.add(row[0])
+            for row in self._pending:
+                if row[0] not in seen and _sql_seconds(row[1]) >= since:
+                    self._append_row(*row)
+            self._pending = []
+            self.since = since
+            self.loaded = True
+            return len(self.ids)
+
+    def covers(self, start_time) -> bool:
+        """Whether every row at or after start_time is in the cache."""
+        return self.loaded and _sql_seconds(start_time) >= self.since
+
+    def append(self, row_id: int, timestamp: str, state: str, description: Optional[str] = None,
+               tag_id: Optional[int] = None, duration: Optional[float] = 0.0):
+        """Add a row the writer just inserted. Rows already cached (same id) are ignored."""
+        with self._lock:
+            if not self.loaded:
+                self._pending.append((row_id, timestamp, state, description, tag_id, duration))
+                return
+            if len(self.ids) and row_id in self.ids[-64:]:
+                return
+            self._append_row(row_id, timestamp, state, description, tag_id, duration)
+            self._trim()
+
+    def update_duration(self, row_id: int, duration: float):
+        """Mirror an UPDATE of a row's duration."""
+        with self._lock:
+            if not self.loaded:
+                self._pending = [row[:5] + (duration,) if row[0] == row_id else row for row in self._pending]
+                return
+            for index in range(len(self.ids) - 1, -1, -1):
+                if self.ids[index] == row_id:
+                    self.durations[index] = float(duration or 0.0)
+                    return
+
+    def clear(self):
+        """Mirror deleting all rows."""
+        with self._lock:
+            self._reset_columns()
+            self._pending = []
+
+    def _trim(self):
+        # Drop rows a day past the window, in one slice rather than per row
+        cutoff = math.floor(time.time() - self.days * 86400)
+        if not len(self.seconds) or self.seconds[0] >= cutoff - 86400:
+            return
+        keep = int(np.searchsorted(np.frombuffer(self.seconds, dtype=np.int64), cutoff, side='left'))
+        for column in (self.ids, self.starts, self.seconds, self.offsets, self.durations,
+                       self.state_codes, self.tag_ids, self.description_codes):
+            del column[:keep]
+        del self.timestamps[:keep]
+        self.since = cutoff
+
+    def _range(self, start_time, end_time):
+        seconds = np.frombuffer(self.seconds, dtype=np.int64)
+        lo = int(np.searchsorted(seconds, _sql_seconds(start_time), side='left'))
+        hi = int(np.searchsorted(seconds, _sql_seconds(end_time), side='right'))
+        return lo, max(lo, hi)
+
+    def state_totals(self, start_time, end_time) -> Dict[str, float]:
+        """Total duration per state, like get_state_counts."""
+        with self._lock:
+            lo, hi = self._range(start_time, end_time)
+            codes = np.frombuffer(self.state_codes, dtype=np.uint8)[lo:hi]
+            totals = np.bincount(codes, weights=np.frombuffer(self.durations, dtype=np.float64)[lo:hi],
+                                 minlength=len(TRACKED_STATES))
+            counts = np.bincount(codes, minlength=len(TRACKED_STATES))
+            # States without rows stay 0, like the SQL version
+            return {state: float(totals[code]) if counts[code] else 0 for code, state in enumerate(TRACKED_STATES)}
+
+    def daily_totals(self, start_time, end_time) -> Dict[str, Dict]:
+        """Per-day running/idle/error durations and efficiency, by each row's local date."""
+        with self._lock:
+            lo, hi = self._range(start_time, end_time)
+            if lo == hi:
+                return {}
+            local = (np.frombuffer(self.starts, dtype=np.float64)[lo:hi]
+                     + np.frombuffer(self.offsets, dtype=np.int32)[lo:hi])
+            day_index = np.floor(local / 86400).astype(np.int64)
+            days, positions = np.unique(day_index, return_inverse=True)
+            codes = np.frombuffer(self.state_codes, dtype=np.uint8)[lo:hi].astype(np.int64)
+            # Tracked states only; other states count towards nothing, like the SQL version
+            tracked = codes < len(TRACKED_STATES)
+            cells = (positions[tracked], codes[tracked])
+            totals = np.zeros((len(days), len(TRACKED_STATES)))
+            np.add.at(totals, cells, np.frombuffer(self.durations, dtype=np.float64)[lo:hi][tracked])
+            counts = np.zeros((len(days), len(TRACKED_STATES)), dtype=np.int64)
+            np.add.at(counts, cells, 1)
+
+        epoch_ordinal = date(1970, 1, 1).toordinal()
+        daily = {}
+        for day, row_totals, row_counts in zip(days.tolist(), totals.tolist(), counts.tolist()):
+            running, idle, error = (total if count else 0 for total, count in zip(row_totals, row_counts))
+            total = running + idle + error
+            daily[date.fromordinal(epoch_ordinal + day).isoformat()] = {
+                "running_duration": running,
+                "idle_duration": idle,
+                "error_duration": error,
+                "efficiency": round((running / total * 100) if total > 0 else 0, 1)
+            }
+        return daily
+
+    def hourly_totals(self, start_time, end_time) -> Dict[int, Dict]:
+        """Durations per local hour of day, splitting states that span an hour boundary."""
+        hourly = {h: {"running_duration": 0, "idle_duration": 0, "error_duration": 0} for h in range(24)}
+        keys = ('running_duration', 'idle_duration', 'error_duration')
+        with self._lock:
+            lo, hi = self._range(start_time, end_time)
+            rows = list(zip(self.starts[lo:hi], self.offsets[lo:hi], self.durations[lo:hi], self.state_codes[lo:hi]))
+        # Work in whole microseconds, as the datetime arithmetic of the SQL version does
+        for start, offset, duration, code in rows:
+            if duration <= 0 or code >= len(TRACKED_STATES):
+                continue
+            cur = round(start * 1e6) + offset * 1000000
+            end = cur + round(duration * 1e6)
+            while cur < end:
+                next_hour = (cur // 3600000000 + 1) * 3600000000
+                seg_end = min(end, next_hour)
+                hourly[cur // 3600000000 % 24][keys[code]] += (seg_end - cur) / 1e6
+                cur = seg_end
+        return hourly
+
+    def _event(self, index: int) -> StateEvent:
+        tag_id = self.tag_ids[index]
+        return StateEvent(self.ids[index], self.timestamps[index], self.state_names[self.state_codes[index]],
+                          self.descriptions[self.description_codes[index]],
+                          None if tag_id == NO_TAG else tag_id, self.durations[index])
+
+    def events(self, start_time, end_time, state: Optional[str] = None, limit: Optional[int] = None,
+               newest_first: bool = False) -> List[StateEvent]:
+        """Rows in a time range, optionally filtered by state."""
+        with self._lock:
+            lo, hi = self._range(start_time, end_time)
+            indices = np.arange(lo, hi)
+            if state is not None:
+                code = self._state_lookup.get(state)
+                if code is None:
+                    return []
+                indices = indices[np.frombuffer(self.state_codes, dtype=np.uint8)[lo:hi] == code]
+            if newest_first:
+                indices = indices[::-1]
+            if limit is not None:
+                indices = indices[:max(0, limit)]
+            return [self._event(index) for index in indices.tolist()]
+
+    def latest(self) -> Optional[StateEvent]:
+        with self._lock:
+            return self._event(len(self.ids) - 1) if len(self.ids) else None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'loaded': self.loaded,
+                'rows': len(self.ids),
+                'days': self.days,
+                'since': datetime.fromtimestamp(self.since, timezone.utc).isoformat() if self.since is not None else None
+            }
+
+history_cache = HistoryCache()
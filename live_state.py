@@ -0,0 +1,93 @@
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from models import CST
+
+class StateSnapshot(NamedTuple):
+    """Immutable view of the machine state at one point in time."""
+    state: str
+    since: float  # Epoch time the state started
+    tag_id: Optional[int]
+    confidence: float  # Fraction of recent frames in which a tag was detected
+    seq: int  # Increases by one with every published change
+    description: str = ''
+    source: str = 'detector'  # 'detector', or 'database' for the cold-start snapshot
+
+    def to_dict(self) -> Dict:
+        return {
+            "state": self.state,
+            "description": self.description,
+            "timestamp": datetime.fromtimestamp(self.since, CST).isoformat(),
+            "since": self.since,
+            "duration": round(max(0.0, time.time() - self.since), 3),
+            "last_tag_id": self.tag_id,
+            "confidence": round(self.confidence, 3),
+            "seq": self.seq,
+            "source": self.source
+        }
+
+class LiveStateStore:
+    """
+    Latest machine state, owned by the camera pipeline.
+
+    The pipeline publishes a new StateSnapshot on every change; readers get the
+    current one with a single attribute read, which is atomic, so they never see a
+    half-updated state and never take a lock. The database is only read once, to seed
+    the store at startup.
+    """
+
+    def __init__(self, confidence_window: int = 30):
+        """
+        Args:
+            confidence_window: Number of recent frames used for the detection confidence
+        """
+        self._snapshot: Optional[StateSnapshot] = None
+        self._write_lock = threading.Lock()
+        self._detections = deque(maxlen=confidence_window)
+        self._listeners: List[Callable[[StateSnapshot], None]] = []
+
+    def get(self) -> Optional[StateSnapshot]:
+        """Current snapshot, or None before anything is known."""
+        return self._snapshot
+
+    def _swap(self, only_if_empty: bool = False, **fields) -> Optional[StateSnapshot]:
+        with self._write_lock:
+            previous = self._snapshot
+            if only_if_empty and previous is not None:
+                return None
+            seq = previous.seq + 1 if previous is not None else 1
+            snapshot = StateSnapshot(seq=seq, **fields)
+            self._snapshot = snapshot
+        for listener in self._listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                print(f"Error in live state listener: {e}")
+        return snapshot
+
+    def seed(self, state: str, since: float, tag_id: Optional[int] = None, description: str = '') -> Optional[StateSnapshot]:
+        """Set the cold-start snapshot from the database, unless the pipeline already published."""
+        # Checked under the write lock, so a publish from the camera thread always wins
+        return self._swap(only_if_empty=True, state=state, since=since, tag_id=tag_id, confidence=0.0,
+                          description=description, source='database')
+
+    def record_frame(self, tag_detected: bool) -> float:
+        """Note whether a processed frame contained a tag and return the current confidence."""
+        self._detections.append(1 if tag_detected else 0)
+        return sum(self._detections) / len(self._detections)
+
+    def publish(self, state: str, tag_id: Optional[int], description: str = '',
+                since: Optional[float] = None) -> StateSnapshot:
+        """Publish a state change detected by the pipeline."""
+        confidence = sum(self._detections) / len(self._detections) if self._detections else 0.0
+        return self._swap(state=state, since=time.time() if since is None else since, tag_id=tag_id,
+                          confidence=confidence, description=description, source='detector')
+
+    def add_listener(self, callback: Callable[[StateSnapshot], None]):
+        """Call callback with every new snapshot, from the publishing thread."""
+        self._listeners.append(callback)
+
+live_state = LiveStateStore()
@@ -16,18 +16,29 @@ import io
 import csv
 
 from models import get_db, MachineState, init_db, calculate_hourly_metrics, CST, Base
-from apriltag_detector import detector
+import apriltag_detector
+from ws_protocol import BINARY_SUBPROTOCOL, Frame, make_update, wants_binary
+
+async def start_detector():
+    """Initialize the database and open the camera concurrently, then run the detector."""
+    await asyncio.gather(
+        asyncio.to_thread(init_db),
+        asyncio.to_thread(apriltag_detector.initialize_detector)
+    )
+    if apriltag_detector.detector is not None:
+        await apriltag_detector.detector.run()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup
-    detector_task = asyncio.create_task(detector.run())
+    # Startup: hardware and database come up in the background so requests are served immediately
+    detector_task = asyncio.create_task(start_detector())
     broadcast_task = asyncio.create_task(broadcast_state_updates())
     yield
     # Shutdown
     detector_task.cancel()
     broadcast_task.cancel()
-    if detector.cap:
+    detector = apriltag_detector.detector
+    if detector is not None and detector.cap:
         detector.cap.release()
     cv2.destroyAllWindows()
 
@@ -45,24 +56,37 @@ async def get_index():
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
+    # Clients asking for the MessagePack subprotocol get compact binary frames (see ws_protocol.py)
+    binary = wants_binary(websocket.scope.get("subprotocols", []))
+    await websocket.accept(subprotocol=BINARY_SUBPROTOCOL if binary else None)
     try:
+        if binary:
+            await websocket.send_bytes(Frame.hello([[0, "local", "local"]]).binary())
+        last_sent = None
         while True:
             # Only send updates during working hours
             now = datetime.now(CST)
-            if MachineState.is_working_hours(now):
-                # Add rate limiting to WebSocket updates
-                await websocket.send_json({
+            detector = apriltag_detector.detector
+            if detector is not None and MachineState.is_working_hours(now):
+                message = {
                     "state": detector.current_state,
                     "last_tag_id": detector.last_tag_id
-                })
-                await asyncio.sleep(0.1)  # Limit to 10 updates per second
+                }
+                delay = 0.1  # Limit to 10 updates per second
             else:
-                await websocket.send_json({
+                message = {
                     "state": "OFFLINE",
                     "last_tag_id": None
-                })
-                await asyncio.sleep(1.0)  # Slower updates when offline
+                }
+                delay = 1.0  # Slower updates when offline
+            if not binary:
+                await websocket.send_json(message)
+            elif message != last_sent:
+                # Binary clients only get changes, stamped with when the change was seen
+                update = make_update(0, dict(message, since=time.time()))
+                await websocket.send_bytes(Frame.updates([update]).binary())
+            last_sent = message
+            await asyncio.sleep(delay)
     except Exception as e:
         print(f"WebSocket error: {e}")
     finally:
@@ -203,12 +227,14 @@ def clear_all_data(db: Session = Depends(get_db)):
         db.commit()
         
         # Reset detector state
-        detector.last_position = None
-        detector.last_detection_time = None
-        detector.current_state = 'IDLE'
-        detector.pending_state = None
-        detector.pending_state_start_time = None
-        detector.movement_history = []
+        detector = apriltag_detector.detector
+        if detector is not None:
+            detector.last_position = None
+            detector.last_detection_time = None
+            detector.current_state = 'IDLE'
+            detector.pending_state = None
+            detector.pending_state_start_time = None
+            detector.movement_history = []
         
         return {"status": "success", "message": "All state data cleared successfully"}
     except Exception as e:
@@ -238,13 +264,6 @@ def open_browser():
     time.sleep(2)  # Wait for the server to start
     webbrowser.open('http://localhost:8080')
 
-@app.on_event("startup")
-async def startup_event():
-    # Initialize database
-    init_db()
-    # Start the detector
-    asyncio.create_task(detector.run())
-
 @app.get("/api/export_states")
 def export_states(db: Session = Depends(get_db)):
     """Export all state changes as a CSV file."""
@@ -0,0 +1,40 @@
+import cv2
+
+from apriltag_detector import DetectionResult
+from telemetry import Histogram
+
+OVERLAY_SECONDS = Histogram('cnc_overlay_seconds', 'Time spent drawing the detection overlay on streamed frames')
+
+OVERLAY_COLOR = (0, 255, 0)
+
+def draw_overlay(frame, result: DetectionResult):
+    """
+    Draw a detection result onto a frame in place.
+
+    Only frames that are actually sent to a viewer need this, so it is kept out of
+    the detector: the detection loop never pays for drawing.
+
+    Args:
+        frame: BGR frame to draw on (copy it first if it is shared)
+        result: Detection for this frame, or the latest one available
+
+    Returns:
+        The same frame
+    """
+    with OVERLAY_SECONDS.time():
+        if result.tag_id is not None and len(result.corners) > 0:
+            cv2.aruco.drawDetectedMarkers(frame, result.corners, result.ids)
+        if result.position is not None:
+            center = (int(result.position[0]), int(result.position[1]))
+            cv2.circle(frame, center, 5, OVERLAY_COLOR, -1)
+
+        state_text = f"State: {result.state}"
+        if result.tag_id is not None:
+            state_text += f" (Tag: {result.tag_id})"
+        if result.pending_state:
+            state_text += f" (pending {result.pending_state})"
+        cv2.putText(frame, state_text, (10, 30), cv2.FONT_HERSHEY_SIMPLEX, 1, OVERLAY_COLOR, 2)
+        if result.position is not None:
+            cv2.putText(frame, f"Speed: {result.velocity:.1f} {result.velocity_units}",
+                        (10, 60), cv2.FONT_HERSHEY_SIMPLEX, 1, OVERLAY_COLOR, 2)
+    return frame
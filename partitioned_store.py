@@ -0,0 +1,323 @@
+import argparse
+import glob
+import os
+import re
+import sqlite3
+import threading
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, List, Optional
+
+from history_cache import to_epoch
+
+# Directory holding one state_changes database per period; partitioning is off when unset
+PARTITION_DIR = os.getenv('PARTITION_DIR', '')
+# 'month' or 'week'
+PARTITION_GRANULARITY = os.getenv('PARTITION_GRANULARITY', 'month')
+# Extra directory searched for older partitions, e.g. slower or network storage
+PARTITION_ARCHIVE_DIR = os.getenv('PARTITION_ARCHIVE_DIR', '')
+
+STATE_CHANGES_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS state_changes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT NOT NULL,
+        state TEXT NOT NULL,
+        description TEXT,
+        tag_id INTEGER,
+        duration REAL
+    )
+'''
+
+# Ids of each partition start at its period number times this, so ids stay unique and
+# increasing across partitions while remaining exact in JavaScript
+ID_BLOCK = 1_000_000_000
+EPOCH = date(2000, 1, 3)  # A Monday, so week numbers start on ISO weeks
+
+# SQLite's default SQLITE_MAX_ATTACHED; Python 3.9 cannot query the real limit
+DEFAULT_ATTACH_LIMIT = 10
+
+def _utc(value) -> datetime:
+    # Partitions follow datetime(timestamp), which reads timestamps in UTC and naive values as UTC
+    return datetime.fromtimestamp(to_epoch(value), timezone.utc)
+
+class PartitionedStore:
+    """
+    state_changes split into one SQLite file per month (or week).
+
+    Readers get a connection to the main database with only the partitions that
+    overlap the requested period attached and a temporary state_changes view over
+    them, so existing queries run unchanged and a query for today opens one file no
+    matter how much history exists. Partitions older than the newest one no longer
+    change: they are switched out of WAL mode and attached read-only and immutable,
+    which lets SQLite skip locking and change checks, and they can be moved to
+    PARTITION_ARCHIVE_DIR.
+
+    The writer opens the current partition as its main database with the main
+    database attached, so inserts and lastrowid work as before and tables such as the
+    replication outbox still resolve. A commit through it is atomic per file only;
+    the replication shipper reconciles its outbox on startup for that reason.
+    """
+
+    def __init__(self, directory: str, main_path: str, granularity: str = PARTITION_GRANULARITY,
+                 archive_dir: str = PARTITION_ARCHIVE_DIR):
+        """
+        Args:
+            directory: Where new partitions are created
+            main_path: Main database (rollups, replication outbox)
+            granularity: 'month' or 'week'
+            archive_dir: Additional directory searched for partitions, or ''
+        """
+        if granularity not in ('month', 'week'):
+            raise ValueError(f"Unknown partition granularity: {granularity}")
+        self.directory = directory
+        self.main_path = main_path
+        self.granularity = granularity
+        self.archive_dir = archive_dir
+        self._lock = threading.Lock()
+
+    # Period arithmetic
+
+    def period_index(self, value) -> int:
+        moment = _utc(value)
+        if self.granularity == 'month':
+            return (moment.year - 2000) * 12 + moment.month - 1
+        return (moment.date() - EPOCH).days // 7
+
+    def key(self, index: int) -> str:
+        if self.granularity == 'month':
+            return f"{2000 + index // 12:04d}-{index % 12 + 1:02d}"
+        return (EPOCH + timedelta(weeks=index)).strftime('%G-W%V')
+
+    def index_of(self, key: str) -> int:
+        if self.granularity == 'month':
+            year, month = map(int, key.split('-'))
+            return (year - 2000) * 12 + month - 1
+        year, week = map(int, key.split('-W'))
+        return (date.fromisocalendar(year, week, 1) - EPOCH).days // 7
+
+    # Partition files
+
+    def partitions(self) -> Dict[int, str]:
+        """Existing partitions by period index; the main directory wins over the archive."""
+        found = {}
+        pattern = r'state_changes-(\d{4}-(?:W\d{2}|\d{2}))\.db$'
+        for directory in (self.archive_dir, self.directory):
+            if not directory:
+                continue
+            for path in glob.glob(os.path.join(directory, 'state_changes-*.db')):
+                match = re.search(pattern, os.path.basename(path))
+                if match:
+                    found[self.index_of(match.group(1))] = path
+        return dict(sorted(found.items()))
+
+    def path(self, index: int) -> str:
+        return os.path.join(self.directory, f"state_changes-{self.key(index)}.db")
+
+    def _create(self, index: int, previous: Optional[str]) -> str:
+        os.makedirs(self.directory, exist_ok=True)
+        path = self.path(index)
+        db = sqlite3.connect(path)
+        try:
+            db.execute('PRAGMA journal_mode=WAL')
+            db.execute(STATE_CHANGES_SCHEMA)
+            db.execute("INSERT INTO sqlite_sequence (name, seq) SELECT 'state_changes', ? "
+                       "WHERE NOT EXISTS (SELECT 1 FROM sqlite_sequence WHERE name = 'state_changes')",
+                       (index * ID_BLOCK,))
+            if previous is not None:
+                # The state in progress moves along, so the writer can still update its duration
+                db.execute('ATTACH DATABASE ? AS previous', (previous,))
+                db.execute('''
+                    INSERT INTO state_changes SELECT * FROM previous.state_changes
+                    WHERE id = (SELECT MAX(id) FROM previous.state_changes)
+                ''')
+                db.execute('DELETE FROM previous.state_changes WHERE id IN (SELECT id FROM main.state_changes)')
+            db.commit()
+            if previous is not None:
+                db.execute('DETACH DATABASE previous')
+        finally:
+            db.close()
+        if previous is not None:
+            self.close_partition(previous)
+        return path
+
+    def close_partition(self, path: str):
+        """Checkpoint a partition that will not be written again into a single self-contained file."""
+        db = sqlite3.connect(path)
+        try:
+            db.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            db.execute('PRAGMA journal_mode=DELETE')
+        finally:
+            db.close()
+
+    def current(self) -> str:
+        """Path of the partition for now, creating it (and closing the previous one) if needed."""
+        index = self.period_index(datetime.now(timezone.utc))
+        with self._lock:
+            partitions = self.partitions()
+            if index in partitions:
+                return partitions[index]
+            older = [i for i in partitions if i < index]
+            return self._create(index, partitions[older[-1]] if older else None)
+
+    # Connections
+
+    def _connect(self, path: str) -> sqlite3.Connection:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        db = sqlite3.connect(path, uri=path.startswith('file:'))
+        db.row_factory = sqlite3.Row
+        return db
+
+    def select(self, start_time=None, end_time=None) -> List[str]:
+        """
+        Partitions a query between start_time and end_time (None for unbounded) has to read.
+
+        The partition after the range is included because its first row can be the
+        state that was in progress when it was created.
+        """
+        partitions = self.partitions()
+        first = self.period_index(start_time) if start_time is not None else None
+        last = self.period_index(end_time) if end_time is not None else None
+        chosen = [i for i in partitions if (first is None or i >= first) and (last is None or i <= last)]
+        following = [i for i in partitions if last is not None and i > last]
+        if following:
+            chosen.append(following[0])
+        return [partitions[i] for i in chosen]
+
+    def connect(self, start_time=None, end_time=None) -> sqlite3.Connection:
+        """Connection to the main database with a temporary state_changes view over the period."""
+        return self._connect_view(self.select(start_time, end_time))
+
+    def connect_from_id(self, first_id: Optional[int] = None) -> sqlite3.Connection:
+        """
+        Connection with a state_changes view over the partitions that can hold ids from first_id on.
+
+        Ids of each partition start at its period index times ID_BLOCK; rows migrated
+        from an unpartitioned database keep their small ids, so those attach everything.
+        """
+        partitions = self.partitions()
+        first = first_id // ID_BLOCK if first_id else None
+        return self._connect_view([path for index, path in partitions.items() if first is None or index >= first])
+
+    def connect_main(self) -> sqlite3.Connection:
+        """Connection to the main database alone (rollups, replication outbox), attaching no partitions."""
+        return self._connect(self.main_path)
+
+    def _connect_view(self, paths: List[str]) -> sqlite3.Connection:
+        newest = max(self.partitions().values(), key=self._index_of_path, default=None)
+        db = sqlite3.connect(self.main_path, uri=True)
+        db.row_factory = sqlite3.Row
+        limit = db.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED) if hasattr(db, 'getlimit') else DEFAULT_ATTACH_LIMIT
+
+        def uri(path):
+            if path == newest:
+                return path
+            return f"file:{os.path.abspath(path)}?mode=ro&immutable=1"
+
+        if len(paths) <= limit:
+            for i, path in enumerate(paths):
+                db.execute(f'ATTACH DATABASE ? AS p{i}', (uri(path),))
+            selects = [f'SELECT * FROM p{i}.state_changes' for i in range(len(paths))]
+            if not selects:
+                selects = ['SELECT * FROM (SELECT NULL AS id, NULL AS timestamp, NULL AS state, NULL AS description, '
+                           'NULL AS tag_id, NULL AS duration) WHERE 0']
+            db.execute(f"CREATE TEMP VIEW state_changes AS {' UNION ALL '.join(selects)}")
+        else:
+            # More partitions than SQLite can attach at once: gather them in a temporary table
+            db.execute('CREATE TEMP TABLE state_changes (id INTEGER PRIMARY KEY, timestamp TEXT NOT NULL, '
+                       'state TEXT NOT NULL, description TEXT, tag_id INTEGER, duration REAL)')
+            for path in paths:
+                db.execute('ATTACH DATABASE ? AS source', (uri(path),))
+                db.execute('INSERT INTO temp.state_changes SELECT * FROM source.state_changes')
+                db.commit()
+                db.execute('DETACH DATABASE source')
+        return db
+
+    def connect_writer(self) -> sqlite3.Connection:
+        """Connection whose main database is the current partition, with the main database attached."""
+        db = self._connect(self.current())
+        db.execute('ATTACH DATABASE ? AS shared', (self.main_path,))
+        return db
+
+    def _index_of_path(self, path: str) -> int:
+        match = re.search(r'state_changes-(\d{4}-(?:W\d{2}|\d{2}))\.db$', path)
+        return self.index_of(match.group(1))
+
+    def clear(self):
+        """Delete every partition and start an empty current one."""
+        with self._lock:
+            for path in self.partitions().values():
+                for suffix in ('', '-wal', '-shm'):
+                    if os.path.exists(path + suffix):
+                        os.remove(path + suffix)
+        self.current()
+
+    def status(self) -> Dict:
+        partitions = self.partitions()
+        return {
+            'directory': self.directory,
+            'granularity': self.granularity,
+            'partitions': len(partitions),
+            'current': self.key(self.period_index(datetime.now(timezone.utc))),
+            'oldest': self.key(next(iter(partitions))) if partitions else None,
+            'size_bytes': sum(os.path.getsize(path) for path in partitions.values())
+        }
+
+def migrate(store: PartitionedStore, batch_size: int = 10000) -> int:
+    """
+    Move rows from the main database's state_changes table into partitions.
+
+    Ids are kept. The old table is renamed to state_changes_unpartitioned rather than
+    dropped; remove it once the partitions have been checked.
+
+    Returns:
+        Number of rows moved
+    """
+    source = sqlite3.connect(store.main_path)
+    try:
+        if not source.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'state_changes'").fetchone():
+            return 0
+        rows = source.execute('SELECT id, timestamp, state, description, tag_id, duration FROM state_changes '
+                              'ORDER BY id').fetchall()
+    finally:
+        source.close()
+
+    by_partition: Dict[int, list] = {}
+    for row in rows:
+        by_partition.setdefault(store.period_index(row[1]), []).append(row)
+    for index, partition_rows in by_partition.items():
+        path = store.partitions().get(index) or store._create(index, None)
+        db = sqlite3.connect(path)
+        try:
+            for start in range(0, len(partition_rows), batch_size):
+                db.executemany('INSERT OR REPLACE INTO state_changes VALUES (?, ?, ?, ?, ?, ?)',
+                               partition_rows[start:start + batch_size])
+            db.commit()
+        finally:
+            db.close()
+    newest = max(by_partition, default=None)
+    for index, path in store.partitions().items():
+        if newest is not None and index < newest:
+            store.close_partition(path)
+
+    source = sqlite3.connect(store.main_path)
+    try:
+        source.execute('ALTER TABLE state_changes RENAME TO state_changes_unpartitioned')
+        source.commit()
+    finally:
+        source.close()
+    return len(rows)
+
+def main():
+    parser = argparse.ArgumentParser(description="Split the state_changes table into per-period database files.")
+    parser.add_argument('--db', default=os.getenv('DATABASE_PATH', 'machine_states.db'), help="Main database file")
+    parser.add_argument('--dir', default=PARTITION_DIR or 'data/partitions', help="Partition directory")
+    parser.add_argument('--granularity', default=PARTITION_GRANULARITY, choices=('month', 'week'))
+    args = parser.parse_args()
+    store = PartitionedStore(args.dir, args.db, args.granularity)
+    moved = migrate(store)
+    print(f"Moved {moved} state changes into {len(store.partitions())} partitions in {args.dir}")
+    print(f"Start the server with PARTITION_DIR={args.dir} PARTITION_GRANULARITY={args.granularity}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+# Hard limits so a profile requested over the API can never run unbounded
+MAX_PROFILE_SECONDS = 60.0
+MIN_INTERVAL = 0.001
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def _summarize(samples: List[float]) -> Dict:
+    """Summarize durations (in milliseconds)."""
+    if not samples:
+        return {'count': 0}
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'mean': round(sum(ordered) / len(ordered), 3),
+        'p95': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))], 3),
+        'max': round(ordered[-1], 3)
+    }
+
+class SamplingProfiler:
+    """
+    Statistical profiler for every thread in the process.
+
+    Periodically snapshots the stacks of all threads with sys._current_frames and counts
+    identical stacks, which yields the collapsed format read by flamegraph.pl and
+    speedscope. Nothing is hooked into the profiled code, so the capture thread and the
+    event loop run at full speed between samples.
+    """
+
+    def __init__(self, interval: float = 0.005):
+        """
+        Args:
+            interval: Seconds between samples
+        """
+        self.interval = max(MIN_INTERVAL, interval)
+        self.stacks = Counter()
+        self.samples = 0
+
+    def sample(self, skip_thread: Optional[int] = None):
+        """Record one stack per thread, prefixed with the thread name."""
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == skip_thread:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_label(frame))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, f"thread-{thread_id}"))
+            self.stacks[';'.join(reversed(stack))] += 1
+        self.samples += 1
+
+    def run(self, seconds: float) -> float:
+        """
+        Sample all other threads for the given number of seconds.
+
+        Blocks the calling thread, so call it from a worker thread.
+
+        Returns:
+            Wall time actually spent sampling (in seconds)
+        """
+        seconds = min(max(seconds, 0.0), MAX_PROFILE_SECONDS)
+        own_thread = threading.get_ident()
+        start = time.perf_counter()
+        deadline = start + seconds
+        next_sample = start
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            if now < next_sample:
+                time.sleep(next_sample - now)
+            self.sample(skip_thread=own_thread)
+            next_sample += self.interval
+        return time.perf_counter() - start
+
+    def collapsed(self) -> str:
+        """Stacks in collapsed format, one 'frame;frame;frame count' line per stack."""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def threads(self) -> Dict[str, int]:
+        """Samples per thread name."""
+        totals = Counter()
+        for stack, count in self.stacks.items():
+            totals[stack.split(';', 1)[0]] += count
+        return dict(totals.most_common())
+
+    def top_functions(self, limit: int = 20) -> List[Dict]:
+        """Functions most often on top of the stack (self time)."""
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            thread, _, frames = stack.partition(';')
+            leaves[(thread, frames.rsplit(';', 1)[-1] if frames else '<idle>')] += count
+        total = sum(self.stacks.values()) or 1
+        return [
+            {'thread': thread, 'function': function, 'samples': count, 'percent': round(count * 100.0 / total, 1)}
+            for (thread, function), count in leaves.most_common(limit)
+        ]
+
+class _SlowCallbackHandler(logging.Handler):
+    """Collects asyncio's 'Executing <callback> took N seconds' debug warnings."""
+
+    def __init__(self):
+        super().__init__(level=logging.WARNING)
+        self.callbacks = []
+
+    def emit(self, record):
+        if record.msg.startswith('Executing ') and len(record.args or ()) == 2:
+            callback, duration = record.args
+            self.callbacks.append({'callback': str(callback)[:300], 'duration_ms': round(duration * 1000.0, 3)})
+
+class LoopLagMonitor:
+    """
+    Measures event-loop responsiveness while a profile runs.
+
+    Lag is how late a short sleep wakes up; blocked callbacks are reported by asyncio's
+    debug mode, which times every callback (e.g. a sync DB query inside an async
+    handler) and is only enabled for the duration of the profile.
+    """
+
+    def __init__(self, interval: float = 0.05, slow_callback: float = 0.02):
+        """
+        Args:
+            interval: Seconds between lag probes
+            slow_callback: Callbacks running longer than this many seconds are reported
+        """
+        self.interval = interval
+        self.slow_callback = slow_callback
+        self.lag_ms: List[float] = []
+        self._handler = _SlowCallbackHandler()
+
+    async def run(self, seconds: float):
+        loop = asyncio.get_running_loop()
+        asyncio_logger = logging.getLogger('asyncio')
+        previous = (loop.get_debug(), loop.slow_callback_duration)
+        asyncio_logger.addHandler(self._handler)
+        loop.slow_callback_duration = self.slow_callback
+        loop.set_debug(True)
+        try:
+            deadline = loop.time() + min(seconds, MAX_PROFILE_SECONDS)
+            while loop.time() < deadline:
+                start = loop.time()
+                await asyncio.sleep(self.interval)
+                self.lag_ms.append(max(0.0, (loop.time() - start - self.interval) * 1000.0))
+        finally:
+            loop.set_debug(previous[0])
+            loop.slow_callback_duration = previous[1]
+            asyncio_logger.removeHandler(self._handler)
+
+    def report(self) -> Dict:
+        return {
+            'loop_lag_ms': _summarize(self.lag_ms),
+            'blocked_callbacks': sorted(self._handler.callbacks, key=lambda c: c['duration_ms'], reverse=True)
+        }
+
+# Set while a profile runs; only touched from the event loop, so no lock is needed
+_profile_running = False
+
+def profile_in_progress() -> bool:
+    return _profile_running
+
+async def profile_process(seconds: float = 10.0, interval: float = 0.005, slow_callback: float = 0.02) -> Dict:
+    """
+    Profile the running process for a bounded time.
+
+    The sampler runs in its own thread while the lag monitor runs on the event loop,
+    so both the capture thread and request handling are covered. Only one profile
+    runs at a time.
+
+    Returns:
+        Dict with summary statistics and the collapsed stacks
+    """
+    global _profile_running
+    if _profile_running:
+        raise RuntimeError("A profile is already running")
+    seconds = min(max(seconds, 0.1), MAX_PROFILE_SECONDS)
+    _profile_running = True
+    try:
+        profiler = SamplingProfiler(interval)
+        monitor = LoopLagMonitor(slow_callback=slow_callback)
+        sampler = threading.Thread(target=profiler.run, args=(seconds,), name='profiler', daemon=True)
+        sampler.start()
+        await monitor.run(seconds)
+        await asyncio.get_running_loop().run_in_executor(None, sampler.join)
+
+        result = {
+            'duration_s': round(seconds, 3),
+            'interval_ms': round(profiler.interval * 1000.0, 3),
+            'samples': profiler.samples,
+            'threads': profiler.threads(),
+            'top_functions': profiler.top_functions()
+        }
+        result.update(monitor.report())
+        result['collapsed'] = profiler.collapsed()
+        return result
+    finally:
+        _profile_running = False
@@ -0,0 +1,357 @@
+import argparse
+import glob
+import json
+import math
+import os
+import time
+from typing import Callable, Dict, List, Optional
+
+import cv2
+import numpy as np
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+def is_replay_source(camera_id) -> bool:
+    """Check whether a camera ID refers to a recording rather than a live device."""
+    if not isinstance(camera_id, str) or camera_id.startswith('/dev/') or camera_id.isdigit():
+        return False
+    return os.path.isfile(camera_id) or os.path.isdir(camera_id) or any(ch in camera_id for ch in '*?[')
+
+class ReplaySource:
+    """
+    Frame source that plays back a video file or an image sequence.
+
+    Mirrors the parts of cv2.VideoCapture used by the detector (read, grab, get, set,
+    isOpened, release) so it can stand in for a live camera.
+    """
+
+    def __init__(self, path: str, realtime: bool = False, loop: bool = False, fps: Optional[float] = None):
+        """
+        Open a recording for replay.
+
+        Args:
+            path: Video file, directory of images or glob pattern
+            realtime: Pace frames at the recording's native rate instead of max speed
+            loop: Restart from the first frame when the recording ends
+            fps: Frame rate for image sequences, or to override the video's rate
+        """
+        self.path = path
+        self.realtime = realtime
+        self.loop = loop
+        self.cap = None
+        self.files = None
+        self.index = 0
+        self.timestamp = 0.0  # Media time of the last frame (in seconds)
+        self._frame_shape = None
+        self._start_time = None
+
+        if os.path.isdir(path) or any(ch in path for ch in '*?['):
+            pattern = os.path.join(path, '*') if os.path.isdir(path) else path
+            self.files = sorted(f for f in glob.glob(pattern) if f.lower().endswith(IMAGE_EXTENSIONS))
+            self.fps = fps or 30.0
+        else:
+            self.cap = cv2.VideoCapture(path)
+            native_fps = self.cap.get(cv2.CAP_PROP_FPS) if self.cap.isOpened() else 0
+            self.fps = fps or native_fps or 30.0
+
+    def isOpened(self) -> bool:
+        if self.files is not None:
+            return len(self.files) > 0
+        return self.cap is not None and self.cap.isOpened()
+
+    def _read_next(self):
+        if self.files is not None:
+            if self.index >= len(self.files):
+                return False, None
+            frame = cv2.imread(self.files[self.index])
+            return frame is not None, frame
+        return self.cap.read()
+
+    def _rewind(self):
+        self.index = 0
+        self._start_time = None
+        if self.cap is not None:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+
+    def read(self):
+        """Return (ret, frame) for the next frame, like cv2.VideoCapture.read."""
+        if not self.isOpened():
+            return False, None
+
+        ret, frame = self._read_next()
+        if not ret and self.loop and self.index > 0:
+            self._rewind()
+            ret, frame = self._read_next()
+        if not ret:
+            return False, None
+
+        self.timestamp = self.index / self.fps
+        self.index += 1
+        self._frame_shape = frame.shape
+
+        if self.realtime:
+            if self._start_time is None:
+                self._start_time = time.perf_counter() - self.timestamp
+            delay = self._start_time + self.timestamp - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+        return True, frame
+
+    def grab(self) -> bool:
+        ret, _ = self.read()
+        return ret
+
+    def get(self, prop) -> float:
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        if prop == cv2.CAP_PROP_POS_FRAMES:
+            return float(self.index)
+        if prop == cv2.CAP_PROP_POS_MSEC:
+            return self.timestamp * 1000.0
+        if prop == cv2.CAP_PROP_FRAME_COUNT:
+            if self.files is not None:
+                return float(len(self.files))
+            return self.cap.get(cv2.CAP_PROP_FRAME_COUNT)
+        if prop in (cv2.CAP_PROP_FRAME_WIDTH, cv2.CAP_PROP_FRAME_HEIGHT):
+            if self._frame_shape is None:
+                if self.cap is not None:
+                    return self.cap.get(prop)
+                if self.files:
+                    first = cv2.imread(self.files[0])
+                    self._frame_shape = first.shape if first is not None else None
+            if self._frame_shape is None:
+                return 0.0
+            return float(self._frame_shape[1] if prop == cv2.CAP_PROP_FRAME_WIDTH else self._frame_shape[0])
+        return 0.0
+
+    def set(self, prop, value) -> bool:
+        """Camera controls do not apply to recordings."""
+        return False
+
+    def release(self):
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+        self.files = [] if self.files is not None else None
+
+def run_replay(path: str, detector=None, realtime: bool = False, max_frames: Optional[int] = None,
+               on_frame: Optional[Callable[[Dict], None]] = None, every: int = 1, **detector_kwargs) -> Dict:
+    """
+    Feed a recording through ArUcoStateDetector.detect_state.
+
+    Frame timestamps come from the recording, so time-based state logic (error timeout,
+    state change delay, movement window) behaves the same at max speed as in real time.
+
+    Args:
+        path: Video file, directory of images or glob pattern
+        detector: Detector to use (default: a new ArUcoStateDetector on the recording)
+        realtime: Replay at the recording's native frame rate
+        max_frames: Stop after this many frames
+        on_frame: Called with each per-frame record
+        every: Only process every Nth frame, to check that states hold at a lower processing rate
+        **detector_kwargs: Passed to ArUcoStateDetector when creating one
+
+    Returns:
+        Dict with per-frame records, state transitions and a timing summary
+    """
+    from apriltag_detector import ArUcoStateDetector
+
+    if not is_replay_source(path):
+        raise ValueError(f"{path} is not a recording")
+    if detector is None:
+        detector = ArUcoStateDetector(camera_id=path, **detector_kwargs)
+    source = detector.cap
+    source.realtime = realtime
+    source.loop = False
+
+    base_time = time.time()
+    frames: List[Dict] = []
+    transitions: List[Dict] = []
+    previous_state = detector.current_state
+    wall_start = time.perf_counter()
+
+    while max_frames is None or len(frames) < max_frames:
+        read_start = time.perf_counter()
+        ret, frame = source.read()
+        capture_ms = (time.perf_counter() - read_start) * 1000.0
+        if not ret:
+            break
+        if (source.index - 1) % every != 0:
+            continue
+
+        detect_start = time.perf_counter()
+        state, tag_id, _ = detector.detect_state(frame, timestamp=base_time + source.timestamp)
+        detect_ms = (time.perf_counter() - detect_start) * 1000.0
+
+        record = {
+            'frame': source.index - 1,
+            'media_time': round(source.timestamp, 4),
+            'capture_ms': round(capture_ms, 3),
+            'detect_ms': round(detect_ms, 3),
+            'state': state,
+            'tag_id': tag_id,
+            'position': [round(v, 2) for v in detector.last_position] if tag_id is not None else None,
+            'velocity': round(detector.last_velocity, 2) if tag_id is not None else None
+        }
+        frames.append(record)
+        if state != previous_state:
+            transitions.append({
+                'frame': record['frame'],
+                'media_time': record['media_time'],
+                'from': previous_state,
+                'to': state
+            })
+            previous_state = state
+        if on_frame is not None:
+            on_frame(record)
+
+    wall_time = time.perf_counter() - wall_start
+    source.release()
+
+    detect_times = np.array([f['detect_ms'] for f in frames]) if frames else np.zeros(1)
+    summary = {
+        'recording': path,
+        'opencv_version': cv2.__version__,
+        'profile': detector.profile,
+        'realtime': realtime,
+        'every': every,
+        'velocity_threshold': f"{detector.get_velocity_threshold():g} {detector.velocity_units()}",
+        'frames': len(frames),
+        'frames_with_tag': sum(1 for f in frames if f['tag_id'] is not None),
+        'wall_time_s': round(wall_time, 3),
+        'fps': round(len(frames) / wall_time, 1) if wall_time > 0 else 0.0,
+        'detect_ms_mean': round(float(detect_times.mean()), 3),
+        'detect_ms_p50': round(float(np.percentile(detect_times, 50)), 3),
+        'detect_ms_p95': round(float(np.percentile(detect_times, 95)), 3),
+        'detect_ms_max': round(float(detect_times.max()), 3),
+        'transitions': len(transitions),
+        'prefilter': detector.get_prefilter_stats(),
+        'tracking': detector.get_tracking_stats()
+    }
+    return {'summary': summary, 'transitions': transitions, 'frames': frames}
+
+def error_delays(reference: List[Dict], other: List[Dict]) -> List[float]:
+    """
+    Seconds each ERROR transition of other comes after the nearest one of reference.
+
+    Args:
+        reference: Transitions of the reference run
+        other: Transitions of the run being compared
+    """
+    expected = [t['media_time'] for t in reference if t['to'] == 'ERROR']
+    actual = [t['media_time'] for t in other if t['to'] == 'ERROR']
+    if not actual:
+        return []
+    return [round(min(actual, key=lambda a: abs(a - e)) - e, 4) for e in expected]
+
+def compare_tracking(path: str, profile: str = 'balanced', max_frames: Optional[int] = None,
+                     detect_interval: int = 10) -> Dict:
+    """
+    Measure what optical flow tracking costs in accuracy and saves in time.
+
+    The recording is replayed twice: once with a full detection on every frame (the
+    reference) and once with the hybrid tracker. Tag positions of the two runs are
+    compared frame by frame, and ERROR transitions by how much later the hybrid run
+    reports them: tracked frames never count as seeing the tag, so a covered tag still
+    turns into ERROR after the error timeout.
+
+    Returns:
+        Dict with both summaries, the position error, state agreement and ERROR delay
+    """
+    from apriltag_detector import ArUcoStateDetector
+
+    runs = {}
+    for name, tracking in (('detect_every_frame', False), ('hybrid', True)):
+        detector = ArUcoStateDetector(camera_id=path, profile=profile)
+        detector.motion_prefilter_enabled = False
+        detector.tracking_enabled = tracking
+        detector.tracking_detect_interval = detect_interval
+        runs[name] = run_replay(path, detector=detector, max_frames=max_frames)
+
+    reference, hybrid = runs['detect_every_frame']['frames'], runs['hybrid']['frames']
+    errors = [math.dist(a['position'], b['position']) for a, b in zip(reference, hybrid)
+              if a['position'] is not None and b['position'] is not None]
+    errors = np.array(errors) if errors else np.zeros(1)
+    frames = min(len(reference), len(hybrid))
+    summaries = {name: run['summary'] for name, run in runs.items()}
+    return {
+        'recording': path,
+        'frames': frames,
+        'summaries': summaries,
+        'detect_ms_mean': {name: summary['detect_ms_mean'] for name, summary in summaries.items()},
+        'speedup': round(summaries['detect_every_frame']['detect_ms_mean'] / summaries['hybrid']['detect_ms_mean'], 2)
+        if summaries['hybrid']['detect_ms_mean'] > 0 else None,
+        'detect_calls': {name: summary['tracking']['detect_calls'] for name, summary in summaries.items()},
+        'position_error_px_mean': round(float(errors.mean()), 3),
+        'position_error_px_p95': round(float(np.percentile(errors, 95)), 3),
+        'position_error_px_max': round(float(errors.max()), 3),
+        'tag_agreement': round(sum((a['tag_id'] is None) == (b['tag_id'] is None)
+                                   for a, b in zip(reference, hybrid)) / frames, 4) if frames else 0.0,
+        'state_agreement': round(sum(a['state'] == b['state'] for a, b in zip(reference, hybrid)) / frames, 4)
+        if frames else 0.0,
+        'transitions': {name: len(run['transitions']) for name, run in runs.items()},
+        'error_delay_s': error_delays(runs['detect_every_frame']['transitions'], runs['hybrid']['transitions'])
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recording through the ArUco state detector.")
+    parser.add_argument('recording', help="Video file, directory of images or glob pattern")
+    parser.add_argument('--realtime', action='store_true', help="Replay at the native frame rate instead of max speed")
+    parser.add_argument('--profile', default='balanced', help="Detector parameter profile (default: balanced)")
+    parser.add_argument('--max-frames', type=int, help="Stop after this many frames")
+    parser.add_argument('--every', type=int, default=1, help="Only process every Nth frame (default: 1)")
+    parser.add_argument('--no-prefilter', action='store_true', help="Do not reuse detections on static frames")
+    parser.add_argument('--no-tracking', action='store_true', help="Do not track tags with optical flow between detections")
+    parser.add_argument('--detect-interval', type=int, default=10,
+                        help="Frames tracked with optical flow between full detections (default: 10)")
+    parser.add_argument('--compare-tracking', action='store_true',
+                        help="Compare the hybrid tracker against detecting on every frame")
+    parser.add_argument('--truth', help="Ground truth timeline to score against (see synthetic_video.py)")
+    parser.add_argument('--json', dest='json_path', help="Write the full report to this JSON file")
+    args = parser.parse_args()
+
+    if args.compare_tracking:
+        comparison = compare_tracking(args.recording, profile=args.profile, max_frames=args.max_frames,
+                                      detect_interval=args.detect_interval)
+        for key, value in comparison.items():
+            if key != 'summaries':
+                print(f"{key:>22}: {value}")
+        if args.json_path:
+            with open(args.json_path, 'w') as f:
+                json.dump(comparison, f, indent=2)
+            print(f"\nReport saved to {args.json_path}")
+        return
+
+    from apriltag_detector import ArUcoStateDetector
+
+    detector = ArUcoStateDetector(camera_id=args.recording, profile=args.profile)
+    detector.motion_prefilter_enabled = not args.no_prefilter
+    detector.tracking_enabled = not args.no_tracking
+    detector.tracking_detect_interval = args.detect_interval
+    report = run_replay(args.recording, detector=detector, realtime=args.realtime, max_frames=args.max_frames,
+                        every=max(1, args.every))
+
+    for transition in report['transitions']:
+        print(f"[{transition['media_time']:>9.3f}s] frame {transition['frame']:>6}: "
+              f"{transition['from']} -> {transition['to']}")
+    print()
+    for key, value in report['summary'].items():
+        print(f"{key:>16}: {value}")
+
+    if args.truth:
+        from synthetic_video import score_replay
+
+        with open(args.truth) as f:
+            truth = json.load(f)
+        report['score'] = score_replay(report, truth)
+        print()
+        for key, value in report['score'].items():
+            print(f"{key:>18}: {value}")
+
+    if args.json_path:
+        with open(args.json_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"\nReport saved to {args.json_path}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,491 @@
+import argparse
+import gzip
+import json
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+import urllib.request
+import uuid
+from concurrent.futures import Future
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, List, Optional, Tuple
+
+# Base URL of the central collector (e.g. http://central:8000); replication is off when unset
+REPLICATION_URL = os.getenv('REPLICATION_URL', '')
+REPLICATION_BATCH_SIZE = int(os.getenv('REPLICATION_BATCH_SIZE', '500'))
+NODE_ID = os.getenv('NODE_ID') or socket.gethostname()
+COLLECTOR_DATABASE_PATH = os.getenv('COLLECTOR_DATABASE_PATH', 'data/collector.db')
+
+INGEST_PATH = '/api/replication/ingest'
+STATE_COLUMNS = ('timestamp', 'state', 'description', 'tag_id', 'duration')
+
+class ReplicationShipper:
+    """
+    Edge side of store-and-forward replication.
+
+    Every state change is written to an outbox table in the same transaction as the
+    change itself, so nothing committed is lost when the collector or the network is
+    down. A background thread ships the outbox in gzip-compressed batches; the
+    collector acknowledges the highest sequence number it stored and only then are
+    those rows removed. After an outage shipping resumes from the first
+    unacknowledged row.
+
+    With partitioned storage the state row is written to the current partition and
+    the outbox row to the main database, and SQLite does not commit across attached
+    WAL databases atomically, so a crash can keep one without the other. The highest
+    enqueued id is therefore recorded next to the outbox, and on startup every row
+    from that id on is queued again; the collector upserts by id, so resending is
+    harmless.
+    """
+
+    def __init__(self, collector_url: str = REPLICATION_URL, node_id: str = NODE_ID,
+                 batch_size: int = REPLICATION_BATCH_SIZE, interval: float = 5.0,
+                 max_backoff: float = 300.0, timeout: float = 10.0):
+        """
+        Args:
+            collector_url: Base URL of the collector, or '' to disable replication
+            node_id: Name this box reports its rows under
+            batch_size: Maximum outbox rows per request
+            interval: Seconds between outbox checks when nothing new was written
+            max_backoff: Longest wait between retries while the collector is unreachable
+            timeout: Seconds to wait for the collector to answer
+        """
+        self.collector_url = collector_url.rstrip('/')
+        self.node_id = node_id
+        self.batch_size = batch_size
+        self.interval = interval
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.log_id = None
+        self._connect: Optional[Callable[[], sqlite3.Connection]] = None
+        self._thread = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self.acked_seq = 0
+        self.shipped_rows = 0
+        self.last_shipped = None
+        self.last_error = None
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.collector_url)
+
+    def install(self, connect: Callable[[], sqlite3.Connection],
+                connect_history: Optional[Callable[[Optional[int]], sqlite3.Connection]] = None):
+        """
+        Create the outbox tables and, the first time replication is enabled, queue the
+        existing history so the collector receives it too.
+
+        Args:
+            connect: Opens the database holding the outbox; used for every poll
+            connect_history: Opens a connection that also reads state_changes from the
+                given id on (None for all of it); defaults to connect
+        """
+        self._connect = connect
+        if not self.enabled:
+            return
+        if connect_history is None:
+            connect_history = lambda first_id: connect()
+        db = connect()
+        try:
+            db.execute('''
+                CREATE TABLE IF NOT EXISTS replication_outbox (
+                    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                    op TEXT NOT NULL,
+                    source_id INTEGER,
+                    payload TEXT
+                )
+            ''')
+            db.execute('CREATE TABLE IF NOT EXISTS replication_state (key TEXT PRIMARY KEY, value TEXT)')
+            db.commit()
+            row = db.execute("SELECT value FROM replication_state WHERE key = 'log_id'").fetchone()
+            self.log_id = row[0] if row is not None else None
+            row = db.execute("SELECT value FROM replication_state WHERE key = 'enqueued_id'").fetchone()
+            enqueued_id = int(row[0]) if row is not None else None
+        finally:
+            db.close()
+
+        if self.log_id is None:
+            # A new log id tells the collector the sequence numbers start over
+            self.log_id = uuid.uuid4().hex
+            db = connect_history(None)
+            try:
+                db.execute("INSERT INTO replication_state (key, value) VALUES ('log_id', ?)", (self.log_id,))
+                cursor = db.execute('SELECT id FROM state_changes ORDER BY id')
+                for (row_id,) in cursor.fetchall():
+                    self.enqueue(db, row_id)
+                db.commit()
+            finally:
+                db.close()
+        elif enqueued_id is not None:
+            db = connect_history(enqueued_id)
+            try:
+                self._reconcile(db, enqueued_id)
+                db.commit()
+            finally:
+                db.close()
+
+    def _reconcile(self, db, enqueued_id: int):
+        # The newest enqueued row may have had its duration updated since, and rows after
+        # it may have been committed without their outbox entries
+        cursor = db.execute('SELECT id FROM state_changes WHERE id >= ? ORDER BY id', (enqueued_id,))
+        for (row_id,) in cursor.fetchall():
+            self.enqueue(db, row_id)
+
+    def enqueue(self, db, row_id: int):
+        """
+        Add the current contents of a state_changes row to the outbox.
+
+        Call before committing the transaction that changed the row.
+        """
+        if not self.enabled:
+            return
+        row = db.execute(f"SELECT {', '.join(STATE_COLUMNS)} FROM state_changes WHERE id = ?", (row_id,)).fetchone()
+        if row is not None:
+            payload = json.dumps(dict(zip(STATE_COLUMNS, tuple(row))))
+            db.execute("INSERT INTO replication_outbox (op, source_id, payload) VALUES ('upsert', ?, ?)",
+                       (row_id, payload))
+            db.execute('''
+                INSERT INTO replication_state (key, value) VALUES ('enqueued_id', ?)
+                ON CONFLICT (key) DO UPDATE SET value = MAX(CAST(value AS INTEGER), excluded.value)
+            ''', (row_id,))
+
+    def enqueue_clear(self, db):
+        """Tell the collector that this box's history was deleted."""
+        if self.enabled:
+            db.execute("INSERT INTO replication_outbox (op) VALUES ('clear')")
+
+    def notify(self):
+        """Ship new outbox rows now instead of at the next interval."""
+        self._wake.set()
+
+    def pending(self) -> int:
+        if not self.enabled or self._connect is None:
+            return 0
+        db = self._connect()
+        try:
+            return db.execute('SELECT COUNT(*) FROM replication_outbox').fetchone()[0]
+        finally:
+            db.close()
+
+    def ship_once(self) -> int:
+        """
+        Send one batch of outbox rows and delete the acknowledged ones.
+
+        Returns:
+            Number of rows acknowledged by the collector
+        """
+        db = self._connect()
+        try:
+            rows = db.execute('SELECT seq, op, source_id, payload FROM replication_outbox ORDER BY seq LIMIT ?',
+                              (self.batch_size,)).fetchall()
+        finally:
+            db.close()
+        if not rows:
+            return 0
+
+        events = [{'seq': seq, 'op': op, 'source_id': source_id, 'row': json.loads(payload) if payload else None}
+                  for seq, op, source_id, payload in rows]
+        body = gzip.compress(json.dumps({'node_id': self.node_id, 'log_id': self.log_id, 'events': events}).encode())
+        request = urllib.request.Request(self.collector_url + INGEST_PATH, data=body, method='POST', headers={
+            'Content-Type': 'application/json',
+            'Content-Encoding': 'gzip'
+        })
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            acked_seq = int(json.loads(response.read())['acked_seq'])
+
+        db = self._connect()
+        try:
+            deleted = db.execute('DELETE FROM replication_outbox WHERE seq <= ?', (acked_seq,)).rowcount
+            db.commit()
+        finally:
+            db.close()
+        self.acked_seq = acked_seq
+        self.shipped_rows += deleted
+        self.last_shipped = time.time()
+        return deleted
+
+    def _run(self):
+        backoff = 0.0
+        while not self._stop.is_set():
+            try:
+                # Drain the backlog batch by batch, then wait for new rows
+                while self.ship_once() >= self.batch_size and not self._stop.is_set():
+                    pass
+                self.last_error = None
+                backoff = 0.0
+                wait = self.interval
+            except Exception as e:
+                self.last_error = str(e) or type(e).__name__
+                backoff = min(self.max_backoff, backoff * 2 if backoff else self.interval)
+                print(f"Replication to {self.collector_url} failed, retrying in {backoff:.0f}s: {self.last_error}")
+                wait = backoff
+            self._wake.wait(wait)
+            self._wake.clear()
+
+    def start(self):
+        """Start shipping in a background thread, if a collector is configured."""
+        if not self.enabled or self._connect is None or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='replication', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.timeout + 1)
+            self._thread = None
+
+    def status(self) -> Dict:
+        return {
+            'enabled': self.enabled,
+            'collector_url': self.collector_url or None,
+            'node_id': self.node_id,
+            'acked_seq': self.acked_seq,
+            'shipped_rows': self.shipped_rows,
+            'last_shipped': self.last_shipped,
+            'last_error': self.last_error
+        }
+
+def parse_batch(body: bytes, content_encoding: Optional[str] = None) -> Tuple[str, str, List[Dict]]:
+    """
+    Decode a batch sent by ReplicationShipper.
+
+    Returns:
+        Tuple of (node_id, log_id, events)
+
+    Raises:
+        ValueError: If the body is not a valid batch
+    """
+    try:
+        if content_encoding == 'gzip':
+            body = gzip.decompress(body)
+        batch = json.loads(body)
+        node_id, log_id, events = str(batch['node_id']), str(batch['log_id']), batch['events']
+        for event in events:
+            event['seq'] = int(event['seq'])
+            if event['op'] == 'upsert':
+                event['source_id'] = int(event['source_id'])
+                if not isinstance(event['row'], dict) or 'timestamp' not in event['row'] or 'state' not in event['row']:
+                    raise ValueError(f"incomplete row in event {event['seq']}")
+            elif event['op'] != 'clear':
+                raise ValueError(f"unknown op {event['op']!r}")
+    except (OSError, EOFError, KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"Invalid replication batch: {e}")
+    return node_id, log_id, events
+
+class CollectorStore:
+    """
+    Central side of replication: stores the state changes of every box in one database.
+
+    Batches from all machines go through a single writer thread that commits whatever
+    has queued up in one transaction (group commit), so hundreds of boxes shipping at
+    once cost a handful of fsyncs instead of one each. Rows are upserted on (node,
+    log, source id) and each node's highest stored sequence number is kept, so a
+    batch that is retried after a lost acknowledgment is not applied twice.
+    """
+
+    def __init__(self, db_path: str = COLLECTOR_DATABASE_PATH, max_group: int = 64):
+        """
+        Args:
+            db_path: SQLite file for the combined history
+            max_group: Maximum number of batches committed in one transaction
+        """
+        self.db_path = db_path
+        self.max_group = max_group
+        self._queue: queue.Queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self.batches = 0
+        self.transactions = 0
+        self.rows = 0
+
+    def connect(self) -> sqlite3.Connection:
+        db_dir = os.path.dirname(self.db_path)
+        if db_dir:
+            os.makedirs(db_dir, exist_ok=True)
+        db = sqlite3.connect(self.db_path)
+        db.row_factory = sqlite3.Row
+        return db
+
+    def _init(self, db):
+        db.execute('PRAGMA journal_mode=WAL')
+        db.execute('PRAGMA synchronous=NORMAL')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS fleet_state_changes (
+                node_id TEXT NOT NULL,
+                log_id TEXT NOT NULL,
+                source_id INTEGER NOT NULL,
+                timestamp TEXT NOT NULL,
+                state TEXT NOT NULL,
+                description TEXT,
+                tag_id INTEGER,
+                duration REAL,
+                PRIMARY KEY (node_id, log_id, source_id)
+            )
+        ''')
+        db.execute('CREATE INDEX IF NOT EXISTS idx_fleet_state_changes_timestamp ON fleet_state_changes (timestamp)')
+        db.execute('''
+            CREATE TABLE IF NOT EXISTS replication_nodes (
+                node_id TEXT PRIMARY KEY,
+                log_id TEXT NOT NULL,
+                last_seq INTEGER NOT NULL,
+                last_seen TEXT
+            )
+        ''')
+        db.commit()
+
+    def submit(self, node_id: str, log_id: str, events: List[Dict]) -> Future:
+        """Queue a parsed batch; the future resolves to the acknowledged sequence number."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='replication-collector', daemon=True)
+                self._thread.start()
+        future = Future()
+        self._queue.put((node_id, log_id, events, future))
+        return future
+
+    def ingest(self, node_id: str, log_id: str, events: List[Dict], timeout: Optional[float] = None) -> int:
+        """Store a batch and wait for it to be committed."""
+        return self.submit(node_id, log_id, events).result(timeout)
+
+    def _run(self):
+        db = self.connect()
+        self._init(db)
+        while True:
+            group = [self._queue.get()]
+            while len(group) < self.max_group:
+                try:
+                    group.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                acked = [self._apply(db, node_id, log_id, events) for node_id, log_id, events, _ in group]
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                for *_, future in group:
+                    future.set_exception(e)
+                continue
+            self.batches += len(group)
+            self.transactions += 1
+            for (*_, future), acked_seq in zip(group, acked):
+                future.set_result(acked_seq)
+
+    def _apply(self, db, node_id: str, log_id: str, events: List[Dict]) -> int:
+        node = db.execute('SELECT log_id, last_seq FROM replication_nodes WHERE node_id = ?', (node_id,)).fetchone()
+        last_seq = node['last_seq'] if node is not None and node['log_id'] == log_id else 0
+        upserts = []
+
+        def flush():
+            db.executemany('''
+                INSERT INTO fleet_state_changes (node_id, log_id, source_id, timestamp, state, description, tag_id, duration)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (node_id, log_id, source_id) DO UPDATE SET
+                    timestamp = excluded.timestamp, state = excluded.state, description = excluded.description,
+                    tag_id = excluded.tag_id, duration = excluded.duration
+            ''', upserts)
+            self.rows += len(upserts)
+            upserts.clear()
+
+        for event in events:
+            if event['seq'] <= last_seq:
+                continue  # Already stored; the previous acknowledgment was lost
+            if event['op'] == 'clear':
+                flush()
+                db.execute('DELETE FROM fleet_state_changes WHERE node_id = ?', (node_id,))
+            else:
+                row = event['row']
+                upserts.append((node_id, log_id, event['source_id'], row['timestamp'], row['state'],
+                                row.get('description'), row.get('tag_id'), row.get('duration')))
+        flush()
+
+        acked_seq = max([last_seq] + [event['seq'] for event in events])
+        db.execute('''
+            INSERT INTO replication_nodes (node_id, log_id, last_seq, last_seen) VALUES (?, ?, ?, ?)
+            ON CONFLICT (node_id) DO UPDATE SET
+                log_id = excluded.log_id, last_seq = excluded.last_seq, last_seen = excluded.last_seen
+        ''', (node_id, log_id, acked_seq, datetime.now().isoformat()))
+        return acked_seq
+
+    def nodes(self) -> List[Dict]:
+        """Replication progress of every node that has shipped data."""
+        if not os.path.exists(self.db_path):
+            return []
+        db = self.connect()
+        try:
+            self._init(db)
+            rows = db.execute('''
+                SELECT n.node_id, n.last_seq, n.last_seen, COUNT(f.source_id) AS rows
+                FROM replication_nodes n LEFT JOIN fleet_state_changes f ON f.node_id = n.node_id
+                GROUP BY n.node_id ORDER BY n.node_id
+            ''').fetchall()
+            return [dict(row) for row in rows]
+        finally:
+            db.close()
+
+    def stats(self) -> Dict:
+        return {
+            'batches': self.batches,
+            'transactions': self.transactions,
+            'rows': self.rows,
+            'queued': self._queue.qsize()
+        }
+
+shipper = ReplicationShipper()
+collector = CollectorStore()
+
+def serve_collector(store: CollectorStore, host: str, port: int):
+    """Run a standalone collector that accepts batches without the rest of the app."""
+    class IngestHandler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            if self.path != INGEST_PATH:
+                self._reply(404, {'error': 'Not found'})
+                return
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            try:
+                node_id, log_id, events = parse_batch(body, self.headers.get('Content-Encoding'))
+            except ValueError as e:
+                self._reply(400, {'error': str(e)})
+                return
+            self._reply(200, {'acked_seq': store.ingest(node_id, log_id, events)})
+
+        def do_GET(self):
+            self._reply(200, {'nodes': store.nodes(), 'stats': store.stats()})
+
+        def _reply(self, status: int, content: Dict):
+            body = json.dumps(content).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), IngestHandler)
+    print(f"Collecting state changes into {store.db_path} on http://{host}:{port}{INGEST_PATH}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Stand-in central collector for replicated state changes.")
+    parser.add_argument('--host', default='0.0.0.0', help="Address to listen on (default: 0.0.0.0)")
+    parser.add_argument('--port', type=int, default=8100, help="Port to listen on (default: 8100)")
+    parser.add_argument('--db', default=COLLECTOR_DATABASE_PATH, help="Collector database file")
+    args = parser.parse_args()
+    serve_collector(CollectorStore(args.db), args.host, args.port)
+
+if __name__ == "__main__":
+    main()
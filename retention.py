@@ -0,0 +1,457 @@
+import argparse
+import gzip
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+from history_cache import HISTORY_CACHE_DAYS
+from partitioned_store import PARTITION_DIR, PartitionedStore
+
+# Days of raw state transitions to keep; older ones are compacted into hourly rollups (0 disables)
+RETENTION_DAYS = float(os.getenv('RETENTION_DAYS', '400'))
+# Days hourly rollups are kept before they are merged into daily rollups
+ROLLUP_HOURLY_DAYS = float(os.getenv('ROLLUP_HOURLY_DAYS', '730'))
+# Directory for gzip-compressed JSON lines copies of compacted rows (disabled when empty)
+RETENTION_ARCHIVE_DIR = os.getenv('RETENTION_ARCHIVE_DIR', '')
+# Seconds between retention passes
+RETENTION_INTERVAL = float(os.getenv('RETENTION_INTERVAL', '3600'))
+
+# Tables holding raw transitions whose readers include rollups: state_changes (app.py).
+# machine_states (models.py) is left alone, since main.py's metrics only read raw rows.
+RETENTION_TABLES = ('state_changes',)
+
+SQL_TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+def create_tables(db):
+    """Create the rollup table, shared by every source table."""
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS state_rollups (
+            source TEXT NOT NULL,       -- Table the transitions came from
+            period TEXT NOT NULL,       -- 'hour' or 'day'
+            bucket TEXT NOT NULL,       -- UTC start of the hour or UTC date
+            day TEXT NOT NULL,          -- Local date of the transitions
+            state TEXT NOT NULL,
+            duration REAL NOT NULL,
+            transitions INTEGER NOT NULL,
+            PRIMARY KEY (source, period, bucket, day, state)
+        )
+    ''')
+    # Partitions already folded into rollups, written in the same transaction as their rollups
+    db.execute('''
+        CREATE TABLE IF NOT EXISTS compacted_partitions (
+            key TEXT PRIMARY KEY,
+            rows INTEGER NOT NULL,
+            compacted_at TEXT NOT NULL
+        )
+    ''')
+
+# Buckets follow the raw queries: they filter on datetime(timestamp) (UTC) but group days
+# by the date written in the timestamp, so buckets are UTC hours or days and each
+# rollup also records that local day
+_ROLLUP_FILTER = '''
+    source = ? AND (
+        (period = 'hour' AND bucket BETWEEN datetime(?) AND datetime(?))
+        OR (period = 'day' AND bucket BETWEEN date(?) AND date(?))
+    )
+'''
+
+def _filter_args(source: str, start_time: datetime, end_time: datetime) -> tuple:
+    start, end = start_time.isoformat(), end_time.isoformat()
+    return (source, start, end, start, end)
+
+def rollup_totals(db, source: str, start_time: datetime, end_time: datetime) -> Dict[str, float]:
+    """Seconds per state from compacted history between start_time and end_time."""
+    rows = db.execute(f'''
+        SELECT state, SUM(duration) FROM state_rollups WHERE {_ROLLUP_FILTER} GROUP BY state
+    ''', _filter_args(source, start_time, end_time)).fetchall()
+    return {state: float(total or 0) for state, total in rows}
+
+def rollup_daily_totals(db, source: str, start_time: datetime, end_time: datetime) -> Dict[str, Dict[str, float]]:
+    """Seconds per state for each day of compacted history between start_time and end_time."""
+    rows = db.execute(f'''
+        SELECT day, state, SUM(duration) FROM state_rollups WHERE {_ROLLUP_FILTER} GROUP BY day, state
+    ''', _filter_args(source, start_time, end_time)).fetchall()
+    days: Dict[str, Dict[str, float]] = defaultdict(dict)
+    for day, state, total in rows:
+        days[day][state] = float(total or 0)
+    return dict(days)
+
+def clear_rollups(db, source: str):
+    db.execute('DELETE FROM state_rollups WHERE source = ?', (source,))
+    if source == 'state_changes':
+        db.execute('DELETE FROM compacted_partitions')
+
+def _upsert_rollups(db, source: str, period: str, totals: Dict[tuple, List[float]]):
+    db.executemany('''
+        INSERT INTO state_rollups (source, period, bucket, day, state, duration, transitions)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        ON CONFLICT (source, period, bucket, day, state) DO UPDATE SET
+            duration = duration + excluded.duration,
+            transitions = transitions + excluded.transitions
+    ''', [(source, period, bucket, day, state, duration, int(transitions))
+          for (bucket, day, state), (duration, transitions) in totals.items()])
+
+class RetentionEngine:
+    """
+    Keeps the raw history bounded.
+
+    Transitions older than the retention window are folded into hourly rollups,
+    hourly rollups older than ROLLUP_HOURLY_DAYS into daily ones, and the freed pages
+    are returned with incremental vacuum. Everything happens in small chunks, each
+    its own short transaction with a pause after it, so the camera thread's writes
+    and dashboard reads are never held up for more than a few milliseconds.
+
+    With a partitioned store, state_changes is compacted a whole partition at a time
+    once its entire period is older than the retention window: its rows are folded
+    into rollups in the main database and the file is deleted. Past partitions are
+    attached read-only and immutable by readers, so they are never modified in place.
+    """
+
+    def __init__(self, days: float = RETENTION_DAYS, hourly_days: float = ROLLUP_HOURLY_DAYS,
+                 archive_dir: str = RETENTION_ARCHIVE_DIR, interval: float = RETENTION_INTERVAL,
+                 chunk_size: int = 500, pause: float = 0.2, vacuum_pages: int = 256):
+        """
+        Args:
+            days: Days of raw transitions to keep, at least the history cache window; 0 disables
+            hourly_days: Days hourly rollups are kept before merging into daily rollups
+            archive_dir: Where to write compacted rows as .jsonl.gz, or '' to not archive
+            interval: Seconds between passes
+            chunk_size: Rows compacted per transaction
+            pause: Seconds to sleep between chunks
+            vacuum_pages: Pages released per incremental_vacuum step
+        """
+        if days and days < HISTORY_CACHE_DAYS:
+            print(f"Retention window raised from {days:g} to {HISTORY_CACHE_DAYS:g} days to cover the history cache")
+            days = HISTORY_CACHE_DAYS
+        self.days = days
+        self.hourly_days = max(hourly_days, days)
+        self.archive_dir = archive_dir
+        self.interval = interval
+        self.chunk_size = chunk_size
+        self.pause = pause
+        self.vacuum_pages = vacuum_pages
+        self._connect: Optional[Callable[[], sqlite3.Connection]] = None
+        self._partition_store: Optional[PartitionedStore] = None
+        self._thread = None
+        self._stop = threading.Event()
+        self.compacted_rows = 0
+        self.merged_rollups = 0
+        self.vacuumed_pages = 0
+        self.compacted_partitions = 0
+        self.last_run = None
+        self.last_run_ms = None
+        self.last_error = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.days > 0
+
+    def install(self, connect: Callable[[], sqlite3.Connection],
+                partition_store: Optional[PartitionedStore] = None):
+        """
+        Create the rollup table so queries can include compacted history.
+
+        Args:
+            connect: Opens the main database
+            partition_store: Store holding state_changes when it is partitioned
+        """
+        self._connect = connect
+        self._partition_store = partition_store
+        db = connect()
+        try:
+            create_tables(db)
+            db.commit()
+        finally:
+            db.close()
+
+    def _cutoff(self, days: float) -> str:
+        return (datetime.now(timezone.utc) - timedelta(days=days)).strftime(SQL_TIME_FORMAT)
+
+    def _tables(self, db) -> List[str]:
+        rows = db.execute("SELECT name FROM sqlite_master WHERE type = 'table'").fetchall()
+        names = {row[0] for row in rows}
+        return [table for table in RETENTION_TABLES if table in names]
+
+    def _archive(self, table: str, rows: list):
+        by_month = defaultdict(list)
+        for row in rows:
+            by_month[str(row['timestamp'])[:7]].append(row)
+        os.makedirs(self.archive_dir, exist_ok=True)
+        for month, month_rows in by_month.items():
+            path = os.path.join(self.archive_dir, f"{table}-{month}.jsonl.gz")
+            # Each append adds a gzip member; gzip.open reads them back as one stream
+            with gzip.open(path, 'at') as f:
+                for row in month_rows:
+                    f.write(json.dumps({key: row[key] for key in
+                                        ('id', 'timestamp', 'state', 'description', 'tag_id', 'duration')}) + '\n')
+
+    def compact_chunk(self, table: str) -> int:
+        """
+        Fold up to chunk_size transitions older than the retention window into hourly rollups.
+
+        Returns:
+            Number of raw rows removed
+        """
+        db = self._connect()
+        try:
+            # The newest row is the state still in progress, so it is never compacted
+            rows = db.execute(f'''
+                SELECT id, timestamp, state, description, tag_id, duration,
+                       strftime('%Y-%m-%d %H:00:00', timestamp) AS hour, substr(timestamp, 1, 10) AS day
+                FROM {table}
+                WHERE datetime(timestamp) < datetime(?) AND id < (SELECT MAX(id) FROM {table})
+                ORDER BY id LIMIT ?
+            ''', (self._cutoff(self.days), self.chunk_size)).fetchall()
+            if not rows:
+                return 0
+            if self.archive_dir:
+                self._archive(table, rows)
+            totals = defaultdict(lambda: [0.0, 0])
+            for row in rows:
+                total = totals[(row['hour'], row['day'], row['state'])]
+                total[0] += float(row['duration'] or 0)
+                total[1] += 1
+            _upsert_rollups(db, table, 'hour', totals)
+            db.executemany(f'DELETE FROM {table} WHERE id = ?', [(row['id'],) for row in rows])
+            db.commit()
+            return len(rows)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def merge_chunk(self, table: str) -> int:
+        """
+        Merge up to chunk_size hourly rollups older than hourly_days into daily rollups.
+
+        Returns:
+            Number of hourly rollups merged
+        """
+        db = self._connect()
+        try:
+            rows = db.execute('''
+                SELECT rowid, bucket, day, state, duration, transitions FROM state_rollups
+                WHERE source = ? AND period = 'hour' AND bucket < ?
+                ORDER BY bucket LIMIT ?
+            ''', (table, self._cutoff(self.hourly_days), self.chunk_size)).fetchall()
+            if not rows:
+                return 0
+            totals = defaultdict(lambda: [0.0, 0])
+            for row in rows:
+                total = totals[(row['bucket'][:10], row['day'], row['state'])]
+                total[0] += row['duration']
+                total[1] += row['transitions']
+            _upsert_rollups(db, table, 'day', totals)
+            db.executemany('DELETE FROM state_rollups WHERE rowid = ?', [(row['rowid'],) for row in rows])
+            db.commit()
+            return len(rows)
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+
+    def expired_partitions(self) -> Dict[int, str]:
+        """Partitions whose whole period is older than the retention window, never the newest one."""
+        partitions = self._partition_store.partitions()
+        if not partitions:
+            return {}
+        cutoff = self._partition_store.period_index(self._cutoff(self.days))
+        newest = max(partitions)
+        return {index: path for index, path in partitions.items() if index < cutoff and index < newest}
+
+    def compact_partition(self, index: int, path: str) -> int:
+        """
+        Fold every transition of an expired partition into hourly rollups and delete its file.
+
+        Rows are read chunk_size at a time from a read-only connection; the rollups and
+        a compacted_partitions entry are then written in one transaction, so a partition
+        whose file outlives a crash is deleted on the next pass without being counted twice.
+
+        Returns:
+            Number of raw rows removed
+        """
+        key = self._partition_store.key(index)
+        db = self._connect()
+        try:
+            compacted = db.execute('SELECT 1 FROM compacted_partitions WHERE key = ?', (key,)).fetchone()
+            count = 0
+            if not compacted:
+                source = sqlite3.connect(f"file:{os.path.abspath(path)}?mode=ro", uri=True)
+                source.row_factory = sqlite3.Row
+                try:
+                    cursor = source.execute('''
+                        SELECT id, timestamp, state, description, tag_id, duration,
+                               strftime('%Y-%m-%d %H:00:00', timestamp) AS hour, substr(timestamp, 1, 10) AS day
+                        FROM state_changes ORDER BY id
+                    ''')
+                    totals = defaultdict(lambda: [0.0, 0])
+                    while True:
+                        if self._stop.is_set():
+                            return 0
+                        rows = cursor.fetchmany(self.chunk_size)
+                        if not rows:
+                            break
+                        if self.archive_dir:
+                            self._archive('state_changes', rows)
+                        for row in rows:
+                            total = totals[(row['hour'], row['day'], row['state'])]
+                            total[0] += float(row['duration'] or 0)
+                            total[1] += 1
+                        count += len(rows)
+                finally:
+                    source.close()
+                _upsert_rollups(db, 'state_changes', 'hour', totals)
+                db.execute('INSERT INTO compacted_partitions (key, rows, compacted_at) VALUES (?, ?, ?)',
+                           (key, count, datetime.now(timezone.utc).strftime(SQL_TIME_FORMAT)))
+                db.commit()
+        except Exception:
+            db.rollback()
+            raise
+        finally:
+            db.close()
+        # Readers that still have the file attached keep reading it until they close
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        return count
+
+    def vacuum_step(self) -> int:
+        """Release up to vacuum_pages free pages to the filesystem, if incremental vacuum is enabled."""
+        db = self._connect()
+        try:
+            if db.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                return 0
+            free = db.execute('PRAGMA freelist_count').fetchone()[0]
+            if not free:
+                return 0
+            # executescript steps the pragma to completion; execute() frees a single page
+            db.executescript(f'PRAGMA incremental_vacuum({self.vacuum_pages});')
+            return free - db.execute('PRAGMA freelist_count').fetchone()[0]
+        finally:
+            db.close()
+
+    def _chunks(self, step: Callable[[], int]) -> int:
+        done = 0
+        while not self._stop.is_set():
+            count = step()
+            done += count
+            if not count:
+                break
+            self._stop.wait(self.pause)
+        return done
+
+    def run_once(self) -> Dict:
+        """Run one full pass over every table and return what it did."""
+        start = time.perf_counter()
+        result = {'compacted_rows': 0, 'merged_rollups': 0, 'vacuumed_pages': 0}
+        db = self._connect()
+        try:
+            tables = self._tables(db)
+        finally:
+            db.close()
+        for table in tables:
+            result['compacted_rows'] += self._chunks(lambda: self.compact_chunk(table))
+            result['merged_rollups'] += self._chunks(lambda: self.merge_chunk(table))
+        if self._partition_store is not None:
+            result['compacted_partitions'] = 0
+            for index, path in self.expired_partitions().items():
+                if self._stop.is_set():
+                    break
+                result['compacted_rows'] += self.compact_partition(index, path)
+                result['compacted_partitions'] += 1
+                self._stop.wait(self.pause)
+            if 'state_changes' not in tables:
+                result['merged_rollups'] += self._chunks(lambda: self.merge_chunk('state_changes'))
+            self.compacted_partitions += result['compacted_partitions']
+        if result['compacted_rows'] or result['merged_rollups']:
+            result['vacuumed_pages'] = self._chunks(self.vacuum_step)
+        self.compacted_rows += result['compacted_rows']
+        self.merged_rollups += result['merged_rollups']
+        self.vacuumed_pages += result['vacuumed_pages']
+        self.last_run = time.time()
+        self.last_run_ms = round((time.perf_counter() - start) * 1000.0, 1)
+        return result
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                result = self.run_once()
+                self.last_error = None
+                if result['compacted_rows'] or result['merged_rollups']:
+                    print(f"[Retention] Compacted {result['compacted_rows']} transitions, "
+                          f"merged {result['merged_rollups']} hourly rollups, "
+                          f"released {result['vacuumed_pages']} pages")
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"[Retention] Error: {e}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        """Run retention passes in a background thread."""
+        if not self.enabled or self._connect is None or self._thread is not None:
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='retention', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def status(self) -> Dict:
+        return {
+            'enabled': self.enabled,
+            'raw_days': self.days,
+            'hourly_days': self.hourly_days,
+            'archive_dir': self.archive_dir or None,
+            'compacted_rows': self.compacted_rows,
+            'merged_rollups': self.merged_rollups,
+            'vacuumed_pages': self.vacuumed_pages,
+            'compacted_partitions': self.compacted_partitions if self._partition_store is not None else None,
+            'last_run': self.last_run,
+            'last_run_ms': self.last_run_ms,
+            'last_error': self.last_error
+        }
+
+retention_engine = RetentionEngine()
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact old state transitions into rollups.")
+    parser.add_argument('--db', default=os.getenv('DATABASE_PATH', 'machine_states.db'), help="Database file")
+    parser.add_argument('--days', type=float, default=RETENTION_DAYS, help="Days of raw transitions to keep")
+    parser.add_argument('--archive-dir', default=RETENTION_ARCHIVE_DIR, help="Write compacted rows here as .jsonl.gz")
+    parser.add_argument('--partition-dir', default=PARTITION_DIR,
+                        help="Partition directory, when state_changes is partitioned")
+    parser.add_argument('--enable-incremental-vacuum', action='store_true',
+                        help="Switch an existing database to incremental vacuum (runs a full VACUUM once)")
+    args = parser.parse_args()
+
+    def connect():
+        db = sqlite3.connect(args.db, timeout=30)
+        db.row_factory = sqlite3.Row
+        return db
+
+    if args.enable_incremental_vacuum:
+        db = connect()
+        try:
+            db.execute('PRAGMA auto_vacuum=INCREMENTAL')
+            db.execute('VACUUM')
+        finally:
+            db.close()
+        print(f"Incremental vacuum enabled for {args.db}")
+
+    engine = RetentionEngine(days=args.days, archive_dir=args.archive_dir, pause=0)
+    engine.install(connect, PartitionedStore(args.partition_dir, args.db) if args.partition_dir else None)
+    print(json.dumps(engine.run_once(), indent=2))
+
+if __name__ == "__main__":
+    main()
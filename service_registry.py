@@ -0,0 +1,164 @@
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List
+
+SERVICE_REGISTRY_FILE = "data/service_registry.json"
+# Seconds without a heartbeat after which a service is dropped
+SERVICE_TTL = float(os.getenv('SERVICE_TTL', '300'))
+
+class ServiceRegistry:
+    """
+    Registered services kept in memory and expired when their heartbeats stop.
+
+    Heartbeats only update a dict under a lock, so thousands per minute cost next to
+    nothing. A background thread drops expired services and, when something
+    changed, writes a snapshot to disk through a temporary file and os.replace, so
+    the file is never half-written and a restart picks up where it left off.
+    """
+
+    def __init__(self, path: str = SERVICE_REGISTRY_FILE, ttl: float = SERVICE_TTL, snapshot_interval: float = 10.0):
+        """
+        Args:
+            path: JSON snapshot file, in the same format as the old registry file
+            ttl: Seconds without a heartbeat after which a service expires
+            snapshot_interval: Seconds between expiry checks and snapshots
+        """
+        self.path = path
+        self.ttl = ttl
+        self.snapshot_interval = snapshot_interval
+        self._services: Dict[str, Dict] = {}
+        self._last_seen: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._dirty = False
+        self._thread = None
+        self._stop = threading.Event()
+        self.heartbeats = 0
+        self.snapshots = 0
+
+    def load(self) -> int:
+        """Restore services from the last snapshot, returning how many are still alive."""
+        try:
+            with open(self.path, 'r') as f:
+                services = json.load(f).get("services", [])
+        except (OSError, ValueError):
+            return 0
+        now = time.time()
+        with self._lock:
+            for service in services:
+                try:
+                    last_seen = datetime.fromisoformat(service["last_seen"]).timestamp()
+                except (KeyError, TypeError, ValueError):
+                    continue
+                if now - last_seen < self.ttl:
+                    self._services[service["id"]] = service
+                    self._last_seen[service["id"]] = last_seen
+            return len(self._services)
+
+    def heartbeat(self, service: Dict) -> Dict:
+        """Register a service or refresh it; fields not sent keep their previous values."""
+        return self.heartbeat_many([service])[0]
+
+    def heartbeat_many(self, services: Iterable[Dict]) -> List[Dict]:
+        """
+        Register or refresh several services at once.
+
+        Raises:
+            ValueError: If a service has no id
+        """
+        services = list(services)
+        if any(not isinstance(service, dict) or not service.get("id") for service in services):
+            raise ValueError("Every service needs an id")
+        now = time.time()
+        last_seen = datetime.fromtimestamp(now).isoformat()
+        updated = []
+        with self._lock:
+            for service in services:
+                service_id = str(service["id"])
+                entry = dict(self._services.get(service_id, {}))
+                entry.update(service)
+                entry.update(id=service_id, last_seen=last_seen)
+                self._services[service_id] = entry
+                self._last_seen[service_id] = now
+                updated.append(entry)
+            self._dirty = True
+            self.heartbeats += len(services)
+        return updated
+
+    def active(self) -> List[Dict]:
+        """Services that sent a heartbeat within the TTL."""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            return [dict(service) for service_id, service in self._services.items()
+                    if self._last_seen[service_id] > cutoff]
+
+    def expire(self) -> int:
+        """Drop services whose heartbeats stopped and return how many were removed."""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [service_id for service_id, seen in self._last_seen.items() if seen <= cutoff]
+            for service_id in expired:
+                del self._services[service_id]
+                del self._last_seen[service_id]
+            if expired:
+                self._dirty = True
+        return len(expired)
+
+    def snapshot(self, force: bool = False) -> bool:
+        """Write the registry to disk atomically if it changed since the last snapshot."""
+        with self._lock:
+            if not self._dirty and not force:
+                return False
+            services = list(self._services.values())
+            self._dirty = False
+        try:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({"services": services}, f, indent=2)
+            os.replace(tmp_path, self.path)
+            self.snapshots += 1
+            return True
+        except OSError as e:
+            print(f"Error saving service registry: {e}")
+            with self._lock:
+                self._dirty = True
+            return False
+
+    def _run(self):
+        while not self._stop.wait(self.snapshot_interval):
+            self.expire()
+            self.snapshot()
+
+    def start(self):
+        """Load the last snapshot and start the expiry/snapshot thread."""
+        if self._thread is not None:
+            return
+        self.load()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='service-registry', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread and write a final snapshot."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=self.snapshot_interval + 1)
+            self._thread = None
+        self.snapshot()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            services = len(self._services)
+        return {
+            'services': services,
+            'heartbeats': self.heartbeats,
+            'snapshots': self.snapshots,
+            'ttl_s': self.ttl
+        }
+
+service_registry = ServiceRegistry()
@@ -1,11 +1,36 @@
 import random
 import asyncio
-from datetime import datetime, timedelta
+import argparse
+import heapq
+import sqlite3
+import time
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from sqlalchemy import create_engine
 from sqlalchemy.orm import Session
-from models import MachineState, SessionLocal
+from models import Base, MachineState, SessionLocal, CST, init_db
+
+# app.py's state_changes table
+STATE_CHANGES_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS state_changes (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        timestamp TEXT NOT NULL,
+        state TEXT NOT NULL,
+        description TEXT,
+        tag_id INTEGER,
+        duration REAL
+    )
+'''
+
+@lru_cache(maxsize=None)
+def _cst_offset(epoch_hour: int) -> timezone:
+    """Fixed-offset timezone equal to CST/CDT during the given hour since the epoch."""
+    # Much cheaper than converting every timestamp through pytz
+    return timezone(datetime.fromtimestamp(epoch_hour * 3600, CST).utcoffset())
 
 class CNCSimulator:
-    def __init__(self):
+    def __init__(self, seed=None):
+        self.random = random.Random(seed)
         self.states = ['RUNNING', 'IDLE', 'ERROR']
         self.current_state = 'IDLE'
         self.state_probabilities = {
@@ -18,15 +43,26 @@ class CNCSimulator:
             'IDLE': (60, 900),         # 1 to 15 minutes
             'ERROR': (30, 300)         # 30 seconds to 5 minutes
         }
+        # Outside working hours machines mostly sit idle, with the odd unattended job
+        self.off_hours_probabilities = {
+            'IDLE': {'RUNNING': 0.15, 'IDLE': 0.8, 'ERROR': 0.05},
+            'RUNNING': {'IDLE': 0.9, 'ERROR': 0.1},
+            'ERROR': {'IDLE': 1.0}
+        }
+        self.off_hours_durations = {
+            'RUNNING': (600, 5400),    # 10 minutes to 1.5 hours
+            'IDLE': (1800, 7200),      # 30 minutes to 2 hours
+            'ERROR': (60, 900)         # 1 to 15 minutes
+        }
         self.descriptions = {
             'RUNNING': ['Normal operation', 'Production run', 'Processing job'],
             'IDLE': ['Waiting for operator', 'Job complete', 'Scheduled pause'],
             'ERROR': ['Emergency stop', 'Tool change needed', 'Temperature warning']
         }
 
-    def _get_next_state(self):
-        probabilities = self.state_probabilities[self.current_state]
-        rand = random.random()
+    def _get_next_state(self, probabilities=None):
+        probabilities = (probabilities or self.state_probabilities)[self.current_state]
+        rand = self.random.random()
         cumulative_prob = 0
         for state, prob in probabilities.items():
             cumulative_prob += prob
@@ -34,12 +70,50 @@ class CNCSimulator:
                 return state
         return list(probabilities.keys())[0]
 
-    def _get_duration(self, state):
-        min_duration, max_duration = self.state_durations[state]
-        return random.uniform(min_duration, max_duration)
+    def _get_duration(self, state, durations=None):
+        min_duration, max_duration = (durations or self.state_durations)[state]
+        return self.random.uniform(min_duration, max_duration)
 
     def _get_description(self, state):
-        return random.choice(self.descriptions[state])
+        return self.random.choice(self.descriptions[state])
+
+    def iter_history(self, start: datetime, end: datetime):
+        """
+        Generate state changes in simulated time, without sleeping.
+
+        Weekends and hours outside 7 AM - 5 PM use the off-hours probabilities and
+        durations. Staying in the same state extends the previous row's duration,
+        since the app only stores actual transitions.
+
+        Args:
+            start: Start of the simulated period (timezone-aware)
+            end: End of the simulated period (timezone-aware)
+
+        Yields:
+            (epoch seconds, CST datetime, state, duration, description)
+        """
+        current = start.timestamp()
+        end_ts = end.timestamp()
+        pending = None  # Row of the state in progress, yielded once the state changes
+        while current < end_ts:
+            local = datetime.fromtimestamp(current, _cst_offset(int(current // 3600)))
+            if local.weekday() < 5 and 7 <= local.hour < 17:
+                state = self._get_next_state()
+                duration = self._get_duration(state)
+            else:
+                state = self._get_next_state(self.off_hours_probabilities)
+                duration = self._get_duration(state, self.off_hours_durations)
+            duration = min(duration, end_ts - current)
+            self.current_state = state
+            if pending is not None and pending[2] == state:
+                pending[3] += duration
+            else:
+                if pending is not None:
+                    yield tuple(pending)
+                pending = [current, local, state, duration, self._get_description(state)]
+            current += duration
+        if pending is not None:
+            yield tuple(pending)
 
     async def generate_state(self):
         next_state = self._get_next_state()
@@ -56,6 +130,7 @@ class CNCSimulator:
         return state, duration
 
     async def run(self):
+        init_db()
         while True:
             state, duration = await self.generate_state()
             db = SessionLocal()
@@ -70,4 +145,97 @@ class CNCSimulator:
             finally:
                 db.close()
 
-simulator = CNCSimulator() 
\ No newline at end of file
+def generate_history(db_path: str, start: datetime, end: datetime, machines: int = 1, seed: int = 0,
+                     schema: str = 'state_changes', batch_size: int = 100000, max_rows: int = None) -> int:
+    """
+    Bulk-generate simulated history straight into a SQLite database.
+
+    Each machine runs its own seeded simulator and uses its number as the tag ID. Rows
+    from all machines are merged in time order and written with executemany in one
+    transaction per batch.
+
+    Args:
+        db_path: SQLite database file
+        start: Start of the simulated period (timezone-aware)
+        end: End of the simulated period (timezone-aware)
+        machines: Number of simulated machines
+        seed: Random seed; the same seed always produces the same history
+        schema: 'state_changes' (app.py) or 'machine_states' (models.py)
+        batch_size: Rows per transaction
+        max_rows: Stop after this many rows
+
+    Returns:
+        Number of rows written
+    """
+    if schema == 'state_changes':
+        create_tables = lambda: None
+        insert_sql = 'INSERT INTO state_changes (timestamp, state, description, tag_id, duration) VALUES (?, ?, ?, ?, ?)'
+        to_row = lambda tag_id, local, state, duration, description: (
+            local.isoformat(), state, description, tag_id, duration)
+    elif schema == 'machine_states':
+        # Let SQLAlchemy create the table so it matches the model exactly
+        create_tables = lambda: Base.metadata.create_all(bind=create_engine(f"sqlite:///{db_path}"))
+        insert_sql = 'INSERT INTO machine_states (timestamp, state, duration, description, tag_id) VALUES (?, ?, ?, ?, ?)'
+        # SQLAlchemy stores DateTime in SQLite as naive local time
+        to_row = lambda tag_id, local, state, duration, description: (
+            local.strftime('%Y-%m-%d %H:%M:%S.%f'), state, duration, description, tag_id)
+    else:
+        raise ValueError(f"Unknown schema: {schema}")
+
+    create_tables()
+    db = sqlite3.connect(db_path)
+    db.execute('PRAGMA journal_mode=WAL')
+    db.execute('PRAGMA synchronous=OFF')
+    if schema == 'state_changes':
+        db.execute(STATE_CHANGES_SCHEMA)
+
+    def machine_rows(machine: int):
+        simulator = CNCSimulator(seed=seed * 100003 + machine)
+        for ts, local, state, duration, description in simulator.iter_history(start, end):
+            yield ts, machine, local, state, duration, description
+
+    streams = [machine_rows(machine) for machine in range(1, machines + 1)]
+
+    written = 0
+    batch = []
+    try:
+        for ts, machine, local, state, duration, description in heapq.merge(*streams, key=lambda row: row[0]):
+            batch.append(to_row(machine, local, state, duration, description))
+            if max_rows is not None and written + len(batch) >= max_rows:
+                break
+            if len(batch) >= batch_size:
+                db.executemany(insert_sql, batch)
+                db.commit()
+                written += len(batch)
+                batch = []
+        if batch:
+            db.executemany(insert_sql, batch)
+            db.commit()
+            written += len(batch)
+    finally:
+        db.close()
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate simulated machine state history.")
+    parser.add_argument('--db', default='data/machine_states.db', help="SQLite database file (default: data/machine_states.db)")
+    parser.add_argument('--schema', choices=['state_changes', 'machine_states'], default='state_changes',
+                        help="Table layout to write (default: state_changes)")
+    parser.add_argument('--days', type=float, default=365, help="Days of history ending now (default: 365)")
+    parser.add_argument('--machines', type=int, default=1, help="Number of simulated machines (default: 1)")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed (default: 0)")
+    parser.add_argument('--max-rows', type=int, help="Stop after this many rows")
+    args = parser.parse_args()
+
+    end = datetime.now(CST)
+    start = end - timedelta(days=args.days)
+    began = time.perf_counter()
+    rows = generate_history(args.db, start, end, args.machines, args.seed, args.schema, max_rows=args.max_rows)
+    elapsed = time.perf_counter() - began
+    print(f"Wrote {rows} rows for {args.machines} machine(s) over {args.days} days to {args.db} "
+          f"in {elapsed:.1f}s ({rows / elapsed:.0f} rows/s)")
+
+simulator = CNCSimulator()
+
+if __name__ == "__main__":
+    main()
@@ -6,9 +6,14 @@ exec 2> >(tee -a /var/log/cnc-dashboard.error.log)
 
 echo "Starting CNC Dashboard service..."
 
-# Wait for network to be available
+# Wait for network to be available (up to 30 seconds)
 echo "Waiting for network..."
-sleep 30
+for i in $(seq 1 60); do
+    if ip route 2>/dev/null | grep -q '^default'; then
+        break
+    fi
+    sleep 0.5
+done
 
 # Navigate to the project directory
 echo "Navigating to project directory..."
@@ -23,6 +28,15 @@ echo "Starting Docker containers..."
 docker-compose down
 docker-compose up --build -d
 
+# Wait until the server answers; camera and database finish starting in the background
+echo "Waiting for the server..."
+for i in $(seq 1 120); do
+    if curl -fs http://localhost:8000/api/health > /dev/null; then
+        break
+    fi
+    sleep 0.5
+done
+
 # Print the URL
 IP=$(hostname -I | awk '{print $1}')
 echo "=================================================="
@@ -0,0 +1,194 @@
+import asyncio
+import json
+import os
+import threading
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, List, NamedTuple, Optional, Set
+
+from live_state import LiveStateStore, StateSnapshot, live_state
+
+# Seconds between duration ticks sent to stream subscribers
+STREAM_TICK_INTERVAL = float(os.getenv('STREAM_TICK_INTERVAL', '5'))
+# State changes kept for Last-Event-ID resume
+STREAM_HISTORY = int(os.getenv('STREAM_HISTORY', '256'))
+
+class StreamEvent(NamedTuple):
+    seq: int
+    data: Dict
+    payload: bytes  # Encoded once as a Server-Sent Event, shared by all subscribers
+
+def encode_event(event: str, data: Dict, event_id: Optional[int] = None) -> bytes:
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return ('\n'.join(lines) + '\n\n').encode()
+
+class Subscriber:
+    """One stream client: a bounded queue of encoded events, None meaning the stream ends."""
+
+    def __init__(self, queue_size: int):
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.last_seq = 0  # Last state change queued, so a resumed backlog is not sent twice
+
+    async def get(self) -> Optional[bytes]:
+        return await self.queue.get()
+
+class StateStreamHub:
+    """
+    Fans live state changes out to streaming clients.
+
+    Every snapshot published to the live state store is encoded once and kept in a
+    ring buffer keyed by its sequence number; subscribers only get a reference to
+    the same bytes, so a passive subscriber costs a queue slot. A reconnecting
+    client sends the last sequence it saw and is replayed the changes it missed
+    from the ring buffer, or just the current state if they are gone, without
+    touching the database. A client that falls behind is disconnected and resumes
+    the same way.
+
+    Coroutine listeners (the WebSocket broadcast) are run on the server's event loop
+    for every change, so the camera thread never waits on clients.
+    """
+
+    def __init__(self, store: LiveStateStore, history: int = STREAM_HISTORY,
+                 tick_interval: float = STREAM_TICK_INTERVAL, queue_size: int = 64):
+        """
+        Args:
+            store: Live state store to follow
+            history: Number of state changes kept for resume
+            tick_interval: Seconds between duration ticks (0 disables them)
+            queue_size: Events a subscriber may fall behind before it is disconnected
+        """
+        self.store = store
+        self.tick_interval = tick_interval
+        self.queue_size = queue_size
+        self._events: Deque[StreamEvent] = deque(maxlen=history)
+        self._lock = threading.Lock()
+        self._subscribers: Set[Subscriber] = set()
+        self._listeners: List[Callable[[Dict], Awaitable[None]]] = []
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._tick_task: Optional[asyncio.Task] = None
+        self.events_published = 0
+        self.resumes = 0
+        self.dropped_subscribers = 0
+        store.add_listener(self._on_snapshot)
+
+    def add_listener(self, callback: Callable[[Dict], Awaitable[None]]):
+        """Run callback(state dict) on the event loop for every state change."""
+        self._listeners.append(callback)
+
+    def start(self, loop: Optional[asyncio.AbstractEventLoop] = None):
+        """Attach to the server's event loop and start the duration ticks."""
+        self._loop = loop or asyncio.get_running_loop()
+        if self.tick_interval > 0 and self._tick_task is None:
+            self._tick_task = self._loop.create_task(self._tick())
+
+    def stop(self):
+        if self._tick_task is not None:
+            self._tick_task.cancel()
+            self._tick_task = None
+        for subscriber in list(self._subscribers):
+            self._close(subscriber)
+
+    def _on_snapshot(self, snapshot: StateSnapshot):
+        # Called from the publishing thread
+        data = snapshot.to_dict()
+        event = StreamEvent(snapshot.seq, data, encode_event('state', data, snapshot.seq))
+        with self._lock:
+            if self._events and snapshot.seq <= self._events[-1].seq:
+                self._events.clear()  # Sequence numbers restarted
+            self._events.append(event)
+        self.events_published += 1
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._fan_out, event)
+
+    def _fan_out(self, event: StreamEvent):
+        self._send(event.payload, event.seq)
+        for listener in self._listeners:
+            self._loop.create_task(self._run_listener(listener, event.data))
+
+    async def _run_listener(self, listener, data: Dict):
+        try:
+            await listener(data)
+        except Exception as e:
+            print(f"Error in state stream listener: {e}")
+
+    def _send(self, payload: bytes, seq: Optional[int] = None):
+        for subscriber in list(self._subscribers):
+            if seq is not None:
+                if seq <= subscriber.last_seq:
+                    continue
+                subscriber.last_seq = seq
+            try:
+                subscriber.queue.put_nowait(payload)
+            except asyncio.QueueFull:
+                self.dropped_subscribers += 1
+                self._close(subscriber)
+
+    def _close(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+        while not subscriber.queue.empty():
+            subscriber.queue.get_nowait()
+        subscriber.queue.put_nowait(None)
+
+    async def _tick(self):
+        while True:
+            await asyncio.sleep(self.tick_interval)
+            snapshot = self.store.get()
+            if snapshot is None or not self._subscribers:
+                continue
+            data = snapshot.to_dict()
+            self._send(encode_event('tick', {
+                "seq": snapshot.seq,
+                "state": snapshot.state,
+                "since": snapshot.since,
+                "duration": data["duration"]
+            }))
+
+    def subscribe(self, last_event_id: Optional[int] = None) -> Subscriber:
+        """
+        Register a subscriber on the running event loop.
+
+        Args:
+            last_event_id: Sequence number of the last state the client received, if resuming
+
+        Returns:
+            Subscriber whose queue starts with the missed changes, or the current state
+        """
+        if self._loop is None:
+            self.start()
+        subscriber = Subscriber(self.queue_size)
+        with self._lock:
+            events = list(self._events)
+        backlog = []
+        if last_event_id is not None and events and events[0].seq - 1 <= last_event_id <= events[-1].seq:
+            backlog = [(event.seq, event.payload) for event in events if event.seq > last_event_id]
+            subscriber.last_seq = last_event_id
+            self.resumes += 1
+        else:
+            snapshot = self.store.get()
+            if snapshot is not None:
+                backlog = [(snapshot.seq, encode_event('state', snapshot.to_dict(), snapshot.seq))]
+        for seq, payload in backlog[-self.queue_size:]:
+            subscriber.queue.put_nowait(payload)
+            subscriber.last_seq = seq
+        self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: Subscriber):
+        self._subscribers.discard(subscriber)
+
+    def subscriber_count(self) -> int:
+        return len(self._subscribers)
+
+    def stats(self) -> Dict:
+        return {
+            'subscribers': len(self._subscribers),
+            'buffered_events': len(self._events),
+            'events_published': self.events_published,
+            'resumes': self.resumes,
+            'dropped_subscribers': self.dropped_subscribers,
+            'tick_interval_s': self.tick_interval
+        }
+
+state_hub = StateStreamHub(live_state)
@@ -0,0 +1,151 @@
+import bisect
+import functools
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Callable, List, Optional, Sequence
+
+# Latency buckets in seconds, from sub-millisecond frame stages up to slow DB writes
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# All metrics in creation order, rendered by render()
+REGISTRY: List['_Metric'] = []
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class _Metric(ABC):
+    type_name = 'untyped'
+
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """Sample lines in the Prometheus text format."""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        lines.extend(self._samples())
+        return '\n'.join(lines)
+
+class Counter(_Metric):
+    """Monotonically increasing count, e.g. frames captured."""
+    type_name = 'counter'
+
+    def __init__(self, name: str, documentation: str):
+        super().__init__(name, documentation)
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def _samples(self) -> List[str]:
+        return [f"{self.name} {_format_value(self.value)}"]
+
+class Gauge(_Metric):
+    """
+    Value that goes up and down.
+
+    When a function is given it is only evaluated at scrape time, so gauges such as
+    queue depths cost nothing between scrapes.
+    """
+    type_name = 'gauge'
+
+    def __init__(self, name: str, documentation: str, function: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation)
+        self.value = 0.0
+        self.function = function
+
+    def set(self, value: float):
+        self.value = value
+
+    def inc(self, amount: float = 1.0):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def _samples(self) -> List[str]:
+        value = self.value
+        if self.function is not None:
+            try:
+                value = self.function()
+            except Exception:
+                value = float('nan')
+        return [f"{self.name} {_format_value(value) if value == value else 'NaN'}"]
+
+class _Timer:
+    def __init__(self, histogram: 'Histogram'):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.histogram.observe(time.perf_counter() - self.start)
+        return False
+
+class Histogram(_Metric):
+    """Distribution of durations (in seconds) over fixed buckets."""
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation)
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)  # Last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self) -> _Timer:
+        """Context manager that observes the duration of its block."""
+        return _Timer(self)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            counts = list(self.counts)
+            total, count = self.sum, self.count
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            lines.append(f'{self.name}_bucket{{le="{_format_value(bound)}"}} {cumulative}')
+        lines.append(f"{self.name}_sum {repr(total)}")
+        lines.append(f"{self.name}_count {count}")
+        return lines
+
+def timed(histogram: Histogram):
+    """Decorator that observes each call's duration in the histogram."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def render() -> str:
+    """Render all registered metrics in the Prometheus text exposition format."""
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
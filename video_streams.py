@@ -0,0 +1,233 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from typing import Awaitable, Callable, Dict, Iterator, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from executor import run_encode
+from overlay import draw_overlay
+from telemetry import Counter, Histogram
+
+JPEG_ENCODE_SECONDS = Histogram('cnc_jpeg_encode_seconds', 'Time spent JPEG-encoding video stream frames')
+FRAMES_STREAMED = Counter('cnc_frames_streamed_total', 'Frames sent to video stream clients')
+FRAMES_ENCODED = Counter('cnc_frames_encoded_total', 'Video frames JPEG-encoded, once per variant and frame')
+MOSAIC_FRAMES = Counter('cnc_mosaic_frames_total', 'Mosaic frames composited')
+
+# Output width of each stream variant; None keeps the camera resolution
+VARIANT_WIDTHS = {'thumb': 320, 'medium': 640, 'full': None}
+VARIANT_QUALITY = {'thumb': 70, 'medium': 80, 'full': 95}
+# Seconds between mosaic frames
+MOSAIC_INTERVAL = float(os.getenv('MOSAIC_INTERVAL', '1.0'))
+MOSAIC_TILE_SIZE = (320, 180)
+
+def multipart_chunk(jpeg: bytes) -> bytes:
+    return b'--frame\r\nContent-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n'
+
+def resize_to_width(frame, width: Optional[int]):
+    if width is None or frame.shape[1] <= width:
+        return frame
+    height = max(1, round(frame.shape[0] * width / frame.shape[1]))
+    return cv2.resize(frame, (width, height), interpolation=cv2.INTER_AREA)
+
+class VideoStreams:
+    """
+    Latest camera frame and its JPEG variants for every video viewer.
+
+    The camera thread publishes each captured frame with a sequence number. A
+    variant (thumb, medium, full, with or without the detection overlay) is drawn,
+    scaled and encoded the first time a viewer asks for it for that frame; every
+    other viewer of the same variant gets the same bytes. Nothing is encoded for
+    variants nobody watches.
+    """
+
+    def __init__(self):
+        self._ready = threading.Condition()
+        self._frame = None
+        self._result = None
+        self.seq = 0  # Increases with every published frame
+        self._encoded: Dict[Tuple[str, bool], Tuple[int, bytes]] = {}
+        self._encode_locks: Dict[Tuple[str, bool], threading.Lock] = {
+            (variant, overlay): threading.Lock() for variant in VARIANT_WIDTHS for overlay in (True, False)
+        }
+        self._overlaid: Tuple[int, Optional[np.ndarray]] = (0, None)
+        self._overlay_lock = threading.Lock()
+        # Distinguishes sequence numbers of this run from those before a restart
+        self.epoch = format(int(time.time() * 1000), 'x')
+
+    def publish(self, frame):
+        """Make frame the latest one; it must not be modified afterwards."""
+        with self._ready:
+            self._frame = frame
+            self.seq += 1
+            self._ready.notify_all()
+
+    def set_result(self, result):
+        """Detection result drawn on frames from now on."""
+        self._result = result
+
+    def wait(self, after_seq: int, timeout: float = 1.0) -> int:
+        """Block until a frame newer than after_seq exists; returns the latest sequence number."""
+        with self._ready:
+            if self.seq == after_seq or self._frame is None:
+                self._ready.wait(timeout)
+            return self.seq if self._frame is not None else after_seq
+
+    def _overlay_frame(self, seq: int, frame):
+        # The overlay is drawn once per frame and shared by all overlaid variants
+        with self._overlay_lock:
+            if self._overlaid[0] != seq:
+                overlaid = frame.copy()
+                if self._result is not None:
+                    draw_overlay(overlaid, self._result)
+                self._overlaid = (seq, overlaid)
+            return self._overlaid[1]
+
+    def jpeg(self, variant: str = 'full', overlay: bool = True) -> Optional[Tuple[int, bytes]]:
+        """
+        Latest frame as a JPEG of the given variant, encoded at most once per frame.
+
+        Returns:
+            (sequence number, JPEG bytes), or None before the first frame
+        """
+        key = (variant, overlay)
+        with self._encode_locks[key]:
+            with self._ready:
+                seq, frame = self.seq, self._frame
+            if frame is None:
+                return None
+            cached = self._encoded.get(key)
+            if cached is not None and cached[0] == seq:
+                return cached
+            image = self._overlay_frame(seq, frame) if overlay else frame
+            image = resize_to_width(image, VARIANT_WIDTHS[variant])
+            with JPEG_ENCODE_SECONDS.time():
+                ok, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, VARIANT_QUALITY[variant]])
+            if not ok:
+                return cached
+            FRAMES_ENCODED.inc()
+            self._encoded[key] = (seq, buffer.tobytes())
+            return self._encoded[key]
+
+    def etag(self, seq: int, variant: str, overlay: bool) -> str:
+        return f'"{self.epoch}-{seq}-{variant}{"-overlay" if overlay else ""}"'
+
+    def current_etag(self, variant: str, overlay: bool) -> Optional[str]:
+        """ETag the latest frame would be served with, without encoding it."""
+        with self._ready:
+            if self._frame is None:
+                return None
+            return self.etag(self.seq, variant, overlay)
+
+    def stream(self, variant: str = 'full', overlay: bool = True) -> Iterator[bytes]:
+        """MJPEG multipart chunks of one variant, one per new frame."""
+        sent_seq = 0
+        while True:
+            try:
+                seq = self.wait(sent_seq)
+                if seq == sent_seq:
+                    continue
+                encoded = self.jpeg(variant, overlay)
+                if encoded is None:
+                    continue
+                sent_seq = encoded[0]
+                FRAMES_STREAMED.inc()
+                yield multipart_chunk(encoded[1])
+            except Exception as e:
+                print(f"Error generating frame: {e}")
+                time.sleep(0.01)
+
+def compose_mosaic(tiles: List[Tuple[str, Optional[bytes]]], tile_size: Tuple[int, int] = MOSAIC_TILE_SIZE):
+    """
+    Lay JPEG thumbnails out on a grid, labelled with their names.
+
+    Args:
+        tiles: (label, JPEG bytes or None for an unavailable camera)
+        tile_size: (width, height) of each cell
+
+    Returns:
+        BGR image
+    """
+    width, height = tile_size
+    columns = max(1, math.ceil(math.sqrt(len(tiles))))
+    rows = max(1, math.ceil(len(tiles) / columns))
+    mosaic = np.zeros((rows * height, columns * width, 3), dtype=np.uint8)
+    for i, (label, jpeg) in enumerate(tiles):
+        x, y = (i % columns) * width, (i // columns) * height
+        image = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR) if jpeg else None
+        if image is not None:
+            mosaic[y:y + height, x:x + width] = cv2.resize(image, tile_size, interpolation=cv2.INTER_AREA)
+        else:
+            mosaic[y:y + height, x:x + width] = 40
+            cv2.putText(mosaic, "No video", (x + 10, y + height // 2), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 255), 1)
+        cv2.rectangle(mosaic, (x, y + height - 22), (x + width - 1, y + height - 1), (0, 0, 0), -1)
+        cv2.putText(mosaic, str(label)[:32], (x + 5, y + height - 6), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 255, 255), 1)
+    return mosaic
+
+class MosaicStream:
+    """
+    One low-rate stream combining the latest thumbnail of every camera.
+
+    A single task, running only while someone is watching, collects the thumbnails
+    every interval, composites and encodes them once, and all viewers are sent
+    the same JPEG.
+    """
+
+    def __init__(self, collect: Callable[[], Awaitable[List[Tuple[str, Optional[bytes]]]]],
+                 interval: float = MOSAIC_INTERVAL):
+        """
+        Args:
+            collect: Coroutine function returning (label, JPEG bytes or None) per camera
+            interval: Seconds between mosaic frames
+        """
+        self.collect = collect
+        self.interval = interval
+        self.viewers = 0
+        self.seq = 0
+        self.jpeg: Optional[bytes] = None
+        self._updated: Optional[asyncio.Condition] = None
+        self._task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _encode(tiles) -> Optional[bytes]:
+        ok, buffer = cv2.imencode('.jpg', compose_mosaic(tiles), [cv2.IMWRITE_JPEG_QUALITY, VARIANT_QUALITY['medium']])
+        return buffer.tobytes() if ok else None
+
+    async def _run(self):
+        while self.viewers > 0:
+            start = time.monotonic()
+            try:
+                tiles = await self.collect()
+                jpeg = await run_encode(self._encode, tiles)
+                if jpeg is not None:
+                    MOSAIC_FRAMES.inc()
+                    async with self._updated:
+                        self.jpeg = jpeg
+                        self.seq += 1
+                        self._updated.notify_all()
+            except Exception as e:
+                print(f"Error composing mosaic: {e}")
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - start)))
+
+    async def stream(self):
+        """MJPEG multipart chunks of the mosaic for one viewer."""
+        if self._updated is None:
+            self._updated = asyncio.Condition()
+        self.viewers += 1
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._run())
+        sent_seq = 0
+        try:
+            while True:
+                async with self._updated:
+                    await self._updated.wait_for(lambda: self.seq != sent_seq)
+                    sent_seq, jpeg = self.seq, self.jpeg
+                FRAMES_STREAMED.inc()
+                yield multipart_chunk(jpeg)
+        finally:
+            self.viewers -= 1
+
+video_streams = VideoStreams()
@@ -0,0 +1,95 @@
+import json
+from typing import Dict, Iterable, List, Optional, Sequence
+
+try:
+    import msgpack
+except ImportError:  # The binary protocol is optional; JSON clients work without it
+    msgpack = None
+
+# WebSocket subprotocol a client requests to receive MessagePack frames instead of JSON
+BINARY_SUBPROTOCOL = 'cnc.msgpack.v1'
+
+# Position in this list is the state code sent on the wire
+STATES = ['IDLE', 'RUNNING', 'ERROR', 'OFFLINE', 'UNKNOWN', 'UNREACHABLE']
+STATE_CODES = {state: code for code, state in enumerate(STATES)}
+
+# Frame types, the first element of every binary frame
+MSG_HELLO = 0    # [0, {"v": 1, "states": [...], "machines": [[machine_id, node_id, name], ...]}]
+MSG_UPDATES = 1  # [1, [[machine_id, state_code, since_ms, seq, tag_id], ...]]
+MSG_GET_STATE = 2  # [2], sent by clients; same as the text message "get_state"
+
+def binary_available() -> bool:
+    return msgpack is not None
+
+def wants_binary(subprotocols: Sequence[str]) -> bool:
+    """Whether a connecting client asked for the binary protocol and it can be served."""
+    return binary_available() and BINARY_SUBPROTOCOL in subprotocols
+
+def state_code(state: Optional[str]) -> int:
+    return STATE_CODES.get(state, STATE_CODES['UNKNOWN'])
+
+def make_update(machine_id: int, state: Dict) -> list:
+    """Compact update from a live state dict as returned by /api/state."""
+    since = state.get('since')
+    return [
+        machine_id,
+        state_code(state.get('state')),
+        int(since * 1000) if since is not None else None,
+        state.get('seq'),
+        state.get('last_tag_id')
+    ]
+
+class Frame:
+    """
+    One message for many clients, encoded at most once per protocol.
+
+    The same frame goes to every connection, so the JSON text and the MessagePack
+    bytes are each built on first use and then shared.
+    """
+
+    def __init__(self, message: list):
+        self.message = message
+        self._binary: Optional[bytes] = None
+        self._text: Optional[str] = None
+
+    @classmethod
+    def hello(cls, machines: Iterable[Sequence]) -> 'Frame':
+        return cls([MSG_HELLO, {'v': 1, 'states': STATES, 'machines': [list(m) for m in machines]}])
+
+    @classmethod
+    def updates(cls, updates: List[list]) -> 'Frame':
+        return cls([MSG_UPDATES, updates])
+
+    def binary(self) -> bytes:
+        if self._binary is None:
+            self._binary = msgpack.packb(self.message, use_bin_type=True)
+        return self._binary
+
+    def text(self) -> str:
+        """JSON form: the same arrays, so clients can share one decoder for both."""
+        if self._text is None:
+            self._text = json.dumps(self.message, separators=(',', ':'))
+        return self._text
+
+    async def send(self, websocket, binary: bool):
+        if binary:
+            await websocket.send_bytes(self.binary())
+        else:
+            await websocket.send_text(self.text())
+
+def decode(data: bytes) -> list:
+    """Decode a binary frame (for clients and scripts)."""
+    return msgpack.unpackb(data, raw=False)
+
+def is_get_state(message: Dict) -> bool:
+    """Whether a received WebSocket message asks for the current state, in either protocol."""
+    if message.get('text') == 'get_state':
+        return True
+    data = message.get('bytes')
+    if data and msgpack is not None:
+        try:
+            decoded = msgpack.unpackb(data, raw=False)
+        except Exception:
+            return False
+        return isinstance(decoded, list) and decoded[:1] == [MSG_GET_STATE]
+    return False